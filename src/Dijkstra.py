@@ -1,10 +1,13 @@
-from Dijkstra_Forward_Search.maze_environment import load_level, show_level, save_level_costs
+from Dijkstra_Forward_Search.maze_environment import load_level, show_level, save_level_costs, grid_cell, grid_position, \
+    load_grid, save_grid_costs
 from math import inf, sqrt
 from heapq import heappop, heappush
+import numpy
+from nm_openlist import HeapQueue
 from nm_pathfinder import heuristic
 
 
-def dijkstras_shortest_path(initial_position, destination, graph, adj):
+def dijkstras_shortest_path(initial_position, destination, graph, adj, stats=None, open_list=None):
     """ Searches for a minimal cost path through a graph using Dijkstra's algorithm.
 
     Args:
@@ -12,6 +15,9 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         destination: The end location for the path.
         graph: A loaded level, containing walls, spaces, and waypoints.
         adj: An adjacency function returning cells adjacent to a given cell as well as their respective edge costs.
+        stats: An optional nm_pathfinder.SearchStats, reset and filled in for this search.
+        open_list: An optional empty open list from nm_openlist, a HeapQueue by
+            default. Costs only grow, so a RadixHeap works too.
 
     Returns:
         If a path exits, return a list containing all cells from initial_position to destination.
@@ -20,13 +26,19 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
     """
     paths = {initial_position: []}          # maps cells to previous cells on path
     pathcosts = {initial_position: 0}       # maps cells to their pathcosts (found so far)
-    queue = []
+    queue = HeapQueue() if open_list is None else open_list
+    push, pop = queue.push, queue.pop
+    if stats is not None:
+        stats.reset()
+        push, pop = stats.open_list(push, pop, queue.__len__)
     #replaced 0 with heuristic function
-    heappush(queue, (heuristic(initial_position, destination), initial_position))  # maintain a priority queue of cells
+    push(heuristic(initial_position, destination), initial_position)  # maintain a priority queue of cells
 
     while queue:
-        priority, cell = heappop(queue)
+        priority, cell = pop()
         if cell == destination:
+            if stats is not None:
+                stats.finish(True)
             return path_to_cell(cell, paths)
         
         # investigate children
@@ -36,10 +48,109 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
             if child not in pathcosts or cost_to_child < pathcosts[child]:
                 pathcosts[child] = cost_to_child            # update the cost
                 paths[child] = cell                         # set the backpointer
-                heappush(queue, (cost_to_child, child))     # put the child on the priority queue
+                push(cost_to_child, child)                  # put the child on the priority queue
             
+    if stats is not None:
+        stats.finish(False)
     return False
 
+def grid_dijkstras_shortest_path(initial_position, destination, grid, open_list=None):
+    """ Searches for a minimal cost path through a grid using Dijkstra's algorithm.
+
+    Finds the same paths as dijkstras_shortest_path with navigation_edges, but
+    over the arrays of a grid from load_grid: each expanded cell looks up all
+    eight neighbors and their edge costs at once.
+
+    Args:
+        initial_position: The initial (i, j) cell from which the path extends.
+        destination: The (i, j) end location for the path.
+        grid: A loaded grid, containing costs, walls, and waypoints.
+        open_list: An optional empty open list from nm_openlist, as grid_dijkstra takes.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    start = grid_cell(grid, initial_position)
+    goal = grid_cell(grid, destination)
+    pathcosts, paths = grid_dijkstra(grid, [(heuristic(initial_position, destination), start)], goal, open_list)
+    if pathcosts[goal] == inf:
+        return False
+    path = [goal]
+    while paths[path[-1]] >= 0:
+        path.append(paths[path[-1]].item())
+    return [grid_position(grid, cell) for cell in reversed(path)]
+
+def grid_distance_map(initial_positions, grid, out=None, open_list=None):
+    """ Computes the minimal path cost to every cell of a grid from the nearest of several cells.
+
+    Args:
+        initial_positions: The (i, j) cells the costs are measured from, e.g. spawn waypoints.
+        grid: A loaded grid, containing costs, walls, and waypoints.
+        out: An optional (width, height) array to fill, such as a memmap from
+            numpy.lib.format.open_memmap; a new float64 array by default.
+        open_list: An optional empty open list from nm_openlist, as grid_dijkstra takes.
+
+    Returns:
+        The dense (width, height) array of path costs indexed [i, j], inf where no path exists.
+
+    """
+    width, height = grid['shape']
+    pathcosts, _ = grid_dijkstra(grid, [(0., grid_cell(grid, position)) for position in initial_positions],
+                                 open_list=open_list)
+    if out is None:
+        out = numpy.empty((width, height))
+    out[...] = pathcosts.reshape(width + 2, height + 2)[1:-1, 1:-1]
+    return out
+
+def grid_dijkstra(grid, seeds, goal=None, open_list=None):
+    """ Runs Dijkstra's algorithm over a grid's linear cells.
+
+    Each expanded cell looks up all eight neighbors and their edge costs at once.
+
+    Args:
+        grid: A loaded grid, containing costs, walls, and waypoints.
+        seeds: (initial cost, linear cell) pairs the search starts from.
+        goal: An optional linear cell; the search stops once it is reached.
+        open_list: An optional empty open list from nm_openlist, a HeapQueue by
+            default. Costs only grow, so a RadixHeap works too.
+
+    Returns:
+        The flat arrays of path costs (inf where unreached) and previous cells
+        (-1 at seeds and unreached cells) over the padded grid.
+
+    """
+    offsets, rows, shifts = grid['neighbors']
+    edge_costs = grid['edge_costs']
+    paths = numpy.full(edge_costs.shape[1], -1, dtype=numpy.int64)   # maps cells to previous cells on path
+    pathcosts = numpy.full(edge_costs.shape[1], inf)                # maps cells to their pathcosts (found so far)
+    queue = HeapQueue() if open_list is None else open_list
+    for cost, cell in seeds:
+        if cost < pathcosts[cell]:
+            pathcosts[cell] = cost
+            queue.push(cost, cell)
+
+    while queue:
+        priority, cell = queue.pop()
+        if cell == goal:
+            break
+        if priority > pathcosts[cell]:
+            continue        # already expanded at a lower cost
+
+        # investigate all children at once; blocked ones cost inf and never improve
+        children = cell + offsets
+        costs_to_children = priority + edge_costs[rows, cell + shifts]
+        improved = costs_to_children < pathcosts[children]
+        if improved.any():
+            children, costs_to_children = children[improved], costs_to_children[improved]
+            pathcosts[children] = costs_to_children
+            paths[children] = cell
+            for cost_to_child, child in zip(costs_to_children.tolist(), children.tolist()):
+                queue.push(cost_to_child, child)
+
+    return pathcosts, paths
+
 def transition_cost(level, cell, cell2):
     distance = sqrt((cell2[0] - cell[0])**2 + (cell2[1] - cell[1])**2)
     average_cost = (level['spaces'][cell] + level['spaces'][cell2])/2
@@ -77,6 +188,140 @@ def navigation_edges(level, cell):
             res.append((new, transition_cost(level, new, cell)))
     return res
 
+DIRECTIONS = [(x, y) for x in [-1,0,1] for y in [-1,0,1] if not (x==0 and y==0)]
+
+def jump_point_search(initial_position, destination, graph):
+    """ Searches for a minimal cost path through a level using Jump Point Search.
+
+    Moves are the same as navigation_edges allows, diagonals past wall corners
+    included. Where every cell around a cell has the same cost, the search
+    jumps along straight and diagonal lines instead of expanding each cell,
+    stopping only at cells with a forced neighbor (one that is only reached
+    optimally through this cell because of a wall). Cells next to a cell of a
+    different cost stop a jump and are expanded in all eight directions, as
+    ordinary Dijkstra would.
+
+    Args:
+        initial_position: The initial cell from which the path extends.
+        destination: The end location for the path.
+        graph: A loaded level, containing walls, spaces, and waypoints.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    spaces = graph['spaces']
+    uniform = {}
+
+    def is_uniform(cell):
+        # every open neighbor costs the same as cell
+        found = uniform.get(cell)
+        if found is None:
+            (x, y), cost, get = cell, spaces[cell], spaces.get
+            found = uniform[cell] = (get((x - 1, y - 1), cost) == cost and get((x - 1, y), cost) == cost and
+                                     get((x - 1, y + 1), cost) == cost and get((x, y - 1), cost) == cost and
+                                     get((x, y + 1), cost) == cost and get((x + 1, y - 1), cost) == cost and
+                                     get((x + 1, y), cost) == cost and get((x + 1, y + 1), cost) == cost)
+        return found
+
+    def forced(cell, direction):
+        # neighbors that only become reachable optimally through cell, given a wall beside the move
+        (x, y), (dx, dy) = cell, direction
+        res = []
+        if dx and dy:
+            if (x - dx, y) not in spaces and (x - dx, y + dy) in spaces:
+                res.append((-dx, dy))
+            if (x, y - dy) not in spaces and (x + dx, y - dy) in spaces:
+                res.append((dx, -dy))
+        elif dx:
+            for side in [-1, 1]:
+                if (x, y + side) not in spaces and (x + dx, y + side) in spaces:
+                    res.append((dx, side))
+        else:
+            for side in [-1, 1]:
+                if (x + side, y) not in spaces and (x + side, y + dy) in spaces:
+                    res.append((side, dy))
+        return res
+
+    def stops(cell, direction):
+        return cell == destination or not is_uniform(cell) or forced(cell, direction)
+
+    targets = {}    # maps (cell, direction) to where a jump from there stops, or None
+
+    def target(cell, direction):
+        # where a jump from cell stops; the answer holds for every cell along its ray, so each ray is walked once
+        dx, dy = direction
+        ray = []
+        while (cell, direction) not in targets:
+            ray.append(cell)
+            cell = (cell[0] + dx, cell[1] + dy)
+            if cell not in spaces:
+                found = None
+                break
+            if stops(cell, direction) or (dx and dy and (target(cell, (dx, 0)) is not None or
+                                                         target(cell, (0, dy)) is not None)):
+                found = cell
+                break
+        else:
+            found = targets[cell, direction]
+        for cell in ray:
+            targets[cell, direction] = found
+        return found
+
+    def jump(cell, direction, cost):
+        # follows direction from cell to the next cell worth expanding, with its path cost
+        end = target(cell, direction)
+        if end is None:
+            return None
+        dx, dy = direction
+        distance = sqrt(dx**2 + dy**2)
+        while cell != end:
+            new = (cell[0] + dx, cell[1] + dy)
+            cost = cost + distance * ((spaces[new] + spaces[cell]) / 2)
+            cell = new
+        return cell, cost
+
+    def successors(cell, direction):
+        if direction is None or not is_uniform(cell):
+            return DIRECTIONS
+        dx, dy = direction
+        if dx and dy:
+            return [(dx, 0), (0, dy), (dx, dy)] + forced(cell, direction)
+        return [direction] + forced(cell, direction)
+
+    paths = {initial_position: []}          # maps jump points to previous jump points on path
+    pathcosts = {initial_position: 0}       # maps jump points to their pathcosts (found so far)
+    directions = {initial_position: None}   # maps jump points to the direction they were reached in
+    queue = []
+    heappush(queue, (0, initial_position))
+
+    while queue:
+        priority, cell = heappop(queue)
+        if cell == destination:
+            jump_points = path_to_cell(cell, paths)
+            path = [initial_position]
+            for target in jump_points[1:]:
+                while path[-1] != target:
+                    path.append((path[-1][0] + (target[0] > path[-1][0]) - (target[0] < path[-1][0]),
+                                 path[-1][1] + (target[1] > path[-1][1]) - (target[1] < path[-1][1])))
+            return path
+        if priority > pathcosts[cell]:
+            continue
+
+        for direction in successors(cell, directions[cell]):
+            found = jump(cell, direction, priority)
+            if found is None:
+                continue
+            child, cost_to_child = found
+            if child not in pathcosts or cost_to_child < pathcosts[child]:
+                pathcosts[child] = cost_to_child
+                paths[child] = cell
+                directions[child] = direction
+                heappush(queue, (cost_to_child, child))
+
+    return False
+
 
 
 
@@ -106,6 +351,20 @@ def test_route(filename, src_waypoint, dst_waypoint):
         print("No path possible!")
 
 
+def test_distance_map(filename, src_waypoints, output='distance_map.csv'):
+    """ Loads a level as a grid and saves the path cost from the nearest of the given waypoints to every cell.
+
+    Args:
+        filename: The name of the text file containing the level.
+        src_waypoints: The characters associated with the waypoints costs are measured from.
+        output: The .csv or .npy file to be created.
+
+    """
+    grid = load_grid(filename)
+    costs = grid_distance_map([grid['waypoints'][waypoint] for waypoint in src_waypoints], grid)
+    save_grid_costs(costs, output)
+
+
 if __name__ == '__main__':
     filename, src_waypoint, dst_waypoint = 'example.txt', 'a','e'
 
@@ -1,10 +1,17 @@
 # Implements a maze environment containing cells with walls, spaces, and waypoints
 
-from math import inf
+from math import inf, sqrt
 from csv import writer
+import os
+
+import numpy
 
 WALL = 'X'
 
+# the eight neighbor offsets of a cell: four stored in a grid's edge costs,
+# then their reverses, whose costs are read from the neighbor's side
+GRID_DIRECTIONS = [(0, 1), (1, -1), (1, 0), (1, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)]
+
 
 def load_level(filename):
     """ Loads a level from a given text file.
@@ -41,6 +48,190 @@ def load_level(filename):
     return level
 
 
+# per byte value: the cost of a cell holding it (digits and lowercase waypoints), inf if it is not a space
+BYTE_COSTS = numpy.full(256, inf, dtype=numpy.float32)
+BYTE_COSTS[ord('0'):ord('9') + 1] = numpy.arange(10)
+BYTE_COSTS[ord('a'):ord('z') + 1] = 1.
+BYTE_WAYPOINTS = numpy.zeros(256, dtype=bool)
+BYTE_WAYPOINTS[ord('a'):ord('z') + 1] = True
+
+
+def read_level_arrays(filename, cache=False):
+    """ Decodes a level text file into arrays in bulk, without a Python loop over its cells.
+
+    The file is read as bytes and every cell is classified through a lookup
+    table over byte values, so levels must be ASCII.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+        cache: Also keep the arrays in filename + '.npz', and reuse that file
+            instead of decoding while the text file's size and modification
+            time stay the same.
+
+    Returns:
+        A dict containing the (width, height) float32 cell costs indexed [i, j]
+        with inf where there is no space (array), the locations of walls (bool
+        array), and a mapping of waypoints to locations (dict).
+
+    """
+    stat = os.stat(filename)
+    key = numpy.array([stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+    cache_filename = filename + '.npz'
+    if cache and os.path.exists(cache_filename):
+        with numpy.load(cache_filename) as cached:
+            if numpy.array_equal(cached['source'], key):
+                return {'costs': cached['costs'],
+                        'walls': cached['walls'],
+                        'waypoints': {chr(char): (int(i), int(j))
+                                      for char, i, j in cached['waypoints'].tolist()}}
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+    # the universal newlines load_level gets from reading in text mode
+    data = numpy.frombuffer(data.replace(b'\r\n', b'\n').replace(b'\r', b'\n'), dtype=numpy.uint8)
+
+    newlines = numpy.flatnonzero(data == ord('\n'))
+    line_starts = numpy.concatenate([[0], newlines + 1])
+    if line_starts[-1] == len(data):
+        line_starts = line_starts[:-1]
+    lengths = numpy.append(newlines, len(data))[:len(line_starts)] - line_starts
+    width, height = int(lengths.max(initial=0)), len(line_starts)
+
+    cells = numpy.flatnonzero(data != ord('\n'))
+    j = numpy.searchsorted(line_starts, cells, side='right') - 1
+    i = cells - line_starts[j]
+    chars = numpy.full((width, height), ord(' '), dtype=numpy.uint8)
+    chars[i, j] = data[cells]
+
+    # like load_level, a waypoint repeated later in the file wins
+    letters = cells[BYTE_WAYPOINTS[data[cells]]][::-1]
+    _, last = numpy.unique(data[letters], return_index=True)
+    waypoints = {chr(data[cell]): (int(cell - line_starts[row]), int(row))
+                 for cell, row in zip(letters[last], j[numpy.searchsorted(cells, letters[last])])}
+
+    arrays = {'costs': BYTE_COSTS[chars],
+              'walls': chars == ord(WALL),
+              'waypoints': waypoints}
+    if cache:
+        with open(cache_filename, 'wb') as f:
+            numpy.savez(f, source=key, costs=arrays['costs'], walls=arrays['walls'],
+                        waypoints=numpy.array([(ord(char), i, j) for char, (i, j) in waypoints.items()],
+                                              dtype=numpy.int64).reshape(-1, 3))
+    return arrays
+
+
+def load_level_arrays(filename, cache=False):
+    """ Loads a level from a given text file like load_level, decoding it with read_level_arrays.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+        cache: Reuse or write the binary cache file, as read_level_arrays does.
+
+    Returns:
+        The loaded level (dict), the same as load_level returns.
+
+    """
+    arrays = read_level_arrays(filename, cache)
+    costs = arrays['costs']
+    # transposed, so spaces are listed in file order like load_level's
+    j, i = numpy.nonzero(numpy.isfinite(costs.T))
+    walls_j, walls_i = numpy.nonzero(arrays['walls'].T)
+    return {'walls': set(zip(walls_i.tolist(), walls_j.tolist())),
+            'spaces': dict(zip(zip(i.tolist(), j.tolist()), costs[i, j].tolist())),
+            'waypoints': arrays['waypoints']}
+
+
+def load_grid(filename, cache=False):
+    """ Loads a level from a given text file as a grid of arrays.
+
+    Unlike load_level this never builds a Python object per cell, so it can
+    hold levels of thousands of cells on a side.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+        cache: Reuse or write the binary cache file, as read_level_arrays does.
+
+    Returns:
+        The loaded grid (dict), as grid_from_costs returns it.
+
+    """
+    arrays = read_level_arrays(filename, cache)
+    return grid_from_costs(arrays['costs'], arrays['waypoints'])
+
+
+def grid_from_level(level):
+    """ Converts a level loaded by load_level into a grid.
+
+    Args:
+        level: A loaded level, containing walls, spaces, and waypoints.
+
+    Returns:
+        The grid (dict), as grid_from_costs returns it.
+
+    """
+    xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
+    costs = numpy.full((max(xs) + 1, max(ys) + 1), inf, dtype=numpy.float32)
+    for (i, j), cost in level['spaces'].items():
+        costs[i, j] = cost
+    return grid_from_costs(costs, level['waypoints'])
+
+
+def grid_from_costs(costs, waypoints=None):
+    """ Builds a grid, the array-backed counterpart of a level.
+
+    Cells are linear indices into the grid padded by one blocked cell on every
+    side: (i, j) is cell (i + 1) * (height + 2) + (j + 1), so cells order the
+    same way as (i, j) tuples. Moving between neighboring cells costs their
+    distance times their average cost, as transition_cost computes it.
+
+    Args:
+        costs: A (width, height) array of cell costs indexed [i, j], inf where blocked.
+        waypoints: An optional mapping of waypoint characters to (i, j) cells.
+
+    Returns:
+        The grid (dict) containing the float32 cell costs (array), the mask of
+        blocked cells (array), the waypoints (dict), and the precomputed
+        'edge_costs' (a (4, cells) float64 array, one row per stored direction)
+        and 'neighbors' (linear offset, edge cost row and edge cost shift of
+        each of the eight directions) that grid searches use.
+
+    """
+    costs = numpy.asarray(costs, dtype=numpy.float32)
+    width, height = costs.shape
+    padded = numpy.full((width + 2, height + 2), inf)
+    padded[1:-1, 1:-1] = costs
+    stride = height + 2
+
+    edge_costs = numpy.full((4, padded.size), inf)
+    for row, (di, dj) in enumerate(GRID_DIRECTIONS[:4]):
+        edges = edge_costs[row].reshape(padded.shape)
+        neighbors = padded[1 + di:width + 1 + di, 1 + dj:height + 1 + dj]
+        edges[1:-1, 1:-1] = sqrt(di ** 2 + dj ** 2) * ((padded[1:-1, 1:-1] + neighbors) / 2)
+
+    offsets = numpy.array([di * stride + dj for di, dj in GRID_DIRECTIONS])
+    rows = numpy.array([0, 1, 2, 3] * 2)
+    shifts = numpy.concatenate([numpy.zeros(4, dtype=offsets.dtype), offsets[4:]])
+
+    return {'costs': costs,
+            'walls': ~numpy.isfinite(costs),
+            'waypoints': dict(waypoints or {}),
+            'shape': (width, height),
+            'edge_costs': edge_costs,
+            'neighbors': (offsets, rows, shifts)}
+
+
+def grid_cell(grid, position):
+    """ Returns the linear index of an (i, j) cell of a grid. """
+    i, j = position
+    return (i + 1) * (grid['shape'][1] + 2) + (j + 1)
+
+
+def grid_position(grid, cell):
+    """ Returns the (i, j) cell of a grid's linear index. """
+    i, j = divmod(int(cell), grid['shape'][1] + 2)
+    return i - 1, j - 1
+
+
 def show_level(level, path=[]):
     """ Displays a level via a print statement.
 
@@ -91,23 +282,42 @@ def save_level_costs(level, costs, filename='distance_map.csv'):
     x_lo, x_hi = min(xs), max(xs)
     y_lo, y_hi = min(ys), max(ys)
 
-    rows = []
-    for j in range(y_lo, y_hi + 1):
-        row = []
-
-        for i in range(x_lo, x_hi + 1):
-            cell = (i, j)
-            if cell not in costs:
-                row.append(inf)
-            else:
-                row.append(costs[cell])
-
-        rows.append(row)
-
     assert '.csv' in filename, 'Error: filename does not contain file type.'
     with open(filename, 'w', newline='') as f:
         csv_writer = writer(f)
-        for row in rows:
-            csv_writer.writerow(row)
+        for j in range(y_lo, y_hi + 1):
+            csv_writer.writerow([costs.get((i, j), inf) for i in range(x_lo, x_hi + 1)])
+
+    print("Saved file:", filename)
+
+
+def save_grid_costs(costs, filename='distance_map.csv', chunk_cells=1 << 20):
+    """ Writes a dense cost array, such as one from grid_distance_map, a slice at a time.
+
+    Only one slice of the output is built in memory at once, so maps far
+    larger than a list of rows could hold can be written, and costs may itself
+    be a memmap.
+
+    Args:
+        costs: A (width, height) array of costs indexed [i, j], inf where unreachable.
+        filename: The name of the file to be created: a .csv laid out like
+            save_level_costs (one row per j), or a .npy holding costs as is.
+        chunk_cells: Roughly how many cells to copy or format at a time.
+
+    """
+    width, height = costs.shape
+    if filename.endswith('.npy'):
+        out = numpy.lib.format.open_memmap(filename, mode='w+', dtype=costs.dtype, shape=costs.shape)
+        step = max(1, chunk_cells // max(1, height))
+        for i in range(0, width, step):
+            out[i:i + step] = costs[i:i + step]
+        out.flush()
+    else:
+        assert '.csv' in filename, 'Error: filename does not contain file type.'
+        step = max(1, chunk_cells // max(1, width))
+        with open(filename, 'w', newline='') as f:
+            csv_writer = writer(f)
+            for j in range(0, height, step):
+                csv_writer.writerows(costs[:, j:j + step].T.tolist())
 
-    print("Saved file:", filename)
\ No newline at end of file
+    print("Saved file:", filename)
@@ -0,0 +1,127 @@
+"""
+Checks for Dijkstra. Run them with pytest from this directory, or as a
+script: python Dijkstra_test.py
+"""
+import csv
+import heapq
+import math
+import os
+import sys
+import tempfile
+
+import numpy
+
+import Dijkstra
+from Dijkstra_Forward_Search import maze_environment
+from nm_samples import load_level_text, open_level, synthetic_level
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample_levels():
+    levels = [maze_environment.load_level(os.path.join(HERE, 'Dijkstra_Forward_Search', 'example.txt'))]
+    levels += [load_level_text(open_level(64, seed, patches=4)) for seed in range(4)]
+    levels += [load_level_text(synthetic_level(32, seed)) for seed in range(4)]
+    return levels
+
+
+def waypoint_pairs(level):
+    waypoints = sorted(level['waypoints'].values())
+    return [(source, destination) for source in waypoints for destination in waypoints if source != destination]
+
+
+def path_cost(level, path):
+    return sum(Dijkstra.transition_cost(level, a, b) for a, b in zip(path, path[1:]))
+
+
+def assert_valid_path(level, path, source, destination):
+    assert path[0] == source and path[-1] == destination
+    assert all(cell in level['spaces'] for cell in path)
+    assert all(max(abs(a[0] - b[0]), abs(a[1] - b[1])) == 1 for a, b in zip(path, path[1:]))
+
+
+def shortest_path(level, source, destination):
+    # path_to_cell recurses once per cell of the path
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 5000))
+    try:
+        return Dijkstra.dijkstras_shortest_path(source, destination, level, Dijkstra.navigation_edges)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def level_distances(level, sources):
+    # path cost of every space from the nearest source, by plain Dijkstra over the level's cells
+    distances = {}
+    queue = [(0., source) for source in sources]
+    while queue:
+        distance, cell = heapq.heappop(queue)
+        if cell in distances:
+            continue
+        distances[cell] = distance
+        for child, _ in Dijkstra.navigation_edges(level, cell):
+            if child not in distances:
+                heapq.heappush(queue, (distance + Dijkstra.transition_cost(level, cell, child), child))
+    return distances
+
+
+def test_grid_search_matches_level_search():
+    for level in sample_levels():
+        grid = maze_environment.grid_from_level(level)
+        for source, destination in waypoint_pairs(level):
+            shortest = shortest_path(level, source, destination)
+            found = Dijkstra.grid_dijkstras_shortest_path(source, destination, grid)
+            assert bool(found) == bool(shortest), (source, destination)
+            if found:
+                assert_valid_path(level, found, source, destination)
+                assert math.isclose(path_cost(level, found), path_cost(level, shortest), rel_tol=1e-6), \
+                    (source, destination)
+
+
+def test_distance_map_matches_level_dijkstra():
+    for level in sample_levels():
+        grid = maze_environment.grid_from_level(level)
+        sources = sorted(level['waypoints'].values())[:2]
+        costs = Dijkstra.grid_distance_map(sources, grid)
+        expected = numpy.full(grid['shape'], numpy.inf)
+        for (i, j), distance in level_distances(level, sources).items():
+            expected[i, j] = distance
+        assert numpy.allclose(costs, expected, rtol=1e-6), sources
+
+        with tempfile.TemporaryDirectory() as directory:
+            # filling a memmap gives the same map, and both writers store it as is
+            filename = os.path.join(directory, 'costs.npy')
+            out = numpy.lib.format.open_memmap(filename, mode='w+', dtype=numpy.float64, shape=grid['shape'])
+            assert Dijkstra.grid_distance_map(sources, grid, out=out) is out
+            assert numpy.array_equal(out, costs)
+            del out
+            assert numpy.array_equal(numpy.load(filename), costs)
+            for chunk_cells in (1, 7, 1 << 20):
+                written = os.path.join(directory, 'written.npy')
+                maze_environment.save_grid_costs(costs, written, chunk_cells)
+                assert numpy.array_equal(numpy.load(written), costs)
+                written = os.path.join(directory, 'written.csv')
+                maze_environment.save_grid_costs(costs, written, chunk_cells)
+                with open(written, newline='') as f:
+                    rows = [[float(value) for value in row] for row in csv.reader(f)]
+                assert numpy.array_equal(numpy.array(rows).T, costs)
+
+
+def test_jump_point_search_costs():
+    for level in sample_levels():
+        for source, destination in waypoint_pairs(level):
+            shortest = shortest_path(level, source, destination)
+            jumped = Dijkstra.jump_point_search(source, destination, level)
+            assert bool(jumped) == bool(shortest), (source, destination)
+            if jumped:
+                assert_valid_path(level, jumped, source, destination)
+                assert math.isclose(path_cost(level, jumped), path_cost(level, shortest), rel_tol=1e-9), \
+                    (source, destination)
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
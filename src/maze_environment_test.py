@@ -0,0 +1,69 @@
+"""
+Checks for Dijkstra_Forward_Search/maze_environment. Run them with pytest
+from this directory, or as a script: python maze_environment_test.py
+"""
+import os
+import tempfile
+
+import numpy
+
+from Dijkstra_Forward_Search import maze_environment
+from nm_samples import open_level, synthetic_level
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample_texts():
+    with open(os.path.join(HERE, 'Dijkstra_Forward_Search', 'example.txt')) as f:
+        example = f.read()
+    texts = [example, example.replace('\n', '\r\n'), example.rstrip('\n')]
+    texts += [open_level(48, seed, patches=3) for seed in range(2)] + [synthetic_level(32, seed) for seed in range(2)]
+    # ragged lines, blank lines, and a waypoint given twice, where the later one wins
+    texts.append('XXXX\nXa1X9\n\nX2b\nXXa3X\n')
+    return texts
+
+
+def test_bulk_decoder_matches_load_level():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'level.txt')
+        for number, text in enumerate(sample_texts()):
+            with open(filename, 'w', newline='') as f:
+                f.write(text)
+            # the cache is written on the first call and read on the second
+            for cache in (False, True, True):
+                expected = maze_environment.load_level(filename)
+                level = maze_environment.load_level_arrays(filename, cache)
+                assert level['walls'] == expected['walls'], (number, cache)
+                assert list(level['spaces'].items()) == list(expected['spaces'].items()), (number, cache)
+                assert level['waypoints'] == expected['waypoints'], (number, cache)
+            assert os.path.exists(filename + '.npz')
+
+            grid = maze_environment.load_grid(filename, cache=True)
+            converted = maze_environment.grid_from_level(expected)
+            width, height = converted['shape']
+            assert numpy.array_equal(grid['costs'][:width, :height], converted['costs']), number
+            assert numpy.isinf(grid['costs'][width:]).all() and numpy.isinf(grid['costs'][:, height:]).all()
+            assert grid['waypoints'] == converted['waypoints'], number
+
+
+def test_decoder_cache_follows_the_text_file():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'level.txt')
+        with open(filename, 'w') as f:
+            f.write('XXXX\nXa1X\nX2bX\nXXXX\n')
+        maze_environment.read_level_arrays(filename, cache=True)
+        # a changed level has another size, so the stale cache is not used
+        with open(filename, 'w') as f:
+            f.write('XXXXX\nXa19X\nX2b3X\nXXXXX\n')
+        level = maze_environment.load_level_arrays(filename, cache=True)
+        expected = maze_environment.load_level(filename)
+        assert list(level['spaces'].items()) == list(expected['spaces'].items())
+        assert level['walls'] == expected['walls'] and level['waypoints'] == expected['waypoints']
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
@@ -0,0 +1,1032 @@
+import argparse
+import collections
+import contextlib
+import heapq
+import io
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+import Dijkstra
+import nm_contraction
+import nm_hierarchy
+import nm_landmarks
+import nm_meshbuilder
+import nm_navmesh
+import nm_openlist
+import nm_pathfinder
+from nm_navmesh import BoxIndex, NavMesh
+from nm_samples import load_level_text, mesh_extent, open_level, random_pairs, random_points, synthetic_level, \
+    synthetic_map
+from Dijkstra_Forward_Search import maze_environment
+
+
+def load_mesh(filename):
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def cross_map_pairs(navmesh, count, seed, min_fraction=0.5):
+    # random pairs at least min_fraction of the map's diagonal apart
+    width, height = mesh_extent(navmesh.boxes)
+    reach = min_fraction * math.hypot(width, height)
+    pairs = []
+    for source, destination in random_pairs(navmesh, count * 50, seed):
+        if math.dist(source, destination) >= reach:
+            pairs.append((source, destination))
+            if len(pairs) == count:
+                break
+    return pairs
+
+
+def path_length(path):
+    return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def quietly(fn, *args, **kwargs):
+    # find_path prints 'No Path Found!' for every miss
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_locate(mesh, count, seed):
+    """
+    Compares BoxIndex point location against the linear in_bounds scan.
+
+    Returns:
+        A dict of timings; raises AssertionError if the two ever disagree.
+    """
+    boxes = list(mesh["boxes"])
+    points = random_points(boxes, count, seed)
+    points += [(int(x), int(y)) for x, y in points]  # integer points land on box edges
+
+    def linear():
+        return [next((box for box in boxes if nm_pathfinder.in_bounds(p, box)), None) for p in points]
+
+    index, build_time = timed(BoxIndex, boxes)
+
+    def indexed():
+        return [index.find(p) for p in points]
+
+    expected, linear_time = timed(linear)
+    found, index_time = timed(indexed)
+    assert found == expected, "BoxIndex disagrees with in_bounds"
+    return {
+        'boxes': len(boxes),
+        'queries': len(points),
+        'buckets': len(index.buckets),
+        'index_build_ms': build_time * 1e3,
+        'linear_us_per_query': linear_time / len(points) * 1e6,
+        'index_us_per_query': index_time / len(points) * 1e6,
+        'speedup': linear_time / index_time,
+    }
+
+
+class CountingQueue(nm_openlist.HeapQueue):
+    gets = 0
+
+    def pop(self):
+        CountingQueue.gets += 1
+        return super().pop()
+
+
+def count_flat_expansions(fn):
+    # runs fn with search()'s frontier pops counted
+    original, nm_pathfinder.HeapQueue = nm_pathfinder.HeapQueue, CountingQueue
+    CountingQueue.gets = 0
+    try:
+        result = fn()
+    finally:
+        nm_pathfinder.HeapQueue = original
+    return result, CountingQueue.gets
+
+
+def bench_expansions(mesh, count, seed):
+    """
+    Measures search() throughput in box expansions per second.
+
+    Expansions are counted as frontier pops by count_flat_expansions.
+    """
+    navmesh = NavMesh.from_dict(mesh)
+    queries = [(navmesh.locate(s), navmesh.locate(d), s, d) for s, d in random_pairs(navmesh, count, seed)]
+    queries = [q for q in queries if q[0] != q[1]]
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+
+    (_, elapsed), expansions = count_flat_expansions(
+        lambda: timed(lambda: [nm_pathfinder.search(navmesh, *q) for q in queries]))
+    return {
+        'queries': len(queries),
+        'expansions': expansions,
+        'ms_per_query': elapsed / len(queries) * 1e3,
+        'expansions_per_sec': expansions / elapsed,
+    }
+
+
+def bench_build(image, min_feature_size, worker_counts):
+    """Wall-clock build_mesh time for each worker count (1 = serial integral build)."""
+    results = {}
+    serial_time = None
+    for workers in worker_counts:
+        mesh, elapsed = timed(nm_meshbuilder.build_mesh, image, min_feature_size, 'integral', workers)
+        serial_time = serial_time or elapsed
+        results['workers_%d_s' % workers] = elapsed
+        results['workers_%d_speedup' % workers] = serial_time / elapsed
+    results['boxes'] = len(mesh['boxes'])
+    return results
+
+
+def bench_patch(image, min_feature_size, dirty_sizes, count, seed):
+    """
+    Times patch_mesh and patch_navmesh, each followed by the first query on
+    the result, against a full rebuild, for square edits of several sizes.
+
+    Each edit toggles a random square between wall and floor and patches both
+    meshes around it. The dict mesh has to be compiled before its first query;
+    the NavMesh is queried as patched, reusing its BoxIndex across the run.
+    """
+    rng = random.Random(seed)
+    image = image.copy()
+    mesh, rebuild_time = timed(nm_meshbuilder.build_mesh, image, min_feature_size, 'integral')
+    index = BoxIndex(mesh['boxes'])
+    navmesh, compile_time = timed(NavMesh.from_dict, mesh)
+    open_cells = numpy.argwhere(image == 255)
+
+    def query():
+        # two random floor pixels; their cells may have been walled off since
+        (x1, y1), (x2, y2) = open_cells[rng.randrange(len(open_cells))], open_cells[rng.randrange(len(open_cells))]
+        return (x1 + 0.5, y1 + 0.5), (x2 + 0.5, y2 + 0.5)
+
+    quietly(nm_pathfinder.find_path, *query(), navmesh)  # build the views a live mesh would have
+    results = {'boxes': len(mesh['boxes']), 'full_rebuild_ms': rebuild_time * 1e3, 'compile_ms': compile_time * 1e3}
+    for size in dirty_sizes:
+        timings = collections.defaultdict(float)
+        for _ in range(count):
+            x, y = rng.randrange(image.shape[0] - size), rng.randrange(image.shape[1] - size)
+            image[x:x + size, y:y + size] = rng.choice([0, 255])
+            dirty = (x, x + size, y, y + size)
+            source, destination = query()
+
+            mesh, seconds = timed(nm_meshbuilder.patch_mesh, mesh, image, dirty, min_feature_size, 1, index)
+            timings['dict_patch'] += seconds
+            _, querying = timed(lambda: quietly(nm_pathfinder.find_path, source, destination, NavMesh.from_dict(mesh)))
+            timings['dict_patch_query'] += seconds + querying
+
+            navmesh, seconds = timed(nm_meshbuilder.patch_navmesh, navmesh, image, dirty, min_feature_size)
+            timings['navmesh_patch'] += seconds
+            _, querying = timed(quietly, nm_pathfinder.find_path, source, destination, navmesh)
+            timings['navmesh_patch_query'] += seconds + querying
+        for name, seconds in timings.items():
+            results['%s_%dpx_ms' % (name, size)] = seconds / count * 1e3
+    results['navmesh_ids'] = len(navmesh)
+    results['navmesh_live_boxes'] = sum(x1 < x2 for x1, x2, y1, y2 in navmesh.boxes)
+    return results
+
+
+def resident_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def measure_load(filename):
+    """Loads one mesh file into a NavMesh and reports the time and resident memory it took."""
+    before = resident_kb()
+    navmesh, elapsed = timed(nm_navmesh.load, filename)
+    loaded = resident_kb()
+    navmesh.locate(navmesh.boxes[0][:3:2])  # first query builds the Python-side views
+    return {'load_ms': elapsed * 1e3, 'load_rss_kb': loaded - before, 'first_query_rss_kb': resident_kb() - before}
+
+
+def bench_load(filename):
+    """
+    Compares loading a .mesh.pickle against the same mesh in the binary format.
+
+    Each load runs in a fresh interpreter so resident memory is not shared
+    between the two measurements.
+    """
+    def child(path):
+        output = subprocess.run([sys.executable, __file__, 'load-child', path],
+                                check=True, capture_output=True, text=True).stdout
+        return json.loads(output)
+
+    with tempfile.TemporaryDirectory() as directory:
+        binary = os.path.join(directory, 'mesh.navmesh')
+        nm_navmesh.convert(filename, binary)
+        results = {'pickle_bytes': os.path.getsize(filename), 'navmesh_bytes': os.path.getsize(binary)}
+        for name, path in (('pickle', filename), ('navmesh', binary)):
+            for key, value in child(path).items():
+                results['%s_%s' % (name, key)] = value
+    return results
+
+
+def bench_batch(filename, count, seed, worker_counts):
+    """Throughput of find_paths over random query pairs for each worker count."""
+    navmesh = nm_navmesh.load(filename)
+    pairs = random_pairs(navmesh, count, seed)
+    results = {'queries': count}
+    single = None
+    for workers in worker_counts:
+        paths, elapsed = timed(nm_pathfinder.find_paths, pairs, filename, workers)
+        single = single or elapsed
+        results['workers_%d_qps' % workers] = count / elapsed
+        results['workers_%d_speedup' % workers] = single / elapsed
+    return results
+
+
+def bench_hierarchy(mesh, count, seed):
+    """Expanded nodes, latency and path length of hierarchical vs flat search on cross-map queries."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    hierarchy, build_time = timed(nm_hierarchy.Hierarchy, navmesh)
+    pairs = cross_map_pairs(navmesh, count, seed)
+
+    def flat():
+        return [quietly(nm_pathfinder.find_path, s, d, navmesh) for s, d in pairs]
+
+    (flat_paths, flat_time), flat_expansions = count_flat_expansions(lambda: timed(flat))
+
+    expansions = 0
+    hierarchical_paths = []
+    start = time.perf_counter()
+    for s, d in pairs:
+        hierarchical_paths.append(quietly(nm_pathfinder.find_path, s, d, navmesh, router=hierarchy))
+        expansions += hierarchy.last_expansions
+    hierarchical_time = time.perf_counter() - start
+
+    found = [(a[0], b[0]) for a, b in zip(flat_paths, hierarchical_paths) if a[0] and b[0]]
+    return {
+        'queries': len(pairs),
+        'clusters': len(hierarchy.members),
+        'entrances': len(hierarchy.links),
+        'build_ms': build_time * 1e3,
+        'flat_expansions': flat_expansions / len(pairs),
+        'hierarchical_expansions': expansions / len(pairs),
+        'flat_ms': flat_time / len(pairs) * 1e3,
+        'hierarchical_ms': hierarchical_time / len(pairs) * 1e3,
+        'path_length_ratio': sum(path_length(b) for a, b in found) / max(1e-9, sum(path_length(a) for a, b in found)),
+    }
+
+
+def bench_landmarks(mesh, count, seed, landmark_count, radius=50):
+    """
+    Expanded nodes and latency of search() with the ALT estimate vs the
+    straight-line heuristic, on random queries and on queries at most radius apart.
+    """
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    landmarks, build_time = timed(nm_landmarks.Landmarks, navmesh, landmark_count)
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+
+    def corridor_length(corridor):
+        return sum(navmesh.edge_costs[navmesh.edge(a, b)] for a, b in zip(corridor, corridor[1:]))
+
+    results = {'landmarks': len(landmarks.boxes), 'build_ms': build_time * 1e3}
+    for prefix, pairs in (('', random_pairs(navmesh, count, seed)),
+                          ('nearby_', nearby_pairs(navmesh, count, seed, radius))):
+        queries = [(navmesh.locate(s), navmesh.locate(d), s, d) for s, d in pairs]
+        queries = [q for q in queries if q[0] != q[1]]
+
+        def run(landmarks):
+            return timed(lambda: [nm_pathfinder.search(navmesh, *q, landmarks=landmarks) for q in queries])
+
+        (plain, plain_time), plain_expansions = count_flat_expansions(lambda: run(None))
+        (guided, guided_time), guided_expansions = count_flat_expansions(lambda: run(landmarks))
+        results.update({
+            prefix + 'queries': len(queries),
+            prefix + 'euclidean_expansions': plain_expansions / len(queries),
+            prefix + 'alt_expansions': guided_expansions / len(queries),
+            prefix + 'euclidean_ms': plain_time / len(queries) * 1e3,
+            prefix + 'alt_ms': guided_time / len(queries) * 1e3,
+            prefix + 'path_length_ratio':
+                sum(map(corridor_length, guided)) / max(1e-9, sum(map(corridor_length, plain))),
+        })
+    return results
+
+
+def bench_contraction(mesh, count, seed):
+    """Preprocessing time, memory overhead and query latency of a contraction hierarchy vs search()."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+    hierarchy, build_time = timed(nm_contraction.ContractionHierarchy, navmesh)
+    queries = [(navmesh.locate(s), navmesh.locate(d), s, d) for s, d in random_pairs(navmesh, count, seed)]
+    queries = [q for q in queries if q[0] != q[1]]
+
+    _, flat_time = timed(lambda: [nm_pathfinder.search(navmesh, *q) for q in queries])
+    expansions = 0
+    start = time.perf_counter()
+    for q in queries:
+        hierarchy.corridor(navmesh, *q)
+        expansions += hierarchy.last_expansions
+    hierarchy_time = time.perf_counter() - start
+
+    mesh_bytes = sum(array.nbytes for array in (navmesh.bounds, navmesh.offsets, navmesh.neighbors, navmesh.portals))
+    return {
+        'boxes': len(navmesh),
+        'edges': navmesh.num_edges // 2,
+        'shortcuts': hierarchy.shortcuts,
+        'build_ms': build_time * 1e3,
+        'mesh_kb': mesh_bytes / 1024,
+        'hierarchy_kb': hierarchy.nbytes / 1024,
+        'queries': len(queries),
+        'search_ms': flat_time / len(queries) * 1e3,
+        'hierarchy_ms': hierarchy_time / len(queries) * 1e3,
+        'hierarchy_expansions': expansions / len(queries),
+    }
+
+
+def bench_flow_field(mesh, agents, destinations, seed):
+    """find_path for many agents converging on a few rally points, with and without a FlowFieldCache."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+    rng = random.Random(seed)
+    rally_points = [d for _, d in random_pairs(navmesh, destinations, seed)]
+    pairs = [(s, rng.choice(rally_points)) for s, _ in random_pairs(navmesh, agents, seed + 1)]
+
+    def run(router):
+        return [quietly(nm_pathfinder.find_path, s, d, navmesh, router=router) for s, d in pairs]
+
+    plain, plain_time = timed(run, None)
+    flow_fields = nm_pathfinder.FlowFieldCache()
+    guided, guided_time = timed(run, flow_fields)
+    results = {
+        'agents': len(pairs),
+        'destinations': len(rally_points),
+        'search_ms': plain_time / len(pairs) * 1e3,
+        'flow_field_ms': guided_time / len(pairs) * 1e3,
+        'reachability_agrees': sum(bool(a[0]) == bool(b[0]) for a, b in zip(plain, guided)) / len(pairs),
+        'field_kb': sum(a.nbytes + b.nbytes for a, b in flow_fields.fields.values()) / 1024,
+    }
+    results.update(('cache_' + key, value) for key, value in flow_fields.stats().items())
+    return results
+
+
+def bench_search_stats(mesh, count, seed):
+    """find_path latency without and with a SearchStats, and what the stats sampled."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list, navmesh.edge_costs  # build the Python-side views outside the timing
+    pairs = random_pairs(navmesh, count, seed)
+    samples = []
+    stats = nm_pathfinder.SearchStats(sink=samples.append)
+
+    def run(stats):
+        for s, d in pairs:
+            nm_pathfinder.find_path(s, d, navmesh, stats=stats)
+
+    _, plain = timed(quietly, run, None)
+    _, traced = timed(quietly, run, stats)
+    searched = [sample for sample in samples if sample['pops']] or [{}]
+    results = {'queries': len(pairs),
+               'plain_ms': plain * 1e3,
+               'traced_ms': traced * 1e3,
+               'overhead': traced / plain - 1 if plain else 0.0}
+    for key in ('expanded', 'pushes', 'stale_pops', 'peak_frontier'):
+        results['mean_' + key] = sum(sample.get(key, 0) for sample in searched) / len(searched)
+    elapsed = sum(sample.get('elapsed', 0) for sample in searched) or 1
+    results['queue_share'] = sum(sample.get('queue_time', 0) for sample in searched) / elapsed
+    results['point_share'] = sum(sample.get('point_time', 0) for sample in searched) / elapsed
+    return results
+
+
+def nearby_pairs(navmesh, count, seed, radius):
+    # random pairs at most radius apart, like an agent's next move
+    pairs = []
+    for source, destination in random_pairs(navmesh, count * 200, seed):
+        if math.dist(source, destination) <= radius:
+            pairs.append((source, destination))
+            if len(pairs) == count:
+                break
+    return pairs
+
+
+def bench_line_of_sight(mesh, count, seed, radius):
+    """How often find_path's straight-line check answers a query, and the latency it saves."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+    results = {}
+    for name, pairs in (('random', random_pairs(navmesh, count, seed)),
+                        ('nearby', nearby_pairs(navmesh, count, seed, radius))):
+        queries = [(navmesh.locate(s), navmesh.locate(d), s, d) for s, d in pairs]
+        hits = [q[0] != q[1] and nm_pathfinder.visible_corridor(navmesh, *q) is not None for q in queries]
+        misses = [q for q, hit in zip(queries, hits) if not hit and q[0] != q[1]]
+        timings = {}
+        for check in (False, True):
+            timings[check] = []
+            for s, d in pairs:
+                _, elapsed = timed(lambda: quietly(nm_pathfinder.find_path, s, d, navmesh, line_of_sight=check))
+                timings[check].append(elapsed * 1e3)
+        hit_searched = [t for t, hit in zip(timings[False], hits) if hit]
+        hit_direct = [t for t, hit in zip(timings[True], hits) if hit]
+        results[name + '_queries'] = len(pairs)
+        results[name + '_hit_fraction'] = sum(hits) / len(pairs)
+        results[name + '_search_ms'] = sum(timings[False]) / len(pairs)
+        results[name + '_checked_ms'] = sum(timings[True]) / len(pairs)
+        if hit_direct:
+            results[name + '_hit_search_ms'] = sum(hit_searched) / len(hit_searched)
+            results[name + '_hit_direct_ms'] = sum(hit_direct) / len(hit_direct)
+        if misses:
+            # what a miss adds to find_path: the walk until it leaves the mesh
+            _, elapsed = timed(lambda: [nm_pathfinder.visible_corridor(navmesh, *q) for q in misses])
+            results[name + '_miss_check_us'] = elapsed / len(misses) * 1e6
+    return results
+
+
+def bench_smoothing(mesh, count, seed):
+    """Waypoints, path length and time of find_path's per-crossing waypoints vs funnel smoothing."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+    pairs = random_pairs(navmesh, count, seed)
+    # with every corridor cached, find_path only places the waypoints
+    cache = nm_pathfinder.CorridorCache(maxsize=len(pairs))
+    for s, d in pairs:
+        quietly(nm_pathfinder.find_path, s, d, navmesh, cache, line_of_sight=False)
+
+    results = {'queries': len(pairs)}
+    for name, smooth in (('portal', False), ('funnel', True)):
+        paths, elapsed = timed(lambda: [quietly(nm_pathfinder.find_path, s, d, navmesh,
+                                                line_of_sight=False, smooth=smooth)[0] for s, d in pairs])
+        _, placing = timed(lambda: [quietly(nm_pathfinder.find_path, s, d, navmesh, cache,
+                                            line_of_sight=False, smooth=smooth) for s, d in pairs])
+        found = [path for path in paths if path]
+        results[name + '_waypoints'] = sum(len(path) for path in found) / len(found)
+        results[name + '_length'] = sum(path_length(path) for path in found) / len(found)
+        results[name + '_find_path_ms'] = elapsed / len(pairs) * 1e3
+        results[name + '_placing_us'] = placing / len(pairs) * 1e6
+    return results
+
+
+def bench_anytime(mesh, count, seed, budget_us):
+    """Frames and worst step time of AnytimeSearch with a per-frame time budget, vs search() in one go."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+    queries = [(navmesh.locate(s), navmesh.locate(d), s, d) for s, d in cross_map_pairs(navmesh, count, seed)]
+    queries = [q for q in queries if q[0] != q[1]]
+    _, whole = timed(lambda: [nm_pathfinder.search(navmesh, *q) for q in queries])
+
+    frames, worst_steps, total = [], [], 0.0
+    for q in queries:
+        anytime = nm_pathfinder.AnytimeSearch(navmesh, *q)
+        steps, worst = 0, 0.0
+        status = nm_pathfinder.AnytimeSearch.IN_PROGRESS
+        while status == nm_pathfinder.AnytimeSearch.IN_PROGRESS:
+            (status, _), elapsed = timed(anytime.step, None, budget_us)
+            steps += 1
+            worst = max(worst, elapsed)
+            total += elapsed
+        frames.append(steps)
+        worst_steps.append(worst * 1e3)
+    results = {'queries': len(queries),
+               'search_ms_per_query': whole / len(queries) * 1e3,
+               'anytime_ms_per_query': total / len(queries) * 1e3}
+    results.update(percentiles('frames', frames))
+    results.update(percentiles('worst_step_ms', worst_steps))
+    return results
+
+
+def bench_merge(mesh, count, seed):
+    """Boxes, adjacency and find_path cost on a built mesh vs the same mesh after merge_boxes."""
+    merged, merging = timed(nm_meshbuilder.merge_boxes, mesh)
+    results = {'merge_ms': merging * 1e3}
+    pairs = None
+    for name, boxes in (('built', mesh), ('merged', merged)):
+        navmesh = nm_navmesh.as_navmesh(boxes)
+        navmesh.edges, navmesh.portal_list  # build the Python-side views outside the timing
+        # the merged mesh covers the same area, so the same points are on both
+        pairs = pairs or random_pairs(navmesh, count, seed)
+        samples = []
+        stats = nm_pathfinder.SearchStats(sink=samples.append)
+        _, elapsed = timed(lambda: [quietly(nm_pathfinder.find_path, s, d, navmesh, line_of_sight=False)
+                                    for s, d in pairs])
+        paths = [quietly(nm_pathfinder.find_path, s, d, navmesh, stats=stats, line_of_sight=False)[0]
+                 for s, d in pairs]
+        found = [path for path in paths if path]
+        results[name + '_boxes'] = len(navmesh)
+        results[name + '_edges'] = navmesh.num_edges // 2
+        results[name + '_found'] = len(found)
+        results[name + '_expanded'] = sum(sample['expanded'] for sample in samples) / len(samples)
+        results[name + '_find_path_ms'] = elapsed / len(pairs) * 1e3
+        results[name + '_length'] = sum(path_length(path) for path in found) / max(len(found), 1)
+        smoothed = [quietly(nm_pathfinder.find_path, s, d, navmesh, line_of_sight=False, smooth=True)[0]
+                    for s, d in pairs]
+        results[name + '_smoothed_length'] = sum(path_length(path) for path in smoothed if path) / max(len(found), 1)
+    results['speedup'] = results['built_find_path_ms'] / results['merged_find_path_ms']
+    results['length_ratio'] = results['merged_length'] / results['built_length']
+    results['smoothed_length_ratio'] = results['merged_smoothed_length'] / results['built_smoothed_length']
+    return results
+
+
+def count_cell_expansions(fn):
+    # runs fn with Dijkstra.py's queue pops counted, from its HeapQueues and its bare heapq calls
+    pops = [0]
+
+    def counting_heappop(queue):
+        pops[0] += 1
+        return heapq.heappop(queue)
+
+    Dijkstra.heappop, Dijkstra.HeapQueue = counting_heappop, CountingQueue
+    CountingQueue.gets = 0
+    try:
+        result = fn()
+    finally:
+        Dijkstra.heappop, Dijkstra.HeapQueue = heapq.heappop, nm_openlist.HeapQueue
+    return result, pops[0] + CountingQueue.gets
+
+
+def bench_jump_points(size, seed, patches):
+    """Expanded cells and runtime of Dijkstra vs Jump Point Search on an open maze level."""
+    level = load_level_text(open_level(size, seed, patches))
+    source, destination = level['waypoints']['a'], level['waypoints']['b']
+    results = {'cells': len(level['spaces'])}
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 4 * size + 100))
+    try:
+        for name, search in [('dijkstra', lambda: Dijkstra.dijkstras_shortest_path(source, destination, level,
+                                                                                   Dijkstra.navigation_edges)),
+                             ('jps', lambda: Dijkstra.jump_point_search(source, destination, level))]:
+            (path, elapsed), expanded = count_cell_expansions(lambda: timed(search))
+            results[name + '_expanded'] = expanded
+            results[name + '_ms'] = elapsed * 1e3
+            results[name + '_cost'] = sum(Dijkstra.transition_cost(level, a, b) for a, b in zip(path, path[1:])) \
+                if path else math.inf
+    finally:
+        sys.setrecursionlimit(limit)
+    return results
+
+
+def bench_level_load(size, seed):
+    """load_level vs the bulk byte decoder, uncached and from its binary cache."""
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'level.txt')
+    with open(filename, 'w') as f:
+        f.write(synthetic_level(size, seed))
+    try:
+        level, text_time = timed(maze_environment.load_level, filename)
+        arrays_level, arrays_time = timed(maze_environment.load_level_arrays, filename)
+        _, decode_time = timed(maze_environment.read_level_arrays, filename)
+        _, cache_write_time = timed(maze_environment.read_level_arrays, filename, True)
+        _, cache_time = timed(maze_environment.read_level_arrays, filename, True)
+        _, grid_time = timed(maze_environment.load_grid, filename, True)
+        cache_kb = os.path.getsize(filename + '.npz') / 1024
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+    return {
+        'cells': size * size,
+        'load_level_ms': text_time * 1e3,
+        'load_level_arrays_ms': arrays_time * 1e3,
+        'decode_ms': decode_time * 1e3,
+        'decode_and_cache_ms': cache_write_time * 1e3,
+        'cached_ms': cache_time * 1e3,
+        'cached_grid_ms': grid_time * 1e3,
+        'cache_kb': cache_kb,
+        'same_level': level == arrays_level,
+    }
+
+
+OPEN_LISTS = [('heap', nm_openlist.HeapQueue), ('indexed', nm_openlist.IndexedHeap),
+              ('radix', nm_openlist.RadixHeap)]
+
+
+def bench_open_lists(prefix, run):
+    # runs run(open_list) with each kind of open list, totalling the stats of the queues it yields
+    results = {}
+    for name, open_list in OPEN_LISTS:
+        totals = {}
+        start = time.perf_counter()
+        try:
+            for queue in run(open_list):
+                for key, value in queue.stats().items():
+                    totals[key] = max(totals.get(key, 0), value) if key == 'peak' else totals.get(key, 0) + value
+        except ValueError:
+            results['%s_%s' % (prefix, name)] = 'not monotone'
+            continue
+        totals['ms'] = (time.perf_counter() - start) * 1e3
+        results.update(('%s_%s_%s' % (prefix, name, key), value) for key, value in totals.items())
+    return results
+
+
+def bench_mesh_open_lists(mesh, count, seed):
+    """Open list operations, peak size and latency of search() and box_dijkstra on a mesh."""
+    navmesh = nm_navmesh.as_navmesh(mesh)
+    navmesh.edges, navmesh.portal_list, navmesh.edge_costs  # build the Python-side views outside the timing
+    queries = [(navmesh.locate(s), navmesh.locate(d), s, d) for s, d in random_pairs(navmesh, count, seed)]
+    queries = [q for q in queries if q[0] != q[1]]
+
+    def searches(open_list):
+        for q in queries:
+            queue = open_list()
+            nm_pathfinder.search(navmesh, *q, open_list=queue)
+            yield queue
+
+    def one_to_all(open_list):
+        for q in queries[:20]:
+            queue = open_list()
+            nm_pathfinder.box_dijkstra(navmesh, [q[0]], open_list=queue)
+            yield queue
+
+    results = {'queries': len(queries)}
+    results.update(bench_open_lists('search', searches))
+    results.update(bench_open_lists('dijkstra20', one_to_all))
+    return results
+
+
+def bench_grid_open_lists(size, seed):
+    """
+    Open list operations, peak size and latency of the grid Dijkstra, corner to
+    corner and one-to-all, and of dijkstras_shortest_path over the level's dicts.
+    """
+    text = open_level(size, seed, patches=4)
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write(text)
+    try:
+        grid = maze_environment.load_grid(f.name)
+        level = maze_environment.load_level(f.name)
+    finally:
+        os.unlink(f.name)
+    source, destination = grid['waypoints']['a'], grid['waypoints']['b']
+
+    def level_route(open_list):
+        queue = open_list()
+        Dijkstra.dijkstras_shortest_path(source, destination, level, Dijkstra.navigation_edges, open_list=queue)
+        yield queue
+
+    def route(open_list):
+        queue = open_list()
+        Dijkstra.grid_dijkstras_shortest_path(source, destination, grid, queue)
+        yield queue
+
+    def distance_map(open_list):
+        queue = open_list()
+        Dijkstra.grid_distance_map([source], grid, open_list=queue)
+        yield queue
+
+    results = {'cells': size * size}
+    results.update(bench_open_lists('route', route))
+    results.update(bench_open_lists('map', distance_map))
+    # path_to_cell recurses once per cell of the path
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 4 * size + 100))
+    try:
+        results.update(bench_open_lists('dicts', level_route))
+    finally:
+        sys.setrecursionlimit(limit)
+    return results
+
+
+def bench_grid(size, seed):
+    """Loading and Dijkstra over a level as tuple dicts vs as a grid of arrays."""
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write(synthetic_level(size, seed))
+    try:
+        level, level_time = timed(maze_environment.load_level, f.name)
+        grid, grid_time = timed(maze_environment.load_grid, f.name)
+    finally:
+        os.unlink(f.name)
+    source, destination = level['waypoints']['a'], level['waypoints']['b']
+
+    # path_to_cell recurses once per cell of the path
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 4 * size + 100))
+    try:
+        level_path, level_search = timed(Dijkstra.dijkstras_shortest_path, source, destination,
+                                         level, Dijkstra.navigation_edges)
+    finally:
+        sys.setrecursionlimit(limit)
+    grid_path, grid_search = timed(Dijkstra.grid_dijkstras_shortest_path, source, destination, grid)
+    return {
+        'cells': size * size,
+        'level_load_ms': level_time * 1e3,
+        'grid_load_ms': grid_time * 1e3,
+        'level_search_ms': level_search * 1e3,
+        'grid_search_ms': grid_search * 1e3,
+        'grid_mb': sum(grid[key].nbytes for key in ('costs', 'walls', 'edge_costs')) / 2 ** 20,
+        'same_path': level_path == grid_path,
+    }
+
+
+def percentiles(prefix, values):
+    # p50/p95/p99 of a list of measurements, under prefix_p50 ...
+    if not values:
+        return {}
+    return {'%s_p%d' % (prefix, q): float(value)
+            for q, value in zip((50, 95, 99), numpy.percentile(values, (50, 95, 99)))}
+
+
+def suite_map(image, min_feature_size, count, seed):
+    """Mesh build and load time, box count, and find_path latency and expansions over one map."""
+    mesh, build_time = timed(nm_meshbuilder.build_mesh, image, min_feature_size, 'integral')
+    results = {'pixels': int(image.size), 'boxes': len(mesh['boxes']), 'build_ms': build_time * 1e3}
+    with tempfile.TemporaryDirectory() as directory:
+        pickled = os.path.join(directory, 'map.mesh.pickle')
+        with open(pickled, 'wb') as f:
+            pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+        binary = os.path.join(directory, 'map.navmesh')
+        nm_navmesh.convert(pickled, binary)
+        _, results['load_pickle_ms'] = timed(nm_navmesh.load, pickled)
+        navmesh, results['load_navmesh_ms'] = timed(nm_navmesh.load, binary)
+        results['load_pickle_ms'] *= 1e3
+        results['load_navmesh_ms'] *= 1e3
+        navmesh.edges, navmesh.portal_list, navmesh.edge_costs  # build the Python-side views outside the timing
+
+        pairs = random_pairs(navmesh, count, seed)
+        latencies = []
+        for source, destination in pairs:
+            _, elapsed = timed(quietly, nm_pathfinder.find_path, source, destination, navmesh)
+            latencies.append(elapsed * 1e3)
+        # expansions are counted in a second pass, so the counting does not skew the latencies
+        expansions = []
+        stats = nm_pathfinder.SearchStats()
+        found = 0
+        for source, destination in pairs:
+            quietly(nm_pathfinder.find_path, source, destination, navmesh, stats=stats)
+            expansions.append(stats.expanded + stats.stale_pops)
+            found += stats.found
+        results['queries'] = len(pairs)
+        results['found'] = found
+        results.update(percentiles('query_ms', latencies))
+        results.update(percentiles('expansions', expansions))
+    return results
+
+
+def suite_level(size, seed, count):
+    """Grid load time and grid Dijkstra latency and expansions over one synthetic maze level."""
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write(synthetic_level(size, seed))
+    try:
+        grid, load_time = timed(maze_environment.load_grid, f.name)
+    finally:
+        os.unlink(f.name)
+    rng = random.Random(seed)
+    width, height = grid['shape']
+    spaces = numpy.argwhere(~grid['walls'])
+    pairs = [tuple(tuple(int(v) for v in spaces[rng.randrange(len(spaces))]) for _ in range(2))
+             for _ in range(count)]
+    latencies, expansions = [], []
+    for source, destination in pairs:
+        queue = nm_openlist.HeapQueue()
+        _, elapsed = timed(Dijkstra.grid_dijkstras_shortest_path, source, destination, grid, queue)
+        latencies.append(elapsed * 1e3)
+        expansions.append(queue.pops)
+    results = {'cells': width * height, 'load_ms': load_time * 1e3, 'queries': len(pairs)}
+    results.update(percentiles('query_ms', latencies))
+    results.update(percentiles('expansions', expansions))
+    return results
+
+
+def run_suite(maps, sizes, level_sizes, count, seed, min_feature_size=16):
+    """
+    Runs the whole benchmark suite: the given map images, synthetic random-obstacle
+    maps and synthetic maze levels, each with count seeded random queries.
+
+    Returns:
+        A JSON-serializable dict of an 'environment' record and one result dict
+        per map and level
+    """
+    results = {'environment': {'python': platform.python_version(),
+                               'numpy': numpy.__version__,
+                               'machine': platform.machine(),
+                               'cpus': os.cpu_count(),
+                               'queries': count,
+                               'seed': seed,
+                               'min_feature_size': min_feature_size}}
+    for filename in maps:
+        results['map ' + os.path.basename(filename)] = suite_map(
+            nm_meshbuilder.read_map(filename), min_feature_size, count, seed)
+    for size in sizes:
+        results['synthetic %dx%d' % (size, size)] = suite_map(
+            synthetic_map(size, seed), min_feature_size, count, seed)
+    for size in level_sizes:
+        results['level %dx%d' % (size, size)] = suite_level(size, seed, count)
+    return results
+
+
+def compare_suites(baseline, results):
+    # ratio of every timing, count and percentile to the baseline's; < 1 is faster or fewer
+    ratios = {}
+    for name, values in results.items():
+        if name == 'environment' or name not in baseline:
+            continue
+        ratios[name] = {key: value / baseline[name][key] for key, value in values.items()
+                        if isinstance(value, (int, float)) and baseline[name].get(key)}
+    return ratios
+
+
+def report(name, results):
+    print(name)
+    for key, value in results.items():
+        print("  %-28s %s" % (key, "%.3f" % value if isinstance(value, float) else value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="navmesh micro-benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    locate = commands.add_parser('locate', help="point-to-box lookup: BoxIndex vs linear scan")
+    locate.add_argument('meshes', nargs='+', help=".mesh.pickle files")
+    locate.add_argument('--queries', type=int, default=2000)
+    locate.add_argument('--seed', type=int, default=0)
+
+    expand = commands.add_parser('expand', help="search() expansions per second")
+    expand.add_argument('meshes', nargs='+', help=".mesh.pickle files")
+    expand.add_argument('--queries', type=int, default=300)
+    expand.add_argument('--seed', type=int, default=0)
+
+    build = commands.add_parser('build', help="tiled build_mesh scaling on a synthetic map")
+    build.add_argument('--size', type=int, default=8192)
+    build.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    build.add_argument('--min-feature-size', type=int, default=16)
+    build.add_argument('--seed', type=int, default=0)
+
+    patch = commands.add_parser('patch', help="patch plus first query latency vs full rebuild on synthetic maps")
+    patch.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096])
+    patch.add_argument('--dirty', type=int, nargs='+', default=[8, 32, 128])
+    patch.add_argument('--edits', type=int, default=20)
+    patch.add_argument('--min-feature-size', type=int, default=16)
+    patch.add_argument('--seed', type=int, default=0)
+
+    load = commands.add_parser('load', help="mesh load time and RSS: pickle vs binary format")
+    load.add_argument('meshes', nargs='+', help=".mesh.pickle files")
+
+    batch = commands.add_parser('batch', help="find_paths throughput scaling over worker counts")
+    batch.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    batch.add_argument('--queries', type=int, default=1000)
+    batch.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    batch.add_argument('--seed', type=int, default=0)
+
+    hierarchy = commands.add_parser('hierarchy', help="hierarchical vs flat search on cross-map queries")
+    hierarchy.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    hierarchy.add_argument('--queries', type=int, default=200)
+    hierarchy.add_argument('--seed', type=int, default=0)
+
+    landmarks = commands.add_parser('landmarks', help="ALT landmark estimate vs straight-line heuristic in search()")
+    landmarks.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    landmarks.add_argument('--queries', type=int, default=300)
+    landmarks.add_argument('--landmarks', type=int, default=8)
+    landmarks.add_argument('--seed', type=int, default=0)
+
+    contraction = commands.add_parser('contraction', help="contraction hierarchy preprocessing and queries")
+    contraction.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    contraction.add_argument('--queries', type=int, default=300)
+    contraction.add_argument('--seed', type=int, default=0)
+
+    flow_field = commands.add_parser('flowfield', help="many agents to a few destinations via cached flow fields")
+    flow_field.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    flow_field.add_argument('--agents', type=int, default=500)
+    flow_field.add_argument('--destinations', type=int, default=4)
+    flow_field.add_argument('--seed', type=int, default=0)
+
+    grid = commands.add_parser('grid', help="Dijkstra.py over tuple-dict levels vs array grids")
+    grid.add_argument('--sizes', type=int, nargs='+', default=[64, 256, 512])
+    grid.add_argument('--seed', type=int, default=0)
+
+    jump_points = commands.add_parser('jps', help="Dijkstra vs Jump Point Search on open maze levels")
+    jump_points.add_argument('--sizes', type=int, nargs='+', default=[128, 256, 512])
+    jump_points.add_argument('--patches', type=int, default=0, help="rectangles of non-uniform cost to add")
+    jump_points.add_argument('--seed', type=int, default=0)
+
+    level_load = commands.add_parser('levelload', help="text level parsing vs bulk byte decoding and its cache")
+    level_load.add_argument('--sizes', type=int, nargs='+', default=[256, 1024, 2048])
+    level_load.add_argument('--seed', type=int, default=0)
+
+    open_lists = commands.add_parser('openlist', help="heap, indexed heap and radix heap open lists")
+    open_lists.add_argument('meshes', nargs='*', help=".mesh.pickle or .navmesh files")
+    open_lists.add_argument('--sizes', type=int, nargs='*', default=[256, 512], help="grid level sizes")
+    open_lists.add_argument('--queries', type=int, default=200)
+    open_lists.add_argument('--seed', type=int, default=0)
+
+    search_stats = commands.add_parser('stats', help="find_path with and without SearchStats instrumentation")
+    search_stats.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    search_stats.add_argument('--queries', type=int, default=300)
+    search_stats.add_argument('--seed', type=int, default=0)
+
+    suite = commands.add_parser('suite', help="reproducible build, load and query benchmarks, written as JSON")
+    suite.add_argument('maps', nargs='*', help="map images, e.g. input/*.png input/*.gif")
+    suite.add_argument('--sizes', type=int, nargs='*', default=[1024, 2048, 4096], help="synthetic map sizes")
+    suite.add_argument('--levels', type=int, nargs='*', default=[128, 256], help="synthetic maze level sizes")
+    suite.add_argument('--queries', type=int, default=200)
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--output', help="JSON file to write the results to")
+    suite.add_argument('--compare', help="JSON file of earlier results to report ratios against")
+
+    anytime = commands.add_parser('anytime', help="frame-budgeted AnytimeSearch steps on cross-map queries")
+    anytime.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    anytime.add_argument('--queries', type=int, default=100)
+    anytime.add_argument('--budget-us', type=float, default=1000)
+    anytime.add_argument('--seed', type=int, default=0)
+
+    line_of_sight = commands.add_parser('los', help="find_path's straight-line fast path: hit rate and savings")
+    line_of_sight.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    line_of_sight.add_argument('--queries', type=int, default=500)
+    line_of_sight.add_argument('--radius', type=float, default=100, help="farthest apart nearby pairs may be")
+    line_of_sight.add_argument('--seed', type=int, default=0)
+
+    smoothing = commands.add_parser('smooth', help="per-crossing waypoints vs funnel path smoothing")
+    smoothing.add_argument('meshes', nargs='+', help=".mesh.pickle or .navmesh files")
+    smoothing.add_argument('--queries', type=int, default=300)
+    smoothing.add_argument('--seed', type=int, default=0)
+
+    merge = commands.add_parser('merge', help="find_path on built meshes vs the same meshes after merge_boxes")
+    merge.add_argument('meshes', nargs='+', help=".mesh.pickle files")
+    merge.add_argument('--queries', type=int, default=300)
+    merge.add_argument('--seed', type=int, default=0)
+
+    load_child = commands.add_parser('load-child')
+    load_child.add_argument('mesh')
+
+    args = parser.parse_args()
+
+    if args.command == 'locate':
+        for filename in args.meshes:
+            report(filename, bench_locate(load_mesh(filename), args.queries, args.seed))
+    elif args.command == 'expand':
+        for filename in args.meshes:
+            report(filename, bench_expansions(load_mesh(filename), args.queries, args.seed))
+    elif args.command == 'build':
+        image = synthetic_map(args.size, args.seed)
+        report("synthetic %dx%d" % (args.size, args.size),
+               bench_build(image, args.min_feature_size, args.workers))
+    elif args.command == 'load':
+        for filename in args.meshes:
+            report(filename, bench_load(filename))
+    elif args.command == 'batch':
+        for filename in args.meshes:
+            report(filename, bench_batch(filename, args.queries, args.seed, args.workers))
+    elif args.command == 'hierarchy':
+        for filename in args.meshes:
+            report(filename, bench_hierarchy(nm_navmesh.load(filename), args.queries, args.seed))
+    elif args.command == 'landmarks':
+        for filename in args.meshes:
+            report(filename, bench_landmarks(nm_navmesh.load(filename), args.queries, args.seed, args.landmarks))
+    elif args.command == 'contraction':
+        for filename in args.meshes:
+            report(filename, bench_contraction(nm_navmesh.load(filename), args.queries, args.seed))
+    elif args.command == 'flowfield':
+        for filename in args.meshes:
+            report(filename, bench_flow_field(nm_navmesh.load(filename), args.agents, args.destinations, args.seed))
+    elif args.command == 'grid':
+        for size in args.sizes:
+            report('%dx%d level' % (size, size), bench_grid(size, args.seed))
+    elif args.command == 'jps':
+        for size in args.sizes:
+            report('%dx%d open level' % (size, size), bench_jump_points(size, args.seed, args.patches))
+    elif args.command == 'levelload':
+        for size in args.sizes:
+            report('%dx%d level' % (size, size), bench_level_load(size, args.seed))
+    elif args.command == 'openlist':
+        for filename in args.meshes:
+            report(filename, bench_mesh_open_lists(nm_navmesh.load(filename), args.queries, args.seed))
+        for size in args.sizes:
+            report('%dx%d level' % (size, size), bench_grid_open_lists(size, args.seed))
+    elif args.command == 'stats':
+        for filename in args.meshes:
+            report(filename, bench_search_stats(nm_navmesh.load(filename), args.queries, args.seed))
+    elif args.command == 'suite':
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        results = run_suite(args.maps, args.sizes, args.levels, args.queries, args.seed)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write('\n')
+        for name, values in results.items():
+            report(name, values)
+        if baseline is not None:
+            for name, ratios in compare_suites(baseline, results).items():
+                report(name + ' vs ' + os.path.basename(args.compare), ratios)
+    elif args.command == 'anytime':
+        for filename in args.meshes:
+            report(filename, bench_anytime(nm_navmesh.load(filename), args.queries, args.seed, args.budget_us))
+    elif args.command == 'los':
+        for filename in args.meshes:
+            report(filename, bench_line_of_sight(nm_navmesh.load(filename), args.queries, args.seed, args.radius))
+    elif args.command == 'smooth':
+        for filename in args.meshes:
+            report(filename, bench_smoothing(nm_navmesh.load(filename), args.queries, args.seed))
+    elif args.command == 'merge':
+        for filename in args.meshes:
+            report(filename, bench_merge(load_mesh(filename), args.queries, args.seed))
+    elif args.command == 'load-child':
+        print(json.dumps(measure_load(args.mesh)))
+    elif args.command == 'patch':
+        for size in args.sizes:
+            report("synthetic %dx%d" % (size, size),
+                   bench_patch(synthetic_map(size, args.seed), args.min_feature_size, args.dirty, args.edits, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import sys
+from heapq import heapify, heappop, heappush
+
+import numpy
+
+import nm_navmesh
+from nm_navmesh import as_navmesh
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over the box graph of a NavMesh, for fast exact
+    shortest corridors on static maps.
+
+    Boxes are contracted one at a time, least important first. Contracting a
+    box removes it from the graph and adds a shortcut between each pair of
+    its remaining neighbors whose shortest connection ran through it. A query
+    then only ever climbs towards more important boxes from both ends, which
+    settles a few dozen boxes however far apart the ends are, and unpacks
+    the shortcuts of the route it finds back into ordinary adjacent boxes.
+
+    Edge weights are mesh.edge_costs, center to portal to center. Pass one to
+    find_path as router=..., along with its .mesh as the mesh to search, to use
+    it in place of search().
+    """
+
+    def __init__(self, mesh, rank=None, offsets=None, targets=None, costs=None, middles=None, witness_limit=64):
+        """
+        Args:
+            mesh: a NavMesh or {'boxes', 'adj'} dict
+            rank, offsets, targets, costs, middles: a previously built
+                hierarchy, as load() passes them
+            witness_limit: boxes a witness search may settle before giving
+                up and keeping a shortcut; larger is slower to build but adds
+                fewer needless shortcuts
+        """
+        self.mesh = mesh = as_navmesh(mesh)
+        if rank is None:
+            rank, offsets, targets, costs, middles = contract(mesh, witness_limit)
+        # upward graph in CSR form: box -> more important neighbors, with the
+        # contracted box each edge is a shortcut through, or -1
+        self.rank = numpy.asarray(rank)
+        self.offsets = numpy.asarray(offsets)
+        self.targets = numpy.asarray(targets)
+        self.costs = numpy.asarray(costs)
+        self.middles = numpy.asarray(middles)
+        if len(self.rank) != len(mesh) or len(self.offsets) != len(mesh) + 1:
+            raise ValueError("contraction hierarchy does not match the mesh")
+
+        offsets, targets, costs = self.offsets.tolist(), self.targets.tolist(), self.costs.tolist()
+        self.up = [list(zip(targets[offsets[box]:offsets[box + 1]], costs[offsets[box]:offsets[box + 1]]))
+                   for box in range(len(mesh))]
+        self.middle = {}
+        for box in range(len(mesh)):
+            for i in range(offsets[box], offsets[box + 1]):
+                if self.middles[i] >= 0:
+                    self.middle[box, targets[i]] = self.middle[targets[i], box] = int(self.middles[i])
+        self.last_expansions = 0
+
+    @property
+    def shortcuts(self):
+        return int((self.middles >= 0).sum())
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.rank, self.offsets, self.targets, self.costs, self.middles))
+
+    def distance(self, start_box, destination_box):
+        """
+        Returns:
+            The shortest corridor cost between two boxes, inf if they are not connected
+        """
+        return self._meet(start_box, destination_box)[0]
+
+    def corridor(self, mesh, start_box, destination_box, starting_point=None, destination_point=None):
+        """
+        Finds the shortest box corridor the way nm_pathfinder.search does.
+
+        Returns:
+            The list of box ids from start_box to destination_box, or [] if none exists
+        """
+        if mesh is not self.mesh:
+            raise ValueError("this hierarchy was built for a different mesh")
+        best, meeting, forward, backward = self._meet(start_box, destination_box)
+        if meeting is None:
+            return []
+        route = []
+        box = meeting
+        while box is not None:
+            route.append(box)
+            box = forward[box]
+        route.reverse()
+        box = backward[meeting]
+        while box is not None:
+            route.append(box)
+            box = backward[box]
+
+        corridor = [route[0]]
+        for a, b in zip(route, route[1:]):
+            stack = [(a, b)]
+            while stack:
+                a, b = stack.pop()
+                middle = self.middle.get((a, b))
+                if middle is None:
+                    corridor.append(b)
+                else:
+                    stack.append((middle, b))
+                    stack.append((a, middle))
+        return corridor
+
+    def _meet(self, start_box, destination_box):
+        # bidirectional Dijkstra over upward edges only; returns the best
+        # meeting box and both predecessor maps
+        up = self.up
+        reached = ({start_box: 0}, {destination_box: 0})
+        previous = ({start_box: None}, {destination_box: None})
+        settled = (set(), set())
+        queues = ([(0, start_box)], [(0, destination_box)])
+        best, meeting = float('inf'), None
+        expansions = 0
+        while queues[0] or queues[1]:
+            side = 0 if queues[0] and (not queues[1] or queues[0][0] <= queues[1][0]) else 1
+            distance, box = heappop(queues[side])
+            if distance >= best:
+                # nothing left on this side can improve on best
+                queues[side].clear()
+                continue
+            if box in settled[side]:
+                continue
+            settled[side].add(box)
+            expansions += 1
+            other = reached[1 - side].get(box)
+            if other is not None and distance + other < best:
+                best, meeting = distance + other, box
+            for neighbor, cost in up[box]:
+                candidate = distance + cost
+                if candidate < reached[side].get(neighbor, float('inf')):
+                    reached[side][neighbor] = candidate
+                    previous[side][neighbor] = box
+                    heappush(queues[side], (candidate, neighbor))
+        self.last_expansions = expansions
+        return best, meeting, previous[0], previous[1]
+
+
+def contract(mesh, witness_limit=64):
+    """
+    Contracts every box of mesh, ordered by edge difference.
+
+    Returns:
+        (rank, offsets, targets, costs, middles): the contraction order of
+            each box and the upward graph in CSR form
+    """
+    # remaining graph: box -> {neighbor: (cost, middle)}
+    graph = [dict() for _ in range(len(mesh))]
+    costs = mesh.edge_costs
+    for box, adjacent in enumerate(mesh.edges):
+        for neighbor, edge in adjacent:
+            if neighbor != box:
+                graph[box][neighbor] = (costs[edge], -1)
+
+    def shortcuts(box):
+        neighbors = list(graph[box].items())
+        added = []
+        for i, (u, (to_u, _)) in enumerate(neighbors):
+            through = {w: to_u + to_w for w, (to_w, _) in neighbors[i + 1:]}
+            if not through:
+                continue
+            witnesses = _witness_search(graph, u, box, max(through.values()), witness_limit)
+            added.extend((u, w, cost) for w, cost in through.items()
+                         if witnesses.get(w, float('inf')) > cost)
+        return added
+
+    contracted_neighbors = [0] * len(mesh)
+
+    def priority(box):
+        return len(shortcuts(box)) - len(graph[box]) + contracted_neighbors[box]
+
+    queue = [(priority(box), box) for box in range(len(mesh))]
+    heapify(queue)
+    rank = [0] * len(mesh)
+    upward = [None] * len(mesh)
+    order = 0
+    while queue:
+        _, box = heappop(queue)
+        # priorities go stale as the graph changes; recheck lazily
+        current = priority(box)
+        if queue and current > queue[0][0]:
+            heappush(queue, (current, box))
+            continue
+        for u, w, cost in shortcuts(box):
+            if cost < graph[u].get(w, (float('inf'),))[0]:
+                graph[u][w] = graph[w][u] = (cost, box)
+        upward[box] = graph[box]
+        for neighbor in graph[box]:
+            del graph[neighbor][box]
+            contracted_neighbors[neighbor] += 1
+        graph[box] = {}
+        rank[box] = order
+        order += 1
+
+    offsets = [0]
+    targets, weights, middles = [], [], []
+    for box in range(len(mesh)):
+        for neighbor, (cost, middle) in sorted(upward[box].items()):
+            targets.append(neighbor)
+            weights.append(cost)
+            middles.append(middle)
+        offsets.append(len(targets))
+    return (numpy.array(rank, dtype=numpy.int32), numpy.array(offsets, dtype=numpy.int64),
+            numpy.array(targets, dtype=numpy.int32), numpy.array(weights, dtype=numpy.float64),
+            numpy.array(middles, dtype=numpy.int32))
+
+
+def _witness_search(graph, source, avoided, limit, settle_limit):
+    # distances from source within the remaining graph, avoiding one box,
+    # up to cost limit; giving up early only adds a redundant shortcut
+    distances = {}
+    reached = {source: 0}
+    queue = [(0, source)]
+    while queue and len(distances) < settle_limit:
+        distance, box = heappop(queue)
+        if box in distances:
+            continue
+        if distance > limit:
+            break
+        distances[box] = distance
+        for neighbor, (cost, _) in graph[box].items():
+            if neighbor == avoided:
+                continue
+            candidate = distance + cost
+            if candidate < reached.get(neighbor, float('inf')):
+                reached[neighbor] = candidate
+                heappush(queue, (candidate, neighbor))
+    return reached
+
+
+def save(hierarchy, filename):
+    """
+    Writes the hierarchy, conventionally next to the mesh as <mesh>.ch.npz
+    """
+    with open(filename, 'wb') as f:
+        numpy.savez(f, rank=hierarchy.rank, offsets=hierarchy.offsets, targets=hierarchy.targets,
+                    costs=hierarchy.costs, middles=hierarchy.middles)
+
+
+def load(filename, mesh):
+    """
+    Reads a hierarchy written by save for the given mesh.
+    """
+    with numpy.load(filename) as arrays:
+        return ContractionHierarchy(mesh, arrays['rank'], arrays['offsets'], arrays['targets'],
+                                    arrays['costs'], arrays['middles'])
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print("usage: %s mesh_file" % sys.argv[0])
+        print("writes mesh_file.ch.npz")
+        sys.exit(-1)
+
+    mesh_filename = sys.argv[1]
+    save(ContractionHierarchy(nm_navmesh.load(mesh_filename)), mesh_filename + '.ch.npz')
@@ -0,0 +1,69 @@
+"""
+Checks for nm_contraction. Run them with pytest from this directory, or as a
+script: python nm_contraction_test.py
+"""
+import math
+import os
+import pickle
+import random
+import tempfile
+
+import nm_contraction
+import nm_pathfinder
+from nm_contraction import ContractionHierarchy
+from nm_navmesh import NavMesh
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+
+def corridor_cost(navmesh, corridor):
+    return sum(navmesh.edge_costs[navmesh.edge(a, b)] for a, b in zip(corridor, corridor[1:]))
+
+
+def test_contraction_is_exact():
+    with open(os.path.join(INPUT, 'ucsc_banana_slug.png.mesh.pickle'), 'rb') as f:
+        navmesh = NavMesh.from_dict(pickle.load(f))
+    # a tight witness limit adds redundant shortcuts, which must not change any answer
+    for witness_limit in (64, 4):
+        hierarchy = ContractionHierarchy(navmesh, witness_limit=witness_limit)
+        rng = random.Random(witness_limit)
+        for start_box in rng.sample(range(len(navmesh)), 10):
+            distances, _, _ = nm_pathfinder.box_dijkstra(navmesh, [start_box])
+            for destination_box in rng.sample(range(len(navmesh)), 30):
+                expected = distances.get(destination_box, math.inf)
+                assert math.isclose(hierarchy.distance(start_box, destination_box), expected), \
+                    (start_box, destination_box)
+                corridor = hierarchy.corridor(navmesh, start_box, destination_box)
+                if expected == math.inf:
+                    assert corridor == []
+                    continue
+                # the unpacked corridor walks adjacent boxes and costs the shortest distance
+                assert corridor[0] == start_box and corridor[-1] == destination_box
+                assert all(navmesh.edge(a, b) is not None for a, b in zip(corridor, corridor[1:]))
+                assert math.isclose(corridor_cost(navmesh, corridor), expected, abs_tol=1e-9)
+
+
+def test_contraction_save_and_load():
+    with open(os.path.join(INPUT, 'ucsc_banana_slug.png.mesh.pickle'), 'rb') as f:
+        navmesh = NavMesh.from_dict(pickle.load(f))
+    hierarchy = ContractionHierarchy(navmesh)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'slug.ch.npz')
+        nm_contraction.save(hierarchy, filename)
+        loaded = nm_contraction.load(filename, navmesh)
+    assert loaded.up == hierarchy.up and loaded.middle == hierarchy.middle
+    try:
+        ContractionHierarchy(NavMesh.from_dict({'boxes': [(0, 1, 0, 1)], 'adj': {}}), hierarchy.rank,
+                             hierarchy.offsets, hierarchy.targets, hierarchy.costs, hierarchy.middles)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("loaded a hierarchy onto a mesh it was not built for")
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
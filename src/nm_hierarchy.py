@@ -0,0 +1,131 @@
+from heapq import heappop, heappush
+
+from nm_navmesh import as_navmesh
+from nm_pathfinder import box_dijkstra, get_path, heuristic
+
+
+class Hierarchy:
+    """
+    Two-level (HPA*-style) search structure over a NavMesh.
+
+    Boxes are grouped into square clusters by their centers. Entrances are the
+    boxes with a neighbor in another cluster, and the costs between the
+    entrances of each cluster are precomputed. A query searches this small
+    graph of entrances, then refines only the clusters along the chosen route
+    back into ordinary boxes.
+
+    Pass one to find_path as router=... to use it in place of the flat search,
+    along with its .mesh as the mesh to search.
+    """
+
+    def __init__(self, mesh, cluster_size=None):
+        """
+        Args:
+            mesh: a NavMesh or {'boxes', 'adj'} dict
+            cluster_size: side of a cluster in map units, an eighth of the
+                map's longer side by default
+        """
+        self.mesh = mesh = as_navmesh(mesh)
+        self.centers = mesh.centers.tolist()
+        if cluster_size is None:
+            extent = max(mesh.bounds[:, 1].max(), mesh.bounds[:, 3].max()) if len(mesh) else 1
+            cluster_size = max(1, extent / 8)
+        self.cluster_size = cluster_size
+
+        clusters = {}
+        self.cluster = [clusters.setdefault((int(x // cluster_size), int(y // cluster_size)), len(clusters))
+                        for x, y in self.centers]
+        self.members = [set() for _ in clusters]
+        for box, cluster in enumerate(self.cluster):
+            self.members[cluster].add(box)
+
+        # abstract graph: entrance -> [(entrance, cost)], across and within clusters
+        costs = mesh.edge_costs
+        self.links = {}
+        for box, adjacent in enumerate(mesh.edges):
+            for neighbor, edge in adjacent:
+                if self.cluster[neighbor] != self.cluster[box]:
+                    self.links.setdefault(box, []).append((neighbor, costs[edge]))
+        self.entrances = [set() for _ in clusters]
+        for box in self.links:
+            self.entrances[self.cluster[box]].add(box)
+        for cluster, entrances in enumerate(self.entrances):
+            for entrance in entrances:
+                distances, _, _ = box_dijkstra(mesh, [entrance], self.members[cluster], entrances)
+                self.links[entrance].extend((other, distance) for other, distance in distances.items()
+                                            if other in entrances and other != entrance)
+
+        self.last_expansions = 0
+
+    def corridor(self, mesh, start_box, destination_box, starting_point=None, destination_point=None):
+        """
+        Finds a box corridor the way nm_pathfinder.search does, through the cluster graph.
+
+        Returns:
+            The list of box ids from start_box to destination_box, or [] if none exists
+        """
+        if mesh is not self.mesh:
+            raise ValueError("this hierarchy was built for a different mesh")
+        centers = self.centers
+        start_cluster = self.cluster[start_box]
+        destination_cluster = self.cluster[destination_box]
+
+        # connect the two end boxes to the entrances of their own clusters
+        start_targets = set(self.entrances[start_cluster])
+        if start_cluster == destination_cluster:
+            start_targets.add(destination_box)
+        start_distances, start_previous, start_expansions = box_dijkstra(
+            mesh, [start_box], self.members[start_cluster], start_targets)
+        end_distances, end_previous, end_expansions = box_dijkstra(
+            mesh, [destination_box], self.members[destination_cluster], self.entrances[destination_cluster])
+        expansions = start_expansions + end_expansions
+
+        def neighbors(box):
+            if box == start_box:
+                yield from ((other, cost) for other, cost in start_distances.items() if other in start_targets)
+            yield from self.links.get(box, ())
+            if box in end_distances and box != destination_box:
+                yield destination_box, end_distances[box]
+
+        # A* over the entrances
+        goal = centers[destination_box]
+        reached = {start_box: 0}
+        previous = {start_box: None}
+        done = set()
+        frontier = [(heuristic(centers[start_box], goal), start_box)]
+        while frontier:
+            _, box = heappop(frontier)
+            if box in done:
+                continue
+            done.add(box)
+            expansions += 1
+            if box == destination_box:
+                break
+            for other, cost in neighbors(box):
+                distance = reached[box] + cost
+                if other not in reached or distance < reached[other]:
+                    reached[other] = distance
+                    previous[other] = box
+                    heappush(frontier, (distance + heuristic(centers[other], goal), other))
+        else:
+            self.last_expansions = expansions
+            return []
+
+        # refine each hop of the route back into boxes
+        route = get_path(previous, destination_box)
+        corridor = [start_box]
+        for i in range(1, len(route)):
+            a, b = route[i - 1], route[i]
+            if self.cluster[a] != self.cluster[b]:
+                hop = [a, b]
+            elif a == start_box and b in start_previous:
+                hop = get_path(start_previous, b)
+            elif b == destination_box and a in end_previous:
+                hop = get_path(end_previous, a)[::-1]
+            else:
+                _, hop_previous, hop_expansions = box_dijkstra(mesh, [a], self.members[self.cluster[a]], [b])
+                hop = get_path(hop_previous, b)
+                expansions += hop_expansions
+            corridor.extend(hop[1:])
+        self.last_expansions = expansions
+        return corridor
@@ -0,0 +1,157 @@
+import math
+import sys
+
+import numpy
+
+import nm_navmesh
+from nm_navmesh import as_navmesh
+from nm_pathfinder import box_dijkstra, search
+
+
+class Landmarks:
+    """
+    ALT (A*, landmarks, triangle inequality) distance tables over a NavMesh.
+
+    A few landmark boxes are picked far apart and the box-graph distance from
+    each to every box is stored. For any two boxes, max over landmarks L of
+    |d(L, goal) - d(L, box)| then never exceeds their box-graph distance, and
+    unlike the straight line it accounts for walls: around a concave obstacle
+    it can be many times larger.
+
+    The box graph is weighted by mesh.edge_costs, center to portal to center,
+    which is not the corridor cost search() measures between exact points. So
+    the landmarks give search() an estimate of the remaining cost, not a lower
+    bound on it, and a search guided by them may return a slightly longer
+    corridor than the straight-line heuristic alone would.
+
+    Pass one to search as landmarks=..., or to find_path as router=... along
+    with its .mesh as the mesh to search.
+    """
+
+    def __init__(self, mesh, count=8, boxes=None, distances=None):
+        """
+        Args:
+            mesh: a NavMesh or {'boxes', 'adj'} dict
+            count: number of landmarks to pick
+            boxes, distances: previously computed landmark ids and their
+                (landmarks, boxes) distance table, as load() passes them
+        """
+        self.mesh = mesh = as_navmesh(mesh)
+        if distances is None:
+            boxes, distances = pick_landmarks(mesh, count)
+        self.boxes = list(boxes)
+        # stored a row per box, so that reading a box's distances is one contiguous read
+        self._by_box = numpy.ascontiguousarray(numpy.asarray(distances).T)
+        self.distances = self._by_box.T
+        if self.distances.shape != (len(self.boxes), len(mesh)):
+            raise ValueError("landmark table does not match the mesh")
+
+    def estimates(self, goal):
+        """
+        Returns:
+            A function of a box id giving the landmarks' estimate of its
+            distance to goal. Each call reads that box's row of the table, so
+            a query only pays for the boxes it expands.
+        """
+        by_box = self._by_box
+        to_goal = by_box[goal].tolist() if self.boxes else []
+        # a landmark that cannot reach goal says nothing about it
+        useful = [(k, distance) for k, distance in enumerate(to_goal) if math.isfinite(distance)]
+
+        def estimate(box):
+            row = by_box[box].tolist()
+            best = 0.0
+            for k, distance in useful:
+                difference = abs(row[k] - distance)
+                # nor does one that cannot reach box
+                if best < difference < math.inf:
+                    best = difference
+            return best
+        return estimate
+
+    def corridor(self, mesh, start_box, destination_box, starting_point=None, destination_point=None):
+        """
+        Router for find_path: search() guided by these landmarks.
+        """
+        if mesh is not self.mesh:
+            raise ValueError("these landmarks were computed for a different mesh")
+        return search(mesh, start_box, destination_box, starting_point, destination_point, landmarks=self)
+
+
+def pick_landmarks(mesh, count):
+    """
+    Picks landmarks by farthest-point selection over box-graph distance.
+
+    The first landmark is the box farthest from an arbitrary box of the
+    largest connected piece of the mesh, and each next one is the box there
+    farthest from all landmarks so far. Queries elsewhere get no bound beyond
+    the straight line.
+
+    Returns:
+        (boxes, distances): the landmark ids and their (count, len(mesh)) table
+            of distances, inf where a box is unreachable
+    """
+    boxes = []
+    rows = []
+    if not len(mesh):
+        return boxes, numpy.zeros((0, 0))
+    nearest = _distances_from(mesh, _largest_piece(mesh))
+    nearest[~numpy.isfinite(nearest)] = -1
+    while len(boxes) < min(count, len(mesh)):
+        candidate = int(numpy.argmax(nearest))
+        if nearest[candidate] <= 0 and boxes:
+            break
+        row = _distances_from(mesh, candidate)
+        boxes.append(candidate)
+        rows.append(row)
+        nearest = numpy.minimum(nearest, row)
+    return boxes, numpy.array(rows)
+
+
+def _largest_piece(mesh):
+    # a box of the connected component with the most boxes
+    seen = numpy.zeros(len(mesh), dtype=bool)
+    best, best_size = 0, 0
+    for box in range(len(mesh)):
+        if not seen[box]:
+            piece, _, _ = box_dijkstra(mesh, [box])
+            seen[list(piece)] = True
+            if len(piece) > best_size:
+                best, best_size = box, len(piece)
+    return best
+
+
+def _distances_from(mesh, box):
+    distances, _, _ = box_dijkstra(mesh, [box])
+    row = numpy.full(len(mesh), numpy.inf)
+    row[list(distances)] = list(distances.values())
+    return row
+
+
+def save(landmarks, filename):
+    """
+    Writes the landmark tables, conventionally next to the mesh as <mesh>.landmarks.npz
+    """
+    with open(filename, 'wb') as f:
+        numpy.savez(f, boxes=numpy.array(landmarks.boxes, dtype=numpy.int64),
+                    distances=landmarks.distances.astype(numpy.float32))
+
+
+def load(filename, mesh):
+    """
+    Reads landmark tables written by save for the given mesh.
+    """
+    with numpy.load(filename) as tables:
+        return Landmarks(mesh, boxes=tables['boxes'].tolist(), distances=tables['distances'])
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s mesh_file [landmark_count]" % sys.argv[0])
+        print("writes mesh_file.landmarks.npz")
+        sys.exit(-1)
+
+    mesh_filename = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else 8
+    save(Landmarks(nm_navmesh.load(mesh_filename), count), mesh_filename + '.landmarks.npz')
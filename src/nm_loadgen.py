@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy
+
+import nm_navmesh
+
+
+def random_queries(boxes, count, seed):
+    # point pairs drawn inside random boxes, so every query starts and ends on the mesh
+    rng = random.Random(seed)
+
+    def point():
+        x1, x2, y1, y2 = boxes[rng.randrange(len(boxes))]
+        return [rng.uniform(x1, x2), rng.uniform(y1, y2)]
+
+    return [(point(), point()) for _ in range(count)]
+
+
+async def run_connection(socket_path, mesh_name, queries, concurrency, deadline, latencies, errors):
+    """
+    Sends queries over one connection, keeping concurrency of them in flight,
+    until they run out or the deadline passes.
+    """
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=1 << 24)
+    sent = {}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send():
+        for i, (source, destination) in enumerate(queries):
+            await slots.acquire()
+            if time.perf_counter() > deadline:
+                break
+            request = {'id': i, 'source': source, 'destination': destination}
+            if mesh_name is not None:
+                request['mesh'] = mesh_name
+            sent[i] = time.perf_counter()
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+
+    async def receive():
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            started = sent.pop(reply.get('id'), None)
+            if 'error' in reply:
+                errors[reply['error']] = errors.get(reply['error'], 0) + 1
+            # a "no path" reply has a path too, an empty one, and was searched like any other
+            if 'path' in reply and started is not None:
+                latencies.append(time.perf_counter() - started)
+            slots.release()
+
+    receiver = asyncio.ensure_future(receive())
+    await send()
+    # wait for the replies still outstanding, then hang up
+    while sent and not receiver.done():
+        await asyncio.sleep(0.01)
+    receiver.cancel()
+    writer.close()
+
+
+async def generate_load(socket_path, mesh_name, queries, connections, concurrency, duration):
+    """
+    Runs a closed-loop load test against a running nm_server.
+
+    Returns:
+        A dict of the sustained rate of answered queries, their latency
+        percentiles in milliseconds, and counts of error replies
+    """
+    latencies = []
+    errors = {}
+    started = time.perf_counter()
+    deadline = started + duration
+    share = -(-len(queries) // connections)
+    await asyncio.gather(*(run_connection(socket_path, mesh_name, queries[i * share:(i + 1) * share],
+                                          concurrency, deadline, latencies, errors)
+                           for i in range(connections)))
+    elapsed = time.perf_counter() - started
+    results = {'queries': len(latencies), 'seconds': elapsed, 'qps': len(latencies) / elapsed}
+    if latencies:
+        milliseconds = numpy.array(latencies) * 1e3
+        for q in (50, 95, 99, 99.9):
+            results['p%g_ms' % q] = float(numpy.percentile(milliseconds, q))
+        results['max_ms'] = float(milliseconds.max())
+    results['errors'] = sum(errors.values())
+    results.update(('error: %s' % message, count) for message, count in errors.items())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measures sustained throughput and tail latency of nm_server")
+    parser.add_argument('socket', help="Unix domain socket the server listens on")
+    parser.add_argument('mesh', help="mesh file the server loaded, to draw query points from")
+    parser.add_argument('--name', help="mesh name to query, if the server serves several")
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16, help="queries in flight per connection")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to stop sending after")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    queries = random_queries(nm_navmesh.load(args.mesh).boxes, args.queries, args.seed)
+    results = asyncio.run(generate_load(args.socket, args.name, queries, args.connections, args.concurrency,
+                                        args.duration))
+    for key, value in results.items():
+        print("  %-28s %s" % (key, "%.3f" % value if isinstance(value, float) else value))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
+import bisect
 import collections
+import math
+import multiprocessing
 import pickle
 import sys
 import random
@@ -7,143 +10,642 @@ from matplotlib.pyplot import imread, imsave
 import numpy
 from numpy import zeros_like
 
+from nm_navmesh import BoxIndex
 
-def build_mesh(image, min_feature_size):
-    def scan(box):
+
+def read_map(filename):
+    """
+    Reads a map image as the 2-D uint8 map build_mesh takes.
+
+    PNGs read as floats in [0, 1] and GIFs as uint8 already; only the first
+    channel is kept.
+    """
+    image = imread(filename)
+    if image.dtype != numpy.uint8:
+        image = (image * 255).astype(dtype=numpy.uint8)
+    if len(image.shape) > 2:
+        image = image[:, :, 0]
+    return image
+
+
+def build_mesh(image, min_feature_size, mode='slice', workers=1):
+    """
+    Decomposes the walkable (== 255) pixels of image into adjacent boxes.
+
+    Args:
+        image: 2-D uint8 map
+        min_feature_size: boxes smaller than this many pixels are not split further
+        mode: 'slice' tests each box by comparing its pixels directly, 'integral'
+            answers the same tests from summed-area tables in constant time
+        workers: number of processes; more than one meshes the map in tiles
+            (see build_mesh_tiled), with the same result
+
+    Returns:
+        {'boxes': [...], 'adj': {box: [box, ...]}}
+    """
+    if workers > 1:
+        return build_mesh_tiled(image, min_feature_size, workers, mode)
+
+    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]), min_feature_size, *box_tests(image, mode))
+    return mesh_from_edges(edges)
+
+
+def box_tests(image, mode):
+    """Returns the (is_open, is_blocked) box predicates scan uses for image."""
+    if mode == 'slice':
+        def is_open(box):
+            x1, x2, y1, y2 = box
+            return (image[x1:x2, y1:y2] == 255).all()
+
+        def is_blocked(box):
+            x1, x2, y1, y2 = box
+            return (image[x1:x2, y1:y2] == 0).all()
+
+    elif mode == 'integral':
+        open_count = summed_area(image == 255)
+        blocked_count = summed_area(image == 0)
+
+        def is_open(box):
+            return box_sum(open_count, box) == box_area(box)
+
+        def is_blocked(box):
+            return box_sum(blocked_count, box) == box_area(box)
+
+    else:
+        raise ValueError("unknown build_mesh mode %r" % mode)
+
+    return is_open, is_blocked
+
+
+def build_mesh_tiled(image, min_feature_size, workers, mode='integral', tiles_per_worker=4):
+    """
+    Builds the same mesh as build_mesh, scanning tiles of the map in a process pool.
+
+    Tiles are the boxes scan itself would reach a few splits below the whole
+    map, so each worker runs the ordinary scan on its tile and the seams are
+    stitched by replaying merge_halves up the split tree: boxes that line up
+    across a seam are merged and boxes that touch across it get an edge.
+
+    Args:
+        image: 2-D uint8 map
+        min_feature_size: as for build_mesh
+        workers: size of the process pool
+        mode: box test used inside each tile, see build_mesh
+        tiles_per_worker: tiles queued per worker, to even out uneven tiles
+    """
+    depth = max(1, math.ceil(math.log2(workers * tiles_per_worker)))
+    is_open, is_blocked = box_tests(image, 'slice')
+    tree = tile_tree((0, image.shape[0], 0, image.shape[1]), depth, min_feature_size, is_open, is_blocked)
+
+    tiles = []
+    def collect(node):
+        if len(node) == 4:
+            tiles.append(node)
+        else:
+            collect(node[1])
+            collect(node[2])
+    collect(tree)
+
+    jobs = [(image[x1:x2, y1:y2], (x1, y1), min_feature_size, mode) for x1, x2, y1, y2 in tiles]
+    with multiprocessing.Pool(workers) as pool:
+        scanned = dict(zip(tiles, pool.map(scan_tile, jobs)))
+
+    def stitch(node):
+        if len(node) == 4:
+            return scanned[node]
+        return merge_halves(node[0], stitch(node[1]), stitch(node[2]))
+
+    boxes, edges = stitch(tree)
+    return mesh_from_edges(edges)
+
+
+def tile_tree(box, depth, min_feature_size, is_open, is_blocked):
+    # a tile is a box; a split is (box, first subtree, second subtree)
+    first_box, second_box = split_box(box)
+    if depth == 0 or box_area(box) < min_feature_size or first_box == box or is_open(box) or is_blocked(box):
+        return box
+    return (box,
+            tile_tree(first_box, depth - 1, min_feature_size, is_open, is_blocked),
+            tile_tree(second_box, depth - 1, min_feature_size, is_open, is_blocked))
+
+
+def scan_tile(job):
+    """Pool task: scans one tile in its own coordinates and shifts the result back onto the map."""
+    tile, (dx, dy), min_feature_size, mode = job
+
+    def shift(b): return (b[0] + dx, b[1] + dx, b[2] + dy, b[3] + dy)
+
+    boxes, edges = scan((0, tile.shape[0], 0, tile.shape[1]), min_feature_size, *box_tests(tile, mode))
+    return [shift(b) for b in boxes], [(shift(a), shift(b)) for a, b in edges]
+
+
+def patch_mesh(mesh, image, dirty_rect, min_feature_size, margin=1, index=None, mode='integral'):
+    """
+    Re-meshes the part of a mesh around a changed region of its map.
+
+    The split tree scan walks is followed down to the small nodes that overlap
+    dirty_rect (grown by margin), and only those nodes are scanned again from
+    the updated image. Old boxes overlapping them are dropped, keeping the
+    parts that stick out of them, and every new box is wired to the boxes it
+    touches. The walkable area covered, and so the connectivity, is the same as
+    a full rebuild's (except that an island a rebuild would mesh as a single
+    edgeless box, and drop, may survive as a few boxes).
+
+    Scanning and wiring only visit boxes near the change, but the result is a
+    new dict, copied from mesh, which has to be compiled again before it can be
+    queried. patch_navmesh patches a compiled mesh instead.
+
+    Args:
+        mesh: {'boxes', 'adj'} mesh of the map before the change; not modified
+        image: the updated 2-D uint8 map
+        dirty_rect: (x1, x2, y1, y2) pixels that changed
+        min_feature_size: as for build_mesh
+        margin: pixels around dirty_rect that are re-meshed too
+        index: BoxIndex over mesh["boxes"]; it is updated in place to describe
+            the returned mesh, so pass the same index to the next patch. One is
+            built (in time proportional to the mesh) when omitted.
+        mode: box test used for the re-scan, see build_mesh
+
+    Returns:
+        The patched mesh, as a new {'boxes', 'adj'} dict
+    """
+    if index is None:
+        index = BoxIndex(mesh['boxes'])
+    removed, new_boxes = patch_region(index, image, dirty_rect, min_feature_size, margin, mode)
+
+    # neighbor lists that change are copied, so the caller's mesh is left alone
+    adj = dict(mesh['adj'])
+    touched = set()
+
+    def rewire(box):
+        if box not in touched:
+            touched.add(box)
+            adj[box] = [other for other in adj[box] if other not in removed]
+
+    for box in removed:
+        for other in adj.pop(box, ()):
+            if other not in removed:
+                rewire(other)
+
+    added = set()
+    for box in new_boxes:
+        adj[box] = []
+    for box in new_boxes:
+        for box_id in index.overlapping(box, closed=True):
+            other = index.boxes[box_id]
+            if other not in adj:
+                continue
+            if box_id not in added:
+                rewire(other)
+            adj[box].append(other)
+            adj[other].append(box)
+        added.add(index.add(box))
+
+    # like build_mesh, keep only boxes that have a neighbor
+    for box_id in added:
+        box = index.boxes[box_id]
+        if not adj[box]:
+            del adj[box]
+            index.remove(box_id)
+    for box in touched:
+        if not adj[box]:
+            del adj[box]
+            for box_id in index.overlapping(box, closed=True):
+                if index.boxes[box_id] == box:
+                    index.remove(box_id)
+
+    return {'boxes': list(adj.keys()), 'adj': adj}
+
+
+def patch_navmesh(navmesh, image, dirty_rect, min_feature_size, margin=1, mode='integral'):
+    """
+    Re-meshes the part of a compiled mesh around a changed region of its map.
+
+    Boxes are re-scanned and wired as in patch_mesh, but the changes are
+    applied to the NavMesh's lookup lists by NavMesh.patched, so the result
+    can be queried straight away and the whole patch costs time proportional
+    to the change. Every box that stays keeps its id; new boxes take the ids
+    of removed ones first. The mesh's BoxIndex is updated in place and handed
+    on to the result, so the next patch and the first query reuse it.
+
+    Args:
+        navmesh: NavMesh of the map before the change; see NavMesh.patched
+            for what querying it afterwards costs
+        image, dirty_rect, min_feature_size, margin, mode: as for patch_mesh
+
+    Returns:
+        The patched NavMesh
+    """
+    index = navmesh.index
+    removed, new_boxes = patch_region(index, image, dirty_rect, min_feature_size, margin, mode)
+    dead = set(removed.values())
+
+    added = {}
+    edges = []
+    wired = collections.Counter()
+    for box in new_boxes:
+        others = index.overlapping(box, closed=True)
+        box_id = index.add(box)
+        added[box_id] = box
+        for other in others:
+            edges.append((box_id, other))
+            wired[box_id] += 1
+            wired[other] += 1
+
+    # like build_mesh, keep only boxes that have a neighbor
+    for box_id in [box_id for box_id in added if not wired[box_id]]:
+        index.remove(box_id)
+        del added[box_id]
+    lost = collections.Counter()
+    rows = navmesh.edges
+    for box_id in dead:
+        lost.update(neighbor for neighbor, edge in rows[box_id])
+    for box_id, count in lost.items():
+        if box_id not in dead and not wired[box_id] and count == len(rows[box_id]):
+            index.remove(box_id)
+            dead.add(box_id)
+
+    return navmesh.patched(dead, added, edges, index)
+
+
+def patch_region(index, image, dirty_rect, min_feature_size, margin, mode):
+    """
+    Finds the boxes a patch drops and the boxes that replace them.
+
+    The dropped boxes are unregistered from index; the new ones are not registered yet.
+
+    Returns:
+        ({dropped box: its position in index}, [new box, ...])
+    """
+    width, height = image.shape[:2]
+
+    x1, x2, y1, y2 = dirty_rect
+    region = (max(0, x1 - margin), min(width, x2 + margin), max(0, y1 - margin), min(height, y2 + margin))
+    is_open, is_blocked = box_tests(image, 'slice')
+
+    def is_uniform(box):
+        # a strided sample that is already mixed rules the box out without reading all of it
+        x1, x2, y1, y2 = box
+        step = max(1, int(math.sqrt(box_area(box))) // 16)
+        sample = image[x1:x2:step, y1:y2:step]
+        if not ((sample == 255).all() or (sample == 0).all()):
+            return False
+        return is_open(box) or is_blocked(box)
+
+    nodes = []
+    patch_nodes((0, width, 0, height), region, 4 * box_area(region), min_feature_size, is_uniform, nodes)
+
+    removed = {}
+    for node in nodes:
+        for box_id in index.overlapping(node):
+            removed[index.boxes[box_id]] = box_id
+    for box_id in removed.values():
+        index.remove(box_id)
+
+    # the parts of dropped boxes outside the re-scanned nodes are unchanged
+    new_boxes = []
+    for box in removed:
+        pieces = [box]
+        for node in nodes:
+            pieces = [rest for piece in pieces for rest in subtract_box(piece, node)]
+        new_boxes.extend(pieces)
+    for x1, x2, y1, y2 in nodes:
+        boxes, edges = scan_tile((image[x1:x2, y1:y2], (x1, y1), min_feature_size, mode))
+        new_boxes.extend(boxes)
+    return removed, list(dict.fromkeys(new_boxes))
+
+
+def patch_nodes(box, region, max_area, min_feature_size, is_uniform, nodes):
+    """
+    Collects the split-tree nodes patch_mesh re-scans for a changed region.
+
+    Descends from box the way scan splits, stopping at nodes that no longer
+    overlap region, at nodes of at most max_area, and at nodes scan would not
+    split in the updated image.
+    """
+    x1, x2, y1, y2 = box
+    rx1, rx2, ry1, ry2 = region
+    if max(x1, rx1) >= min(x2, rx2) or max(y1, ry1) >= min(y2, ry2):
+        return
+    first_box, second_box = split_box(box)
+    if box_area(box) <= max_area or box_area(box) < min_feature_size or first_box == box or is_uniform(box):
+        nodes.append(box)
+    else:
+        patch_nodes(first_box, region, max_area, min_feature_size, is_uniform, nodes)
+        patch_nodes(second_box, region, max_area, min_feature_size, is_uniform, nodes)
+
+
+def subtract_box(box, rect):
+    """Returns box minus rect as up to four boxes."""
+    x1, x2, y1, y2 = box
+    rx1, rx2, ry1, ry2 = rect
+    if rx1 >= x2 or x1 >= rx2 or ry1 >= y2 or y1 >= ry2:
+        return [box]
+    pieces = []
+    if x1 < rx1:
+        pieces.append((x1, rx1, y1, y2))
+    if rx2 < x2:
+        pieces.append((rx2, x2, y1, y2))
+    mx1, mx2 = max(x1, rx1), min(x2, rx2)
+    if y1 < ry1:
+        pieces.append((mx1, mx2, y1, ry1))
+    if ry2 < y2:
+        pieces.append((mx1, mx2, ry2, y2))
+    return pieces
+
+
+def mesh_from_edges(edges):
+    adj = collections.defaultdict(list)
+    for a, b in edges:
+        adj[a].append(b)
+        adj[b].append(a)
+
+    mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+
+    return mesh
+
+
+def merge_boxes(mesh):
+    """
+    Merges adjacent boxes into as few rectangles as it greedily can, after a build.
+
+    scan only glues boxes that line up exactly across the cut that split
+    them, so two boxes rarely form a rectangle on their own, but runs of
+    slivers across several cuts often do. The area the boxes cover is cut
+    into cells along every box edge; each row of cells is swept, each run of
+    covered cells is grown over the following rows as far as the whole run
+    stays covered, and the rectangle it makes becomes one box. Adjacency is
+    rebuilt from the new boxes, counting boxes that touch at a corner as
+    scan does.
+
+    Search gets cheaper, but find_path's default paths get longer: they
+    steer through a waypoint per box crossing, and wide boxes spread those
+    waypoints further apart. Query a merged mesh with smooth=True.
+
+    Args:
+        mesh: {'boxes': [...], 'adj': {box: [box, ...]}}, as build_mesh returns it
+
+    Returns:
+        A new mesh of the same form covering the same area, with no more
+        boxes than mesh
+    """
+    boxes = list(dict.fromkeys(mesh['boxes']))
+    if not boxes:
+        return {'boxes': [], 'adj': {}}
+    xs = sorted({x for box in boxes for x in box[:2]})
+    ys = sorted({y for box in boxes for y in box[2:]})
+    column = {x: i for i, x in enumerate(xs)}
+    row = {y: j for j, y in enumerate(ys)}
+    covered = numpy.zeros((len(xs) - 1, len(ys) - 1), dtype=bool)
+    for x1, x2, y1, y2 in boxes:
+        covered[column[x1]:column[x2], row[y1]:row[y2]] = True
+
+    merged = []
+    for i in range(covered.shape[0]):
+        cells = covered[i]
+        j = 0
+        while True:
+            start = numpy.flatnonzero(cells[j:])
+            if not start.size:
+                break
+            j += start[0]
+            gap = numpy.flatnonzero(~cells[j:])
+            end = j + (gap[0] if gap.size else cells.size - j)
+            i2 = i + 1
+            while i2 < covered.shape[0] and covered[i2, j:end].all():
+                i2 += 1
+            covered[i:i2, j:end] = False
+            merged.append((xs[i], xs[i2], ys[j], ys[end]))
+            j = end
+
+    if len(merged) >= len(boxes):
+        return {'boxes': boxes, 'adj': {box: list(dict.fromkeys(mesh['adj'].get(box, ()))) for box in boxes}}
+    return {'boxes': merged, 'adj': touching_boxes(merged)}
+
+
+def touching_boxes(boxes):
+    """
+    Finds which of a set of non-overlapping boxes touch, along an edge or at a corner.
+
+    Returns:
+        {box: [box, ...]} listing every box, in the order of boxes
+    """
+    adj = {box: [] for box in boxes}
+    for axis in (0, 2):
+        # boxes by their low edge on this axis, in order along the other axis;
+        # boxes sharing a low edge cannot overlap, so their high ends are in order too
+        lines = {}
+        for box in sorted(boxes, key=lambda box: box[2 - axis]):
+            lines.setdefault(box[axis], []).append(box)
+        ends = {edge: [box[3 - axis] for box in line] for edge, line in lines.items()}
+        for box in boxes:
+            line = lines.get(box[axis + 1], ())
+            if not line:
+                continue
+            k = bisect.bisect_left(ends[box[axis + 1]], box[2 - axis])
+            while k < len(line) and line[k][2 - axis] <= box[3 - axis]:
+                adj[box].append(line[k])
+                adj[line[k]].append(box)
+                k += 1
+    return {box: list(dict.fromkeys(adjacent)) for box, adjacent in adj.items()}
+
+
+def scan(root, min_feature_size, is_open, is_blocked):
+    """
+    Splits root until every box is open, blocked or below min_feature_size.
+
+    Halves are merged back bottom-up, gluing boxes that line up across each cut.
+    An explicit work stack replaces recursion so deep splits cannot hit the
+    interpreter's recursion limit.
+
+    Returns:
+        (boxes, edges) for root
+    """
+    results = []
+    work = [(root, False)]
+
+    while work:
+
+        box, halves_done = work.pop()
+
+        if halves_done:
+            second = results.pop()
+            first = results.pop()
+            results.append(merge_halves(box, first, second))
+            continue
 
         x1, x2, y1, y2 = box
         area = (x2 - x1) * (y2 - y1)
+        first_box, second_box = split_box(box)
 
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
+        if area < min_feature_size or is_open(box) or is_blocked(box) or first_box == box:
 
             # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
+            # (or too thin to split any further)
+            results.append(([box] if is_open(box) else [], []))
 
         else:
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+            # split this big box on the longest dimension, first half first
+            work.append((box, True))
+            work.append((second_box, False))
+            work.append((first_box, False))
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
+    return results.pop()
 
-                def rank(b): return (b[2], b[3])
 
-                def first_touch(b): return b[1] == cut
+def split_box(box):
+    x1, x2, y1, y2 = box
+    if x2 - x1 > y2 - y1:
+        cut = int(x1 + (x2 - x1) / 2 + 1)
+        return (x1, cut, y1, y2), (cut, x2, y1, y2)
+    else:
+        cut = int(y1 + (y2 - y1) / 2 + 1)
+        return (x1, x2, y1, cut), (x1, x2, cut, y2)
 
-                def second_touch(b): return b[0] == cut
 
-            else:
+def merge_halves(box, first, second):
+    """
+    Combines the (boxes, edges) of the two halves split_box made of box.
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
+    Boxes that span the same range on both sides of the cut are merged, and
+    boxes that touch across the cut get an edge.
+    """
+    x1, x2, y1, y2 = box
 
-                def rank(b): return (b[0], b[1])
+    if x2 - x1 > y2 - y1:
 
-                def first_touch(b): return b[3] == cut
+        cut = int(x1 + (x2 - x1) / 2 + 1)
 
-                def second_touch(b): return b[2] == cut
+        def rank(b): return (b[2], b[3])
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
+        def first_touch(b): return b[1] == cut
 
-            my_boxes = []
-            my_edges = []
+        def second_touch(b): return b[0] == cut
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+    else:
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+        cut = int(y1 + (y2 - y1) / 2 + 1)
 
-            first_merges = {}
-            second_merges = {}
+        def rank(b): return (b[0], b[1])
 
-            while first_touches and second_touches:
+        def first_touch(b): return b[3] == cut
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+        def second_touch(b): return b[2] == cut
 
-                if rf == rs:
+    first_boxes, first_edges = first
+    second_boxes, second_edges = second
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
+    my_boxes = []
+    my_edges = []
 
-                elif rf[1] < rs[1]:
+    my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
+    my_boxes.extend(
+        [sb for sb in second_boxes if not second_touch(sb)])
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
+    first_touches = sorted(filter(first_touch, first_boxes), key=rank)
+    second_touches = sorted(
+        filter(second_touch, second_boxes), key=rank)
 
-                elif rf[1] > rs[1]:
+    first_merges = {}
+    second_merges = {}
 
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
+    i, j = 0, 0
+    while i < len(first_touches) and j < len(second_touches):
 
-                else:
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = rank(f), rank(s)
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+        if rf == rs:
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            first_merges[f] = merged
+            second_merges[s] = merged
+            my_boxes.append(merged)
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+        elif rf[1] < rs[1]:
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
+            my_boxes.append(f)
+            i += 1
+            if rf[1] >= rs[0]:
+                my_edges.append((f, s))
 
-            return my_boxes, my_edges
+        elif rf[1] > rs[1]:
 
-            # end of scan
+            my_boxes.append(s)
+            j += 1
+            if rf[0] <= rs[1]:
+                my_edges.append((f, s))
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
+        else:
 
-    adj = collections.defaultdict(list)
-    for a, b in edges:
-        adj[a].append(b)
-        adj[b].append(a)
+            my_boxes.append(f)
+            my_boxes.append(s)
+            i += 1
+            j += 1
+            my_edges.append((f, s))
 
-    mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    my_boxes.extend(first_touches[i:])
+    my_boxes.extend(second_touches[j:])
 
-    return mesh
+    for a, b in first_edges:
+        my_edges.append(
+            (first_merges.get(a, a), first_merges.get(b, b)))
+
+    for a, b in second_edges:
+        my_edges.append(
+            (second_merges.get(a, a), second_merges.get(b, b)))
+
+    return my_boxes, my_edges
+
+
+def summed_area(mask):
+    """Returns the (w + 1, h + 1) summed-area table of a 2-D boolean mask."""
+    table = numpy.zeros((mask.shape[0] + 1, mask.shape[1] + 1),
+                        dtype=numpy.int32 if mask.size < 2 ** 31 else numpy.int64)
+    numpy.cumsum(mask, axis=0, dtype=table.dtype, out=table[1:, 1:])
+    numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def box_sum(table, box):
+    x1, x2, y1, y2 = box
+    return int(table[x2, y2] - table[x1, y2] - table[x2, y1] + table[x1, y1])
+
+
+def box_area(box):
+    x1, x2, y1, y2 = box
+    return (x2 - x1) * (y2 - y1)
 
 
 if __name__ == '__main__':
 
     min_feature_size = 16
+    workers = 1
     filename = None
-
-    if len(sys.argv) == 2:
-        filename = sys.argv[1]
-    elif len(sys.argv) == 3:
-        filename = sys.argv[1]
-        min_feature_size = int(sys.argv[2])
+    merge = '--merge' in sys.argv
+    argv = [arg for arg in sys.argv if arg != '--merge']
+
+    if len(argv) == 2:
+        filename = argv[1]
+    elif len(argv) in (3, 4):
+        filename = argv[1]
+        min_feature_size = int(argv[2])
+        if len(argv) == 4:
+            workers = int(argv[3])
     else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
+        print("usage: %s map_filename min_feature_size [workers] [--merge]" % sys.argv[0])
         sys.exit(-1)
 
-    img = (imread(filename) * 255).astype(dtype=numpy.uint8)
-    if len(img.shape) > 2:
-        img = img[:, :, 0]
+    img = read_map(filename)
 
-    mesh = build_mesh(img, min_feature_size)
+    mesh = build_mesh(img, min_feature_size, mode='integral', workers=workers)
+    if merge:
+        built = len(mesh['boxes'])
+        mesh = merge_boxes(mesh)
+        print("Merged %d boxes into %d." % (built, len(mesh['boxes'])))
 
     print(type(mesh))
     print(mesh.keys())
@@ -0,0 +1,173 @@
+"""
+Checks for nm_meshbuilder. Run them with pytest from this directory, or as a
+script: python nm_meshbuilder_test.py
+"""
+import os
+import pickle
+import random
+
+import numpy
+
+import nm_meshbuilder
+import nm_pathfinder
+from nm_navmesh import BoxIndex, NavMesh
+from nm_samples import random_pairs, synthetic_map
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+# boxes build_mesh makes of the shipped maps at min_feature_size 16
+MAPS = {'homer.png': 1527, 'ucsc_banana_slug.png': 727}
+
+
+def adjacency_sets(mesh):
+    # {box: neighbors} of a dict mesh, ignoring the order of boxes and neighbors
+    return {box: frozenset(mesh['adj'].get(box, ())) for box in mesh['boxes']}
+
+
+def pieces(navmesh):
+    # the connected piece each box belongs to, as the id of one of its boxes
+    piece = [None] * len(navmesh)
+    for box in range(len(navmesh)):
+        if piece[box] is None:
+            reached, _, _ = nm_pathfinder.box_dijkstra(navmesh, [box])
+            for other in reached:
+                piece[other] = box
+    return piece
+
+
+def random_edit(image, rng, sides=(4, 16, 64)):
+    # toggles a random square between wall and floor; returns it as a dirty rect
+    side = rng.choice(sides)
+    x, y = rng.randrange(image.shape[0] - side), rng.randrange(image.shape[1] - side)
+    image[x:x + side, y:y + side] = rng.choice([0, 255])
+    return x, x + side, y, y + side
+
+
+def sample_images():
+    return [nm_meshbuilder.read_map(os.path.join(INPUT, name)) for name in MAPS] + [synthetic_map(512, 1)]
+
+
+def test_integral_mode_matches_slice_mode():
+    for image in sample_images():
+        built = nm_meshbuilder.build_mesh(image, 16, 'slice')
+        integral = nm_meshbuilder.build_mesh(image, 16, 'integral')
+        assert sorted(integral['boxes']) == sorted(built['boxes'])
+        assert adjacency_sets(integral) == adjacency_sets(built)
+
+
+def test_build_matches_shipped_meshes():
+    for name, count in MAPS.items():
+        image = nm_meshbuilder.read_map(os.path.join(INPUT, name))
+        mesh = nm_meshbuilder.build_mesh(image, 16, 'integral')
+        assert len(mesh['boxes']) == count, name
+        covered = numpy.zeros(image.shape, dtype=bool)
+        for x1, x2, y1, y2 in mesh['boxes']:
+            covered[x1:x2, y1:y2] = True
+        assert (image[covered] == 255).all(), name
+        # the shipped mesh is this build, unmerged
+        with open(os.path.join(INPUT, name + '.mesh.pickle'), 'rb') as f:
+            shipped = pickle.load(f)
+        assert sorted(shipped['boxes']) == sorted(mesh['boxes']), name
+        assert adjacency_sets(shipped) == adjacency_sets(mesh), name
+
+
+def test_tiled_build_matches_single_process_build():
+    for image in sample_images():
+        for mode in ('slice', 'integral'):
+            built = nm_meshbuilder.build_mesh(image, 16, mode)
+            tiled = nm_meshbuilder.build_mesh(image, 16, mode, workers=2)
+            assert sorted(tiled['boxes']) == sorted(built['boxes'])
+            assert adjacency_sets(tiled) == adjacency_sets(built)
+
+
+def test_patch_matches_rebuild():
+    image = synthetic_map(512, 3)
+    mesh = nm_meshbuilder.build_mesh(image, 16, 'integral')
+    index = BoxIndex(mesh['boxes'])
+    navmesh = NavMesh.from_dict(mesh)
+    rng = random.Random(3)
+    for edit in range(12):
+        dirty = random_edit(image, rng)
+        mesh = nm_meshbuilder.patch_mesh(mesh, image, dirty, 16, index=index)
+        navmesh = nm_meshbuilder.patch_navmesh(navmesh, image, dirty, 16)
+        assert adjacency_sets(navmesh.to_dict()) == adjacency_sets(mesh), edit
+
+        # whatever a full rebuild can reach, the patched mesh reaches the same way
+        rebuilt = NavMesh.from_dict(nm_meshbuilder.build_mesh(image, 16, 'integral'))
+        rebuilt_pieces, patched_pieces = pieces(rebuilt), pieces(navmesh)
+        walkable = numpy.argwhere(image == 255)
+        points = [tuple(walkable[i] + 0.5) for i in numpy.random.default_rng(edit).choice(len(walkable), 200)]
+        seen = {}
+        for point in points:
+            rebuilt_box = rebuilt.locate(point)
+            if rebuilt_box is None:
+                continue
+            patched_box = navmesh.locate(point)
+            assert patched_box is not None, (edit, point)
+            pair = rebuilt_pieces[rebuilt_box], patched_pieces[patched_box]
+            # pieces correspond one to one
+            assert seen.setdefault(pair[0], pair[1]) == pair[1], (edit, point)
+        assert len(set(seen.values())) == len(seen), edit
+
+        for source, destination in random_pairs(rebuilt, 5, edit):
+            path, _ = nm_pathfinder.find_path(source, destination, navmesh)
+            rebuilt_path, _ = nm_pathfinder.find_path(source, destination, rebuilt)
+            assert bool(path) == bool(rebuilt_path), (edit, source, destination)
+
+
+def test_patch_reuses_ids():
+    image = synthetic_map(1024, 5)
+    navmesh = NavMesh.from_dict(nm_meshbuilder.build_mesh(image, 16, 'integral'))
+    original = navmesh
+    before = adjacency_sets(original.to_dict())
+    navmesh.edge_costs
+    rng = random.Random(5)
+    most_boxes = most_edges = 0
+    for edit in range(60):
+        navmesh = nm_meshbuilder.patch_navmesh(navmesh, image, random_edit(image, rng), 16)
+        live = sum(x1 < x2 for x1, x2, y1, y2 in navmesh.boxes)
+        most_boxes = max(most_boxes, live)
+        most_edges = max(most_edges, navmesh.num_edges)
+        # new boxes and edges fill the ids removed ones left
+        assert len(navmesh) <= most_boxes + 16, edit
+        assert len(navmesh.portal_list) <= most_edges + 64, edit
+
+    # the arrays built from the patched lists describe the same mesh
+    compiled = NavMesh(navmesh.bounds, navmesh.offsets, navmesh.neighbors)
+    assert (compiled.portals == navmesh.portals).all()
+    assert numpy.allclose(compiled.edge_costs, [navmesh.edge_costs[edge] for edge in navmesh.edge_ids.tolist()])
+    assert adjacency_sets(compiled.to_dict()) == adjacency_sets(navmesh.to_dict())
+    # the first mesh rebuilds its views from its own arrays
+    assert adjacency_sets(original.to_dict()) == before
+
+
+def coverage(boxes, shape):
+    # how many boxes cover each pixel
+    covered = numpy.zeros(shape, dtype=int)
+    for x1, x2, y1, y2 in boxes:
+        covered[x1:x2, y1:y2] += 1
+    return covered
+
+
+def test_merge_boxes_covers_the_same_area():
+    for image in sample_images():
+        built = nm_meshbuilder.build_mesh(image, 16)
+        merged = nm_meshbuilder.merge_boxes(built)
+        assert len(merged['boxes']) <= len(built['boxes'])
+        # the merged boxes cover what the built ones did (which may overlap), without overlapping
+        covered = coverage(merged['boxes'], image.shape)
+        assert covered.max() == 1
+        assert numpy.array_equal(covered > 0, coverage(built['boxes'], image.shape) > 0)
+        # adjacency is every pair of touching boxes, and merging keeps pieces connected
+        assert adjacency_sets(merged) == adjacency_sets(
+            {'boxes': merged['boxes'], 'adj': nm_meshbuilder.touching_boxes(merged['boxes'])})
+        built_mesh, merged_mesh = NavMesh.from_dict(built), NavMesh.from_dict(merged)
+        assert len(set(pieces(built_mesh))) == len(set(pieces(merged_mesh)))
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
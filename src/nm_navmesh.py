@@ -0,0 +1,618 @@
+import heapq
+import math
+import pickle
+import struct
+import sys
+
+import numpy
+
+
+class BoxIndex:
+    """
+    Uniform bucket grid over (x1, x2, y1, y2) boxes for point location.
+
+    Every box is registered in each bucket its half-open extent overlaps, so a
+    point only has to be tested against the few boxes sharing its bucket
+    instead of every box in the mesh. Boxes can be added and removed in place;
+    a removed box leaves None at its position so the other ids stay valid, and
+    the next box added takes the lowest free position.
+    """
+
+    def __init__(self, boxes, cell_size=None):
+        self.boxes = list(boxes)
+        # empty boxes, such as the removed boxes of a patched NavMesh, are free positions
+        self.free = [box_id for box_id, (x1, x2, y1, y2) in enumerate(self.boxes) if x1 >= x2 or y1 >= y2]
+        for box_id in self.free:
+            self.boxes[box_id] = None
+        if cell_size is None:
+            cell_size = default_cell_size([box for box in self.boxes if box is not None])
+        self.cell_size = cell_size
+        self.buckets = {}
+        for box_id, box in enumerate(self.boxes):
+            if box is not None:
+                for key in self._cells(box):
+                    self.buckets.setdefault(key, []).append(box_id)
+
+    def _cells(self, box, closed=False):
+        x1, x2, y1, y2 = box
+        s = self.cell_size
+        # [x1, x2) covers buckets floor(x1 / s) .. ceil(x2 / s) - 1; the closed
+        # [x1, x2] also reaches the neighboring bucket when an end sits on a bucket edge
+        if closed:
+            def first(v): return int(-(-v // s)) - 1
+            def stop(v): return int(v // s) + 1
+        else:
+            def first(v): return int(v // s)
+            def stop(v): return int(-(-v // s))
+        for bx in range(first(x1), stop(x2)):
+            for by in range(first(y1), stop(y2)):
+                yield bx, by
+
+    def add(self, box):
+        """Registers box at the lowest free position, or at the end, and returns its position."""
+        if self.free:
+            box_id = heapq.heappop(self.free)
+            self.boxes[box_id] = box
+        else:
+            box_id = len(self.boxes)
+            self.boxes.append(box)
+        for key in self._cells(box):
+            self.buckets.setdefault(key, []).append(box_id)
+        return box_id
+
+    def remove(self, box_id):
+        """Unregisters the box at position box_id and frees the position."""
+        for key in self._cells(self.boxes[box_id]):
+            bucket = self.buckets[key]
+            bucket.remove(box_id)
+            if not bucket:
+                del self.buckets[key]
+        self.boxes[box_id] = None
+        heapq.heappush(self.free, box_id)
+
+    def overlapping(self, rect, closed=False):
+        """
+        Returns the sorted positions of boxes that overlap rect = (x1, x2, y1, y2).
+
+        With closed=True boxes that only touch rect's border are included as well.
+        """
+        rx1, rx2, ry1, ry2 = rect
+        found = set()
+        for key in self._cells(rect, closed):
+            found.update(self.buckets.get(key, ()))
+        if closed:
+            def hits(x1, x2, y1, y2): return x1 <= rx2 and rx1 <= x2 and y1 <= ry2 and ry1 <= y2
+        else:
+            def hits(x1, x2, y1, y2): return x1 < rx2 and rx1 < x2 and y1 < ry2 and ry1 < y2
+        return sorted(box_id for box_id in found if hits(*self.boxes[box_id]))
+
+    def locate(self, point):
+        """
+        Returns the position in boxes of the first box containing point, or None.
+
+        Candidates are kept in insertion order, so while boxes are only added
+        at the end the answer is the same box a linear scan with in_bounds
+        would find. Where boxes overlap, a box added at a freed position may
+        be found after a box it overlaps at a higher position.
+        """
+        candidates = self.buckets.get((point[0] // self.cell_size, point[1] // self.cell_size))
+        if candidates:
+            x, y = point
+            boxes = self.boxes
+            for box_id in candidates:
+                x1, x2, y1, y2 = boxes[box_id]
+                if x1 <= x < x2 and y1 <= y < y2:
+                    return box_id
+        return None
+
+    def find(self, point):
+        """Returns the first box containing point, or None."""
+        box_id = self.locate(point)
+        return None if box_id is None else self.boxes[box_id]
+
+
+def default_cell_size(boxes):
+    # roughly one box per bucket on average
+    if not boxes:
+        return 1
+    area = sum((x2 - x1) * (y2 - y1) for x1, x2, y1, y2 in boxes)
+    return max(1, int(math.sqrt(area / len(boxes))))
+
+
+class NavMesh:
+    """
+    Compiled, read-only navmesh with integer box ids.
+
+    Box i spans bounds[i] = (x1, x2, y1, y2) and its neighbors are
+    neighbors[offsets[i]:offsets[i + 1]] (CSR adjacency). portals[e] holds
+    the shared segment (x1, y1, x2, y2) of edge e, next to neighbors[e]. Build one with
+    NavMesh.from_dict from nm_meshbuilder output and reuse it for every query;
+    nothing on it changes after construction.
+
+    The edge id of neighbors[e] is e, except in a mesh made by patched(),
+    which keeps the ids of the boxes and edges it did not change so their
+    lookup lists can be carried over. There edge_ids[e] is the id of
+    neighbors[e]; removed boxes are left as empty (0, 0, 0, 0) boxes with no
+    neighbors until a later patch reuses their ids, and so are the ids of
+    removed edges. NavMesh.from_dict(navmesh.to_dict()) compacts both away.
+    A patched mesh is held in its lookup lists; its arrays are only built if
+    they are asked for.
+    """
+
+    __slots__ = ('_bounds', '_offsets', '_neighbors', '_portal_array',
+                 '_boxes', '_adjacency', '_edges', '_portals', '_costs', '_ids', '_index', '_edge_ids',
+                 '_edge_id_count', '_free_edges')
+
+    def __init__(self, bounds, offsets, neighbors, portals=None):
+        self._bounds = _read_only(bounds)
+        self._offsets = _read_only(offsets)
+        self._neighbors = _read_only(neighbors)
+        if portals is None:
+            portals = compute_portals(self._bounds, self._offsets, self._neighbors)
+        self._portal_array = _read_only(portals)
+        self._boxes = None
+        self._adjacency = None
+        self._edges = None
+        self._portals = None
+        self._costs = None
+        self._ids = None
+        self._index = None
+        self._edge_ids = None
+        self._edge_id_count = len(self._neighbors)
+        self._free_edges = []
+
+    @classmethod
+    def from_dict(cls, mesh):
+        """
+        Compiles a {'boxes': [...], 'adj': {box: [box, ...]}} mesh.
+
+        Duplicate boxes and duplicate adjacency entries are dropped; ids follow
+        the order boxes first appear in mesh["boxes"], then in mesh["adj"].
+        """
+        ids = dict.fromkeys(mesh["boxes"])
+        for box, adjacent in mesh["adj"].items():
+            ids.setdefault(box)
+            for other in adjacent:
+                ids.setdefault(other)
+        for box_id, box in enumerate(ids):
+            ids[box] = box_id
+
+        offsets = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+        neighbors = []
+        for box, box_id in ids.items():
+            adjacent = dict.fromkeys(ids[other] for other in mesh["adj"].get(box, ()) if other != box)
+            neighbors.extend(adjacent)
+            offsets[box_id + 1] = len(neighbors)
+
+        navmesh = cls(_bounds_array(list(ids)), _narrow(offsets), numpy.array(neighbors, dtype=_id_type(len(ids))))
+        navmesh._ids = ids
+        return navmesh
+
+    def to_dict(self):
+        """Returns the mesh in the {'boxes', 'adj'} format nm_meshbuilder writes, without removed boxes."""
+        boxes = self.boxes
+        live = [i for i, box in enumerate(boxes) if box[0] < box[1]]
+        return {'boxes': [boxes[i] for i in live],
+                'adj': {boxes[i]: [boxes[j] for j in self.adjacency[i]] for i in live}}
+
+    def patched(self, removed, added, edges, index=None):
+        """
+        Returns the mesh with some boxes removed and others added.
+
+        Boxes and edges that do not change keep their ids, and the ids of
+        removed boxes and edges are handed out again, so a mesh patched over
+        and over stays about the size of a fresh build. The work is
+        proportional to the change, not the mesh: the lookup lists (boxes,
+        edges, portal_list, and adjacency, edge_costs and the box id map if
+        built) move to the result and are edited in place there.
+
+        This mesh keeps its arrays and rebuilds its lookup lists from them if
+        it is queried again, but anything still holding one of the moved lists,
+        such as an AnytimeSearch started on it, sees the patched mesh. A mesh
+        that was itself made by patched() has no arrays to rebuild from until
+        they are built, so it can't be queried once patched again.
+
+        Args:
+            removed: ids of boxes to drop along with their edges
+            added: {id: box} of boxes to add, at the ids of removed boxes or
+                past the last box (any ids skipped are left empty)
+            edges: (a, b) box id pairs to connect, each pair listed once
+            index: BoxIndex already describing the result, to use as its index.
+                This mesh's own index may be passed once it has been updated in
+                place; the mesh then gives it up and builds another if queried again.
+
+        Returns:
+            The patched NavMesh
+        """
+        boxes, rows, portals = self.boxes, self.edges, self.portal_list
+        adjacency, costs, ids = self._adjacency, self._costs, self._ids
+        free = list(self._free_edges)
+        removed = set(removed)
+
+        touched = set()
+        for a in removed:
+            for b, edge in rows[a]:
+                heapq.heappush(free, edge)
+                if b not in removed:
+                    touched.add(b)
+            rows[a] = []
+            if adjacency is not None:
+                adjacency[a] = []
+            if ids is not None and ids.get(boxes[a]) == a:
+                del ids[boxes[a]]
+            boxes[a] = _EMPTY
+        for b in touched:
+            kept = []
+            for neighbor, edge in rows[b]:
+                if neighbor in removed:
+                    heapq.heappush(free, edge)
+                else:
+                    kept.append((neighbor, edge))
+            rows[b] = kept
+            if adjacency is not None:
+                adjacency[b] = [neighbor for neighbor, edge in kept]
+
+        for box_id, box in added.items():
+            while len(boxes) <= box_id:
+                boxes.append(_EMPTY)
+                rows.append([])
+                if adjacency is not None:
+                    adjacency.append([])
+            boxes[box_id] = box = tuple(box)
+            if ids is not None:
+                ids[box] = box_id
+
+        for a, b in edges:
+            (ax1, ax2, ay1, ay2), (bx1, bx2, by1, by2) = boxes[a], boxes[b]
+            portal = (max(ax1, bx1), max(ay1, by1), min(ax2, bx2), min(ay2, by2))
+            if costs is not None:
+                middle = ((portal[0] + portal[2]) / 2.0, (portal[1] + portal[3]) / 2.0)
+                cost = (math.hypot(middle[0] - (ax1 + ax2) / 2.0, middle[1] - (ay1 + ay2) / 2.0) +
+                        math.hypot(middle[0] - (bx1 + bx2) / 2.0, middle[1] - (by1 + by2) / 2.0))
+            for source, target in ((a, b), (b, a)):
+                if free:
+                    edge = heapq.heappop(free)
+                    portals[edge] = portal
+                    if costs is not None:
+                        costs[edge] = cost
+                else:
+                    edge = len(portals)
+                    portals.append(portal)
+                    if costs is not None:
+                        costs.append(cost)
+                rows[source].append((target, edge))
+                if adjacency is not None:
+                    adjacency[source].append(target)
+
+        navmesh = NavMesh.__new__(NavMesh)
+        navmesh._bounds = navmesh._offsets = navmesh._neighbors = navmesh._portal_array = None
+        navmesh._edge_ids = None
+        navmesh._boxes, navmesh._edges, navmesh._portals = boxes, rows, portals
+        navmesh._adjacency, navmesh._costs, navmesh._ids = adjacency, costs, ids
+        navmesh._edge_id_count = len(portals)
+        navmesh._free_edges = free
+        navmesh._index = index
+        self._boxes = self._edges = self._portals = self._adjacency = self._costs = self._ids = None
+        if index is not None and index is self._index:
+            self._index = None
+        return navmesh
+
+    def _build_arrays(self):
+        # the arrays of a patched mesh, from the lookup lists it was patched through
+        if self._edges is None:
+            raise ValueError("this NavMesh has been patched; query the NavMesh patched() returned")
+        rows = self._edges
+        offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(row) for row in rows], out=offsets[1:])
+        pairs = numpy.array([pair for row in rows for pair in row], dtype=numpy.int64).reshape(-1, 2)
+        bounds = _bounds_array(self._boxes)
+        self._bounds = _read_only(bounds)
+        self._offsets = _read_only(_narrow(offsets))
+        self._neighbors = _read_only(pairs[:, 0].astype(_id_type(len(rows))))
+        self._edge_ids = _read_only(pairs[:, 1])
+        portals = numpy.array(self._portals, dtype=bounds.dtype).reshape(-1, 4)
+        self._portal_array = _read_only(portals[self._edge_ids])
+
+    @property
+    def bounds(self):
+        """(boxes, 4) array of (x1, x2, y1, y2)."""
+        if self._bounds is None:
+            self._build_arrays()
+        return self._bounds
+
+    @property
+    def offsets(self):
+        """Start of every box's neighbors in neighbors, plus the end of the last."""
+        if self._offsets is None:
+            self._build_arrays()
+        return self._offsets
+
+    @property
+    def neighbors(self):
+        """Neighbor ids of all boxes, concatenated in box order."""
+        if self._neighbors is None:
+            self._build_arrays()
+        return self._neighbors
+
+    @property
+    def portals(self):
+        """(edges, 4) array of the portal of every entry of neighbors."""
+        if self._portal_array is None:
+            self._build_arrays()
+        return self._portal_array
+
+    def __len__(self):
+        if self._bounds is None and self._boxes is not None:
+            return len(self._boxes)
+        return len(self.bounds)
+
+    @property
+    def edge_ids(self):
+        """Edge id of every entry of neighbors, as an array."""
+        neighbors = self.neighbors
+        if self._edge_ids is None:
+            return numpy.arange(len(neighbors))
+        return self._edge_ids
+
+    @property
+    def num_edges(self):
+        """Number of directed adjacency entries (each undirected edge counts twice)."""
+        if self._neighbors is None and self._edges is not None:
+            return sum(map(len, self._edges))
+        return len(self.neighbors)
+
+    def box(self, box_id):
+        """Returns the box tuple of one id, without building the boxes list."""
+        if self._boxes is not None:
+            return self._boxes[box_id]
+        return tuple(self.bounds[box_id].tolist())
+
+    @property
+    def boxes(self):
+        """Box tuples indexed by id."""
+        if self._boxes is None:
+            self._boxes = [tuple(box) for box in self.bounds.tolist()]
+        return self._boxes
+
+    @property
+    def adjacency(self):
+        """Neighbor ids of every box as Python lists, for tight search loops."""
+        if self._adjacency is None:
+            neighbors = self.neighbors.tolist()
+            offsets = self.offsets.tolist()
+            self._adjacency = list(map(neighbors.__getitem__, map(slice, offsets[:-1], offsets[1:])))
+        return self._adjacency
+
+    @property
+    def edges(self):
+        """(neighbor id, edge id) pairs of every box as Python lists."""
+        if self._edges is None:
+            # every (neighbor, edge id) pair in edge order, then sliced into rows
+            pairs = list(zip(self.neighbors.tolist(), self.edge_ids.tolist()))
+            offsets = self.offsets.tolist()
+            self._edges = list(map(pairs.__getitem__, map(slice, offsets[:-1], offsets[1:])))
+        return self._edges
+
+    @property
+    def portal_list(self):
+        """Portal tuples indexed by edge id."""
+        if self._portals is None:
+            self._portals = [tuple(portal) for portal in self._by_edge_id(self.portals).tolist()]
+        return self._portals
+
+    @property
+    def centers(self):
+        """(boxes, 2) array of box centers."""
+        return numpy.stack([(self.bounds[:, 0] + self.bounds[:, 1]) / 2.0,
+                            (self.bounds[:, 2] + self.bounds[:, 3]) / 2.0], axis=1)
+
+    @property
+    def edge_costs(self):
+        """
+        Length of every edge, indexed by edge id, as a Python list.
+
+        An edge is walked from the center of its box to the middle of its
+        portal and on to the center of the neighbor. These are the weights the
+        precomputed searches (hierarchy, landmarks, contraction) run on.
+        """
+        if self._costs is None:
+            centers = self.centers
+            sources = numpy.repeat(numpy.arange(len(self)), numpy.diff(self.offsets))
+            costs = edge_lengths(centers[sources], self.portals, centers[self.neighbors])
+            self._costs = self._by_edge_id(costs).tolist()
+        return self._costs
+
+    def _by_edge_id(self, values):
+        # rows of values, one per entry of neighbors, reordered by edge id
+        if self._edge_ids is None:
+            return values
+        by_id = numpy.zeros((self._edge_id_count,) + values.shape[1:], dtype=values.dtype)
+        by_id[self._edge_ids] = values
+        return by_id
+
+    def edge(self, a, b):
+        """Returns the id of the edge from box a to box b, or None if they are not adjacent."""
+        for neighbor, edge in self.edges[a]:
+            if neighbor == b:
+                return edge
+        return None
+
+    @property
+    def index(self):
+        """BoxIndex over boxes; its positions are box ids."""
+        if self._index is None:
+            self._index = BoxIndex(self.boxes)
+        return self._index
+
+    def box_id(self, box):
+        """Returns the id of a box tuple."""
+        if self._ids is None:
+            self._ids = {b: i for i, b in enumerate(self.boxes)}
+        return self._ids[box]
+
+    def locate(self, point):
+        """Returns the id of the box containing point, or None."""
+        return self.index.locate(point)
+
+
+# Binary mesh file layout (little-endian):
+#   header:   magic, format version, section count
+#   sections: name, dtype, rows, columns, byte offset of the data
+#   data:     each array in C order, starting on a 64-byte boundary
+MAGIC = b'NAVMESH\0'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<16s8sQQQ')
+_ALIGN = 64
+
+
+def save(navmesh, filename, portals=True):
+    """
+    Writes navmesh in the binary mesh format.
+
+    Args:
+        navmesh: the NavMesh to write
+        filename: output path, conventionally ending in .navmesh
+        portals: also store the portal array, so loading skips computing it
+    """
+    sections = [('bounds', navmesh.bounds), ('offsets', navmesh.offsets), ('neighbors', navmesh.neighbors)]
+    if portals:
+        sections.append(('portals', navmesh.portals))
+
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, array in sections:
+        offset = -(-offset // _ALIGN) * _ALIGN
+        array = numpy.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        table.append((name, array, offset))
+        offset += array.nbytes
+
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(table)))
+        for name, array, offset in table:
+            rows, columns = (array.shape + (0,))[:2]
+            f.write(_SECTION.pack(name.encode(), array.dtype.str.encode(), rows, columns, offset))
+        for name, array, offset in table:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(array.tobytes())
+
+
+def load(filename, mmap=True):
+    """
+    Reads a NavMesh from a binary mesh file, or from a .mesh.pickle dict.
+
+    Args:
+        filename: .navmesh file written by save, or a pickled {'boxes', 'adj'} dict
+        mmap: map the arrays read-only instead of reading them, so loading is
+            near-instant and processes opening the same file share its pages
+
+    Returns:
+        A NavMesh
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if not header.startswith(MAGIC):
+            f.seek(0)
+            return NavMesh.from_dict(pickle.load(f))
+        magic, version, count = _HEADER.unpack(header)
+        if version != FORMAT_VERSION:
+            raise ValueError("%s: unsupported mesh format version %d" % (filename, version))
+        table = [_SECTION.unpack(f.read(_SECTION.size)) for _ in range(count)]
+
+    arrays = {}
+    for name, dtype, rows, columns, offset in table:
+        shape = (rows, columns) if columns else (rows,)
+        dtype = numpy.dtype(dtype.rstrip(b'\0').decode())
+        if rows == 0:
+            arrays[name.rstrip(b'\0').decode()] = numpy.zeros(shape, dtype)
+        elif mmap:
+            arrays[name.rstrip(b'\0').decode()] = numpy.memmap(filename, dtype, 'r', offset, shape)
+        else:
+            arrays[name.rstrip(b'\0').decode()] = numpy.fromfile(filename, dtype, int(numpy.prod(shape)), offset=offset).reshape(shape)
+    return NavMesh(arrays['bounds'], arrays['offsets'], arrays['neighbors'], arrays.get('portals'))
+
+
+def convert(source, destination):
+    """Converts between .mesh.pickle and .navmesh files, picking the direction from destination's name."""
+    navmesh = load(source)
+    if destination.endswith('.pickle'):
+        with open(destination, 'wb') as f:
+            pickle.dump(navmesh.to_dict(), f, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        save(navmesh, destination)
+
+
+def as_navmesh(mesh):
+    """
+    Returns mesh as a NavMesh, compiling a dict mesh.
+
+    A dict is compiled afresh on every call, so changes made to it in place
+    are always seen. Callers that query one mesh repeatedly should compile it
+    once with NavMesh.from_dict and pass the NavMesh around instead.
+    """
+    if isinstance(mesh, NavMesh):
+        return mesh
+    return NavMesh.from_dict(mesh)
+
+
+def compute_portals(bounds, offsets, neighbors):
+    """
+    Computes the shared segment of every adjacency edge.
+
+    Returns:
+        An (edges, 4) array of (x1, y1, x2, y2): the overlap of the two boxes'
+        extents, a segment along their common side.
+    """
+    sources = numpy.repeat(numpy.arange(len(bounds)), numpy.diff(offsets))
+    return portal_segments(bounds[sources], bounds[neighbors])
+
+
+def edge_lengths(a_centers, portals, b_centers):
+    """Returns the lengths of the walks from each a center to the middle of its portal and on to its b center."""
+    middles = numpy.stack([(portals[:, 0] + portals[:, 2]) / 2.0, (portals[:, 1] + portals[:, 3]) / 2.0], axis=1)
+    return numpy.hypot(*(middles - a_centers).T) + numpy.hypot(*(b_centers - middles).T)
+
+
+def portal_segments(a, b):
+    """Returns the (x1, y1, x2, y2) overlap of each pair of boxes in the (n, 4) arrays a and b."""
+    return numpy.stack([numpy.maximum(a[:, 0], b[:, 0]), numpy.maximum(a[:, 2], b[:, 2]),
+                        numpy.minimum(a[:, 1], b[:, 1]), numpy.minimum(a[:, 3], b[:, 3])], axis=1)
+
+
+# what patched() leaves at the id of a removed box
+_EMPTY = (0, 0, 0, 0)
+
+
+def _bounds_array(boxes):
+    # (boxes, 4) array of box tuples, int32 when the coordinates fit
+    bounds = numpy.array(boxes, ndmin=2)
+    if bounds.size == 0:
+        bounds = bounds.reshape(0, 4)
+    if bounds.dtype.kind == 'i' and bounds.size and -2 ** 31 <= bounds.min() and bounds.max() < 2 ** 31:
+        bounds = bounds.astype(numpy.int32)
+    return numpy.ascontiguousarray(bounds)
+
+
+def _narrow(offsets):
+    return offsets.astype(numpy.int32) if offsets[-1] < 2 ** 31 else offsets
+
+
+def _id_type(count):
+    return numpy.int32 if count < 2 ** 31 else numpy.int64
+
+
+def _read_only(array):
+    # a read-only view: the caller's array keeps its flags, and memory-mapped data is not copied
+    view = numpy.asarray(array).view()
+    view.setflags(write=False)
+    return view
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 3:
+        print("usage: %s source_mesh destination_mesh" % sys.argv[0])
+        print("converts between .mesh.pickle and .navmesh files")
+        sys.exit(-1)
+
+    convert(sys.argv[1], sys.argv[2])
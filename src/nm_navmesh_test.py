@@ -0,0 +1,167 @@
+"""
+Checks for nm_navmesh. Run them with pytest from this directory, or as a
+script: python nm_navmesh_test.py
+"""
+import os
+import pickle
+import random
+import struct
+import tempfile
+
+import numpy
+
+import nm_navmesh
+from nm_navmesh import BoxIndex, NavMesh
+from nm_pathfinder import in_bounds
+from nm_samples import mesh_extent, random_points
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+
+def load_boxes(name):
+    with open(os.path.join(INPUT, name + '.mesh.pickle'), 'rb') as f:
+        return pickle.load(f)['boxes']
+
+
+def sample_points(boxes, seed):
+    # random points plus integer points, which land on box and bucket edges
+    width, height = mesh_extent(boxes)
+    rng = random.Random(seed)
+    corners = [(rng.randrange(width + 1), rng.randrange(height + 1)) for _ in range(1000)]
+    return random_points(boxes, 1000, seed) + corners
+
+
+def linear_locate(boxes, point):
+    for box_id, box in enumerate(boxes):
+        if box is not None and in_bounds(point, box):
+            return box_id
+    return None
+
+
+def test_box_index_matches_linear_scan():
+    for name in ('homer.png', 'ucsc_banana_slug.png'):
+        boxes = load_boxes(name)
+        for cell_size in (None, 1, 7, 64):
+            index = BoxIndex(boxes, cell_size)
+            for point in sample_points(boxes, 1):
+                box_id = linear_locate(boxes, point)
+                assert index.locate(point) == box_id, (name, cell_size, point)
+                assert index.find(point) == (None if box_id is None else boxes[box_id])
+
+
+def test_box_index_overlapping_matches_brute_force():
+    boxes = load_boxes('ucsc_banana_slug.png')
+    index = BoxIndex(boxes)
+    rng = random.Random(2)
+    width, height = mesh_extent(boxes)
+    for _ in range(300):
+        x1, y1 = rng.randrange(width), rng.randrange(height)
+        rect = (x1, x1 + rng.randrange(1, 80), y1, y1 + rng.randrange(1, 80))
+        rx1, rx2, ry1, ry2 = rect
+        expected = [i for i, (x1, x2, y1, y2) in enumerate(boxes)
+                    if x1 < rx2 and rx1 < x2 and y1 < ry2 and ry1 < y2]
+        touching = [i for i, (x1, x2, y1, y2) in enumerate(boxes)
+                    if x1 <= rx2 and rx1 <= x2 and y1 <= ry2 and ry1 <= y2]
+        assert index.overlapping(rect) == expected, rect
+        assert index.overlapping(rect, closed=True) == touching, rect
+
+
+def test_box_index_add_and_remove():
+    boxes = load_boxes('ucsc_banana_slug.png')
+    index = BoxIndex(boxes)
+    rng = random.Random(3)
+    live = dict(enumerate(boxes))
+    for box_id in rng.sample(range(len(boxes)), 100):
+        index.remove(box_id)
+        del live[box_id]
+    for box in rng.sample(boxes, 50):
+        box_id = index.add(box)
+        assert box_id not in live
+        live[box_id] = box
+    assert {box_id: box for box_id, box in enumerate(index.boxes) if box is not None} == live
+    # after edits the first match is no longer defined, but any live box containing the point is
+    for point in sample_points(boxes, 4):
+        box_id = index.locate(point)
+        if box_id is None:
+            assert not any(in_bounds(point, box) for box in live.values()), point
+        else:
+            assert in_bounds(point, live[box_id]), point
+
+
+def adjacency_sets(mesh):
+    return {box: frozenset(mesh['adj'].get(box, ())) for box in mesh['boxes']}
+
+
+def test_navmesh_round_trips_dict_meshes():
+    for name in ('homer.png', 'ucsc_banana_slug.png'):
+        with open(os.path.join(INPUT, name + '.mesh.pickle'), 'rb') as f:
+            mesh = pickle.load(f)
+        navmesh = NavMesh.from_dict(mesh)
+        assert navmesh.boxes == list(dict.fromkeys(mesh['boxes']))
+        for box_id, box in enumerate(navmesh.boxes):
+            assert navmesh.box_id(box) == box_id
+            assert [navmesh.boxes[j] for j in navmesh.adjacency[box_id]] == \
+                list(dict.fromkeys(other for other in mesh['adj'].get(box, ()) if other != box))
+        assert adjacency_sets(navmesh.to_dict()) == adjacency_sets(mesh)
+        assert not navmesh.bounds.flags.writeable and not navmesh.neighbors.flags.writeable
+
+
+def test_navmesh_leaves_caller_arrays_writable():
+    navmesh = NavMesh.from_dict({'boxes': [(0, 2, 0, 2), (2, 4, 0, 2)],
+                                 'adj': {(0, 2, 0, 2): [(2, 4, 0, 2)], (2, 4, 0, 2): [(0, 2, 0, 2)]}})
+    bounds = numpy.array(navmesh.bounds)
+    offsets = numpy.array(navmesh.offsets)
+    neighbors = numpy.array(navmesh.neighbors)
+    portals = numpy.array(navmesh.portals)
+    copy = NavMesh(bounds, offsets, neighbors, portals)
+    for array in (bounds, offsets, neighbors, portals):
+        assert array.flags.writeable
+    for array in (copy.bounds, copy.offsets, copy.neighbors, copy.portals):
+        assert not array.flags.writeable
+
+
+def test_save_and_load_round_trip():
+    with open(os.path.join(INPUT, 'ucsc_banana_slug.png.mesh.pickle'), 'rb') as f:
+        mesh = pickle.load(f)
+    navmesh = NavMesh.from_dict(mesh)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'slug.navmesh')
+        for portals in (True, False):
+            nm_navmesh.save(navmesh, filename, portals=portals)
+            for mmap in (True, False):
+                loaded = nm_navmesh.load(filename, mmap=mmap)
+                for name in ('bounds', 'offsets', 'neighbors', 'portals'):
+                    expected, actual = getattr(navmesh, name), getattr(loaded, name)
+                    assert actual.dtype == expected.dtype and (actual == expected).all(), (name, portals, mmap)
+                assert loaded.edge_costs == navmesh.edge_costs
+                del loaded
+
+        # pickle to binary and back
+        source = os.path.join(directory, 'slug.mesh.pickle')
+        with open(source, 'wb') as f:
+            pickle.dump(mesh, f)
+        nm_navmesh.convert(source, filename)
+        back = os.path.join(directory, 'back.mesh.pickle')
+        nm_navmesh.convert(filename, back)
+        with open(back, 'rb') as f:
+            assert adjacency_sets(pickle.load(f)) == adjacency_sets(mesh)
+        assert nm_navmesh.load(source).boxes == navmesh.boxes
+
+        # files from another format version are refused, not misread
+        with open(filename, 'r+b') as f:
+            f.seek(len(nm_navmesh.MAGIC))
+            f.write(struct.pack('<I', nm_navmesh.FORMAT_VERSION + 1))
+        try:
+            nm_navmesh.load(filename)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("loaded a mesh of an unknown format version")
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
@@ -0,0 +1,177 @@
+from heapq import heappop, heappush
+import struct
+
+_DOUBLE = struct.Struct('<d')
+_BITS = struct.Struct('<Q')
+
+
+class HeapQueue:
+    """
+    Open list on a plain binary heap (heapq)
+
+    Pushing an item again adds a second entry rather than updating the first,
+    so the search sees the stale one later and must skip it. Equal priorities
+    pop in item order, as tuples on a heap do.
+
+    All open lists share this interface: push(priority, item), pop() ->
+    (priority, item), len() and stats().
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.pushes = 0
+        self.pops = 0
+        self.peak = 0
+
+    def push(self, priority, item):
+        heappush(self.heap, (priority, item))
+        self.pushes += 1
+        self.peak = max(self.peak, len(self.heap))
+
+    def pop(self):
+        self.pops += 1
+        return heappop(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def stats(self):
+        return {'pushes': self.pushes, 'pops': self.pops, 'decreases': 0, 'peak': self.peak}
+
+
+class IndexedHeap(HeapQueue):
+    """
+    Binary heap that keeps one entry per item, with decrease-key
+
+    Pushing an item that is already queued moves its entry to the new priority
+    instead of adding another, so the heap never holds stale entries. Items
+    must be hashable.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.positions = {}
+        self.decreases = 0
+
+    def push(self, priority, item):
+        position = self.positions.get(item)
+        if position is None:
+            self.heap.append((priority, item))
+            self.positions[item] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+            self.pushes += 1
+            self.peak = max(self.peak, len(self.heap))
+        else:
+            old = self.heap[position][0]
+            self.heap[position] = (priority, item)
+            self.decreases += 1
+            if priority < old:
+                self._sift_up(position)
+            else:
+                self._sift_down(position)
+
+    def pop(self):
+        self.pops += 1
+        heap = self.heap
+        last = heap.pop()
+        if not heap:
+            del self.positions[last[1]]
+            return last
+        top = heap[0]
+        heap[0] = last
+        self.positions[last[1]] = 0
+        del self.positions[top[1]]
+        self._sift_down(0)
+        return top
+
+    def _sift_up(self, position):
+        heap, positions = self.heap, self.positions
+        entry = heap[position]
+        while position:
+            parent = (position - 1) >> 1
+            if heap[parent] <= entry:
+                break
+            heap[position] = heap[parent]
+            positions[heap[position][1]] = position
+            position = parent
+        heap[position] = entry
+        positions[entry[1]] = position
+
+    def _sift_down(self, position):
+        heap, positions = self.heap, self.positions
+        size = len(heap)
+        entry = heap[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[position] = heap[child]
+            positions[heap[position][1]] = position
+            position = child
+        heap[position] = entry
+        positions[entry[1]] = position
+
+    def stats(self):
+        return {'pushes': self.pushes, 'pops': self.pops, 'decreases': self.decreases, 'peak': self.peak}
+
+
+class RadixHeap(HeapQueue):
+    """
+    Radix heap for monotone searches, such as Dijkstra with non-negative costs
+
+    Priorities must be non-negative and never below the last one popped;
+    pushing one that is raises ValueError. Entries sit in buckets by the
+    highest bit in which their priority differs from the last popped one, so
+    each entry is only moved a few times however large the open list grows.
+    Like HeapQueue it keeps stale entries, and equal priorities pop in item
+    order.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = [[] for _ in range(65)]
+        self.last = 0
+        self.last_priority = 0
+        self.size = 0
+
+    def push(self, priority, item):
+        if priority < self.last_priority:
+            raise ValueError("priority %r is below the last popped priority %r" % (priority, self.last_priority))
+        # the bits of a non-negative double (+ 0.0 turns -0.0 into 0.0) order the same way as its value
+        key = _BITS.unpack(_DOUBLE.pack(float(priority) + 0.0))[0]
+        bucket = (key ^ self.last).bit_length()
+        if bucket:
+            self.buckets[bucket].append((key, priority, item))
+        else:
+            heappush(self.buckets[0], (item, priority))
+        self.size += 1
+        self.pushes += 1
+        self.peak = max(self.peak, self.size)
+
+    def pop(self):
+        buckets = self.buckets
+        if not buckets[0]:
+            index = 1
+            while not buckets[index]:
+                index += 1
+            entries = buckets[index]
+            buckets[index] = []
+            self.last = last = min(entry[0] for entry in entries)
+            for key, priority, item in entries:
+                bucket = (key ^ last).bit_length()
+                if bucket:
+                    buckets[bucket].append((key, priority, item))
+                else:
+                    heappush(buckets[0], (item, priority))
+        item, priority = heappop(buckets[0])
+        self.last_priority = priority
+        self.size -= 1
+        self.pops += 1
+        return priority, item
+
+    def __len__(self):
+        return self.size
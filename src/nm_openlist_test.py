@@ -0,0 +1,101 @@
+"""
+Checks for nm_openlist. Run them with pytest from this directory, or as a
+script: python nm_openlist_test.py
+"""
+import math
+import os
+import pickle
+import random
+
+import Dijkstra
+import nm_pathfinder
+from Dijkstra_Forward_Search import maze_environment
+from nm_navmesh import NavMesh
+from nm_openlist import HeapQueue, IndexedHeap, RadixHeap
+from nm_samples import load_level_text, open_level, random_pairs
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+OPEN_LISTS = (HeapQueue, IndexedHeap, RadixHeap)
+
+
+def load_navmesh(name):
+    with open(os.path.join(INPUT, name + '.mesh.pickle'), 'rb') as f:
+        return NavMesh.from_dict(pickle.load(f))
+
+
+def test_open_lists_pop_in_order():
+    rng = random.Random(0)
+    for open_list in OPEN_LISTS:
+        queue = open_list()
+        # HeapQueue and RadixHeap keep every entry pushed; IndexedHeap keeps one per item, moved on re-push
+        entries = [] if open_list is not IndexedHeap else {}
+        last = 0.
+        for _ in range(3000):
+            if entries and rng.random() < 0.4:
+                if isinstance(entries, dict):
+                    expected = min((priority, item) for item, priority in entries.items())
+                    del entries[expected[1]]
+                else:
+                    expected = min(entries)
+                    entries.remove(expected)
+                assert queue.pop() == expected, open_list.__name__
+                last = expected[0]
+            else:
+                # monotone priorities with whole-number ties, so a RadixHeap takes them too
+                priority, item = last + rng.choice([0, 1, 2, rng.random() * 10]), rng.randrange(200)
+                queue.push(priority, item)
+                if isinstance(entries, dict):
+                    entries[item] = priority
+                else:
+                    entries.append((priority, item))
+            assert len(queue) == len(entries), open_list.__name__
+
+    radix = RadixHeap()
+    radix.push(5, 'a')
+    radix.pop()
+    try:
+        radix.push(4, 'b')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("RadixHeap took a priority below the last one popped")
+
+
+def test_searches_agree_across_open_lists():
+    navmesh = load_navmesh('homer.png')
+    for sources in ([0], [1, len(navmesh) // 2, len(navmesh) - 1]):
+        expected, _, _ = nm_pathfinder.box_dijkstra(navmesh, sources)
+        for open_list in OPEN_LISTS:
+            distances, _, _ = nm_pathfinder.box_dijkstra(navmesh, sources, open_list=open_list())
+            assert distances == expected, open_list.__name__
+
+    level = load_level_text(open_level(48, 1, patches=3))
+    grid = maze_environment.grid_from_level(level)
+    source, destination = level['waypoints']['a'], level['waypoints']['b']
+    expected = Dijkstra.grid_dijkstras_shortest_path(source, destination, grid)
+    costs = Dijkstra.grid_distance_map([source], grid)
+    for open_list in OPEN_LISTS:
+        assert Dijkstra.grid_dijkstras_shortest_path(source, destination, grid, open_list()) == expected
+        assert (Dijkstra.grid_distance_map([source], grid, open_list=open_list()) == costs).all()
+        path = Dijkstra.dijkstras_shortest_path(source, destination, level, Dijkstra.navigation_edges,
+                                                open_list=open_list())
+        assert path == expected, open_list.__name__
+
+    # search() is not exact, so only ask for a valid corridor whenever the default finds one
+    for source, destination in random_pairs(navmesh, 50, 1):
+        start_box, destination_box = navmesh.locate(source), navmesh.locate(destination)
+        expected = nm_pathfinder.search(navmesh, start_box, destination_box, source, destination)
+        corridor = nm_pathfinder.search(navmesh, start_box, destination_box, source, destination,
+                                        open_list=IndexedHeap())
+        assert bool(corridor) == bool(expected)
+        if corridor:
+            assert corridor[0] == start_box and corridor[-1] == destination_box
+            assert all(navmesh.edge(a, b) is not None for a, b in zip(corridor, corridor[1:]))
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
@@ -1,7 +1,16 @@
-from queue import PriorityQueue
+from collections import OrderedDict
 import math
+import multiprocessing
+import time
 
-def find_path (source_point, destination_point, mesh):
+import numpy
+
+import nm_navmesh
+from nm_navmesh import as_navmesh
+from nm_openlist import HeapQueue
+
+def find_path (source_point, destination_point, mesh, cache=None, router=None, stats=None, line_of_sight=False,
+               smooth=False):
 
     """
     Searches for a path from source_point to destination_point through the mesh
@@ -9,50 +18,379 @@ def find_path (source_point, destination_point, mesh):
     Args:
         source_point: starting point of the pathfinder
         destination_point: the ultimate goal the pathfinder must reach
-        mesh: pathway constraints the path adheres to
+        mesh: pathway constraints the path adheres to, either a NavMesh or the
+            {'boxes', 'adj'} dict written by nm_meshbuilder. A dict is compiled on
+            every call; compile it once with NavMesh.from_dict for repeated
+            queries. A cache or router belongs to one NavMesh, so passing
+            either with a dict raises TypeError
+        cache: optional CorridorCache; queries between an already searched pair
+            of boxes reuse that corridor and only re-place the waypoints
+        router: optional precomputed search structure, such as
+            nm_hierarchy.Hierarchy or a FlowFieldCache, whose corridor() replaces search()
+        stats: optional SearchStats, reset and filled in for this query
+        line_of_sight: first walk the straight segment between the points
+            (see visible_corridor); if it stays on the mesh, return it without
+            searching. Off by default: the answer is then the two end points
+            and the boxes the segment crosses, not a waypoint per box crossing
+            along a searched corridor
+        smooth: pull the path taut through the corridor (see funnel_path), keeping
+            only the waypoints at wall corners, instead of placing one per box crossing
 
     Returns:
 
         A path (list of points) from source_point to destination_point if exists
         A list of boxes explored by the algorithm
     """
-    # remove duplicates
-    mesh["boxes"] = list(set(mesh["boxes"]))
-    for key in mesh["adj"]:
-        mesh["adj"][key] = list(set(mesh["adj"][key]))
+    if (cache is not None or router is not None) and not isinstance(mesh, nm_navmesh.NavMesh):
+        raise TypeError("find_path needs a NavMesh to use a cache or router; compile the mesh once with "
+                        "NavMesh.from_dict")
+    if stats is not None:
+        stats.reset()
+    navmesh = as_navmesh(mesh)
+    boxes = navmesh.boxes
     #variables
-    start_box = next((box for box in mesh["boxes"] if in_bounds(source_point, box)), None)
-    destination_box = next((box for box in mesh["boxes"] if in_bounds(destination_point, box)), None)
+    start_box = navmesh.locate(source_point)
+    destination_box = navmesh.locate(destination_point)
     path = []
-    boxes = []
-    
-    #check if both source and destination are in the same box, or if there is no path
-    if start_box == destination_box:
-        return [source_point, destination_point], [start_box]
-    if not start_box or not destination_box:
+    corridor = []
+
+    #check if there is no path, or if both source and destination are in the same box
+    if start_box is None or destination_box is None:
         print ("No Path Found!")
+        if stats is not None:
+            stats.finish(False)
         return [], []
+    if start_box == destination_box:
+        if stats is not None:
+            stats.finish(True)
+        return [source_point, destination_point], [boxes[start_box]]
+    if line_of_sight:
+        corridor = visible_corridor(navmesh, start_box, destination_box, source_point, destination_point)
+        if corridor is not None:
+            if stats is not None:
+                stats.direct = True
+                stats.finish(True)
+            return [source_point, destination_point], [boxes[box] for box in corridor]
 
     #BFS to get boxes
-    boxes = search(mesh["adj"], start_box, destination_box, source_point, destination_point)
+    corridor = None if cache is None else cache.get(navmesh, start_box, destination_box)
+    if corridor is None:
+        if router is not None:
+            corridor = router.corridor(navmesh, start_box, destination_box, source_point, destination_point)
+        else:
+            corridor = search(navmesh, start_box, destination_box, source_point, destination_point, stats=stats)
+        if cache is not None:
+            cache.put(navmesh, start_box, destination_box, corridor)
+    elif stats is not None:
+        stats.cached = True
+    if not corridor:
+        print ("No Path Found!")
+        if stats is not None:
+            stats.finish(False)
+        return [], []
 
     # center = lambda box: ((box[0] + box[1]) / 2.0, (box[2] + box[3]) / 2.0)
     # path = [center(start_box), center(destination_box)]
 
-    path = [source_point]
-    for i in range(1, len(boxes)):
-        start_point = None
-        end_point = None
-        if path:
+    if smooth:
+        path = funnel_path(navmesh, corridor, source_point, destination_point)
+    else:
+        portals = navmesh.portal_list
+        point = portal_point if stats is None else stats.timed_point(portal_point)
+        path = [source_point]
+        for i in range(1, len(corridor)):
             start_point = path[-1]
-        if boxes[i] == destination_box:
-            end_point = destination_point
-        path.append(get_point(boxes[i-1], boxes[i], start_point, end_point))
-    path.append(destination_point)
+            if corridor[i] == destination_box:
+                end_point = destination_point
+            else:
+                end_point = center(boxes[corridor[i]])
+            path.append(point(portals[navmesh.edge(corridor[i-1], corridor[i])], start_point, end_point))
+        path.append(destination_point)
+    if stats is not None:
+        stats.finish(True)
     #print("Boxes: ", boxes, " Path: ", path) #print statement for testing
-    return path, boxes
+    return path, [boxes[box] for box in corridor]
 #find_path end========================================
 
+class CorridorCache:
+    """
+    Bounded LRU cache of the box corridors search() returns, keyed by (start box, destination box)
+
+    The corridor search() finds depends a little on the exact end points, so a
+    hit reuses the corridor found for an earlier pair of points in the same two
+    boxes. Entries belong to one NavMesh: using the cache with a different one
+    (for instance one compiled from a patched dict) empties it first. A NavMesh
+    never changes, so entries cannot outlive the mesh they were found on.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.mesh = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, mesh, start_box, destination_box):
+        """Returns the cached corridor between two box ids, or None."""
+        if mesh is not self.mesh:
+            self.invalidate(mesh)
+        corridor = self.entries.get((start_box, destination_box))
+        if corridor is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end((start_box, destination_box))
+        return corridor
+
+    def put(self, mesh, start_box, destination_box, corridor):
+        if mesh is not self.mesh:
+            self.invalidate(mesh)
+        self.entries[(start_box, destination_box)] = corridor
+        self.entries.move_to_end((start_box, destination_box))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, mesh=None):
+        """Drops every entry, e.g. after the mesh changed, and binds the cache to mesh."""
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.mesh = mesh
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
+
+class FlowFieldCache:
+    """
+    Bounded LRU cache of flow fields, keyed by destination box
+
+    A flow field is one Dijkstra from the destination box over the whole box
+    graph (weighted by mesh.edge_costs), kept as the next box towards the
+    destination and the remaining cost from every box. Once a destination has
+    a field, any number of agents heading there follow pointers from their
+    start box instead of searching. Each field takes 8 bytes per box.
+
+    Pass one to find_path as router=..., with a NavMesh. Like CorridorCache, it
+    belongs to one NavMesh and empties itself when used with another.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.fields = OrderedDict()
+        self.mesh = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def field(self, mesh, destination_box):
+        """
+        Returns:
+            (next_box, cost): int32 and float32 arrays over box ids. next_box is
+            -1 at the destination and at boxes that cannot reach it, where cost is inf.
+        """
+        if mesh is not self.mesh:
+            self.invalidate(mesh)
+        field = self.fields.get(destination_box)
+        if field is not None:
+            self.hits += 1
+            self.fields.move_to_end(destination_box)
+            return field
+        self.misses += 1
+        distances, previous, _ = box_dijkstra(mesh, [destination_box])
+        next_box = numpy.full(len(mesh), -1, dtype=numpy.int32)
+        cost = numpy.full(len(mesh), numpy.inf, dtype=numpy.float32)
+        settled = list(previous)
+        next_box[settled] = [-1 if box is None else box for box in previous.values()]
+        cost[settled] = list(distances.values())
+        field = self.fields[destination_box] = (next_box, cost)
+        while len(self.fields) > self.maxsize:
+            self.fields.popitem(last=False)
+            self.evictions += 1
+        return field
+
+    def corridor(self, mesh, start_box, destination_box, starting_point=None, destination_point=None):
+        """
+        Finds a box corridor the way search() does, by following the destination's flow field.
+
+        Returns:
+            The list of box ids from start_box to destination_box, or [] if none exists
+        """
+        next_box, _ = self.field(mesh, destination_box)
+        if start_box != destination_box and next_box[start_box] < 0:
+            return []
+        corridor = [start_box]
+        while corridor[-1] != destination_box:
+            corridor.append(int(next_box[corridor[-1]]))
+        return corridor
+
+    def invalidate(self, mesh=None):
+        """Drops every field, e.g. after the mesh changed, and binds the cache to mesh."""
+        if self.fields:
+            self.invalidations += 1
+        self.fields.clear()
+        self.mesh = mesh
+
+    def stats(self):
+        return {'size': len(self.fields), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
+
+class SearchStats:
+    """
+    Counters and timings of one query, filled in by find_path, search and
+    Dijkstra.dijkstras_shortest_path when they are given one
+
+    find_path and dijkstras_shortest_path reset it at the start of a query and
+    finish it at the end; search() called on its own only adds to it. On
+    finish, every `every`-th query's fields are handed to sink, e.g. a metrics
+    client. Searches without a SearchStats run their uninstrumented code.
+
+    Fields:
+        expanded: distinct (box, direction) or cell entries expanded
+        pushes, pops: open list operations
+        stale_pops: pops of an entry already expanded, which the search expands again
+        peak_frontier: largest open list size seen
+        queue_time: seconds spent in open list operations
+        point_time: seconds spent placing points on portals (get_point / portal_point)
+        elapsed: seconds from reset to finish
+        meeting_box: box where the forward and backward searches met
+        cached: whether the corridor came from a CorridorCache
+        direct: whether find_path's straight-line check answered without a search
+        found: whether a path was found
+    """
+
+    FIELDS = ('expanded', 'pushes', 'pops', 'stale_pops', 'peak_frontier', 'queue_time', 'point_time',
+              'elapsed', 'meeting_box', 'cached', 'direct', 'found')
+
+    def __init__(self, sink=None, every=1):
+        self.sink = sink
+        self.every = every
+        self.queries = 0
+        self.reset()
+
+    def reset(self):
+        self.expanded = self.pushes = self.pops = self.stale_pops = self.peak_frontier = 0
+        self.queue_time = self.point_time = self.elapsed = 0.0
+        self.meeting_box = None
+        self.cached = self.direct = False
+        self.found = None
+        self._expanded = set()
+        self._started = time.perf_counter()
+
+    def finish(self, found):
+        self.found = found
+        self.elapsed = time.perf_counter() - self._started
+        self.queries += 1
+        if self.sink is not None and self.queries % self.every == 0:
+            self.sink(self.as_dict())
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def timed_point(self, point):
+        """Wraps a point placement function to time it."""
+        clock = time.perf_counter
+        def timed(*args):
+            started = clock()
+            result = point(*args)
+            self.point_time += clock() - started
+            return result
+        return timed
+
+    def open_list(self, push, pop, size):
+        """
+        Wraps an open list's push(...) and pop() functions to count and time them.
+
+        Args:
+            push, pop: the open list's functions, e.g. a HeapQueue's methods or heapq's
+            size: returns the open list's current size
+
+        Returns:
+            The instrumented (push, pop); pop() must return (priority, item, ...)
+        """
+        clock = time.perf_counter
+        expanded = self._expanded
+        def timed_push(*args):
+            started = clock()
+            push(*args)
+            self.queue_time += clock() - started
+            self.pushes += 1
+            self.peak_frontier = max(self.peak_frontier, size())
+        def timed_pop(*args):
+            started = clock()
+            entry = pop(*args)
+            self.queue_time += clock() - started
+            self.pops += 1
+            if entry[1] in expanded:
+                self.stale_pops += 1
+            else:
+                expanded.add(entry[1])
+                self.expanded += 1
+            return entry
+        return timed_push, timed_pop
+
+
+def find_paths(pairs, mesh, workers=1, chunksize=None):
+    """
+    Answers many path queries at once, optionally across a process pool
+
+    Args:
+        pairs: (source_point, destination_point) queries
+        mesh: a NavMesh, a {'boxes', 'adj'} dict, or the filename of a mesh.
+            Given a filename each worker loads it itself, memory-mapping a
+            .navmesh file so all workers share its pages. Otherwise the mesh is
+            compiled once and workers inherit it when they are forked.
+        workers: number of processes; 1 answers the queries in this process
+        chunksize: queries handed to a worker at a time
+
+    Returns:
+        A list of (path, boxes) results in the order of pairs, as find_path returns them
+    """
+    pairs = list(pairs)
+    if workers <= 1:
+        navmesh = prepare_mesh(mesh)
+        return [find_path(source, destination, navmesh) for source, destination in pairs]
+
+    if not isinstance(mesh, str):
+        mesh = prepare_mesh(mesh)
+    if chunksize is None:
+        chunksize = max(1, len(pairs) // (workers * 4))
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(mesh,)) as pool:
+        return pool.map(_find_path_task, pairs, chunksize)
+
+# mesh of a find_paths worker process, set once by _init_worker
+_worker_mesh = None
+
+def prepare_mesh(mesh):
+    """
+    Readies a mesh for answering many queries, as find_paths and nm_server
+    workers do once per process.
+
+    Args:
+        mesh: a NavMesh, a {'boxes', 'adj'} dict, or the filename of a mesh,
+            loaded with nm_navmesh.load
+
+    Returns:
+        A NavMesh whose lazily built lookup structures (index, edges,
+        portal_list) are already built, so no query pays for them
+    """
+    navmesh = nm_navmesh.load(mesh) if isinstance(mesh, str) else as_navmesh(mesh)
+    navmesh.index, navmesh.edges, navmesh.portal_list
+    return navmesh
+
+def _init_worker(mesh):
+    global _worker_mesh
+    _worker_mesh = prepare_mesh(mesh)
+
+def _find_path_task(pair):
+    return find_path(pair[0], pair[1], _worker_mesh)
+
 def in_bounds(point, box):
     x1, x2, y1, y2 = box
     if point[0] >= x1 and point[0] < x2:
@@ -60,100 +398,338 @@ def in_bounds(point, box):
             return True
     return False
 
-def search(boxes, starting_box, destination_box, starting_point=None, destination_point=None):
-    #to convert this to A*, we need to track movement costs
-    frontier = PriorityQueue()
-    frontier.put((0, starting_box, 'f'))
-    frontier.put((0, destination_box, 'b'))
-    forward_reached = dict()
-    forward_previous = dict()
-    backward_previous = dict()
-    backward_reached = dict()
-    forward_previous[starting_box] = None
-    backward_previous[destination_box] = None
-    forward_reached[starting_box] = 0
-    backward_reached[destination_box] = 0
-    starting_point = get_point(starting_box) if not starting_point else starting_point
-    destination_point = get_point(destination_box) if not destination_point else destination_point
-    def cost_to_next(current, next, dir):
-        reached = forward_reached if dir == 'f' else backward_reached
-        previous = forward_previous if dir == 'f' else backward_previous
-        prev_entry_point = get_point(previous.get(current, None), current)
-        end_point = None
-        #return reached[current] + heuristic(prev_entry_point if prev_entry_point else center(current), entry_point)
-        if current == starting_box:
-            prev_entry_point = starting_point
-        elif current == destination_box:
-            prev_entry_point = destination_point
-        if next == starting_box and dir == 'b':
-            end_point = starting_point
-        elif next == destination_box and dir == 'f':
-            end_point = destination_point
-        entry_point = get_point(current, next, prev_entry_point, end_point)
-        return reached[current] + heuristic(prev_entry_point, entry_point),\
-            heuristic(entry_point, destination_point if dir == 'f' else starting_point)
-    while frontier:
-        _current_priority, current, dir = frontier.get()
-        dest_reached = (dir == 'f' and current == destination_box) or (dir == 'b' and current == starting_box)
-        if dest_reached or (current in forward_reached and current in backward_reached):
-            # CHANGE
-            # Base Cases: Boxes are touching
-            # Boxes are seperated by one box
-            # Steps: Traverse from dest to midpoint
-            # Traverse from midpoint to start
-            # append dest path to start path
-            # get_path(forward_previous, destination_box)
-
-            path = []
-            #if boxes are touching
-            if destination_box in boxes[starting_box]: 
-                path.append(starting_box)
-                path.append(destination_box)
-                return path
-
-            path = get_path(forward_previous, current)
-            path += get_path(backward_previous, current)[::-1]
-            if path.count(current) > 1:
-                path.remove(current)
-            return path
-        for adj_box in boxes[current]:
-            # prev_entry_point = get_point(current) # Fallback estimate is center of prev box
-            if dir == 'f':
-                # if forward_previous.get(current, None):
-                #     prev_entry_point = get_point(forward_previous[current], current)
-                #     entry_point = get_point(current, adj_box, prev_entry_point)
-                # distance = forward_reached[current] + heuristic(prev_entry_point, entry_point)
-                distance, heuristic_value = cost_to_next(current, adj_box, dir)
-                if not adj_box in forward_reached or distance < forward_reached[adj_box]:
-                    forward_previous[adj_box] = current
-                    forward_reached[adj_box] = distance
-                    frontier.put((distance + heuristic_value, adj_box, 'f'))
+def visible_corridor(mesh, start_box, destination_box, source_point, destination_point):
+    """
+    Walks the straight segment from source_point to destination_point through the mesh box by box
+
+    From each box the segment leaves through one side; the next box is the
+    neighbor sharing that side at the exit point. The walk gives up wherever
+    the segment leaves the mesh, and also where it exits exactly through a
+    corner or a portal's end point, since which way it goes on from there is
+    ambiguous; callers then fall back to a graph search.
+
+    Args:
+        mesh: a NavMesh
+        start_box: id of the box containing source_point
+        destination_box: id of the box containing destination_point
+        source_point, destination_point: the segment's ends
+
+    Returns:
+        The list of box ids the segment crosses, from start_box to
+        destination_box, or None if it does not stay on the mesh
+    """
+    boxes = mesh.boxes
+    edges = mesh.edges
+    px, py = source_point
+    dx, dy = destination_point[0] - px, destination_point[1] - py
+    current = start_box
+    corridor = [current]
+    # each box can only be crossed once along a straight line
+    for _ in range(len(boxes)):
+        if current == destination_box:
+            return corridor
+        x1, x2, y1, y2 = boxes[current]
+        tx = (x2 - px) / dx if dx > 0 else (x1 - px) / dx if dx < 0 else math.inf
+        ty = (y2 - py) / dy if dy > 0 else (y1 - py) / dy if dy < 0 else math.inf
+        if min(tx, ty) >= 1:
+            # the segment ends in this box; boxes may overlap, so the destination's can be another
+            corridor.append(destination_box)
+            return corridor
+        if tx == ty:
+            return None
+        following = None
+        if tx < ty:
+            side, ey = (x2 if dx > 0 else x1), py + tx * dy
+            for neighbor, _ in edges[current]:
+                nx1, nx2, ny1, ny2 = boxes[neighbor]
+                if (nx1 if dx > 0 else nx2) == side and max(y1, ny1) < ey < min(y2, ny2):
+                    following = neighbor
+                    break
+        else:
+            side, ex = (y2 if dy > 0 else y1), px + ty * dx
+            for neighbor, _ in edges[current]:
+                nx1, nx2, ny1, ny2 = boxes[neighbor]
+                if (ny1 if dy > 0 else ny2) == side and max(x1, nx1) < ex < min(x2, nx2):
+                    following = neighbor
+                    break
+        if following is None:
+            return None
+        current = following
+        corridor.append(current)
+    return None
+
+
+class AnytimeSearch:
+    """
+    search() as a resumable object, for callers that can only spare it a slice of each frame
+
+    Holds the whole bidirectional search state (frontier, reached costs,
+    back pointers and portal edges of both directions) between calls, so
+    step() can advance the search by a bounded number of expansions or
+    microseconds and return. Run to completion it finds exactly the corridor
+    search() does.
+
+    The mesh views the search reads (boxes, edges, portal_list) are taken in
+    the constructor, so that step() only ever pays for its expansions. On a
+    NavMesh whose views are not built yet that makes construction O(boxes),
+    some 150 ms at 30k boxes; build them once beforehand with prepare_mesh,
+    or construct searches outside the frame budget.
+    """
+
+    IN_PROGRESS = 'in progress'
+    FOUND = 'found'
+    NO_PATH = 'no path'
+
+    def __init__(self, mesh, starting_box, destination_box, starting_point=None, destination_point=None,
+                 landmarks=None, open_list=None, stats=None):
+        """
+        Args:
+            mesh, starting_box, destination_box, starting_point, destination_point,
+            landmarks, open_list, stats: as search() takes them
+        """
+        #to convert this to A*, we need to track movement costs
+        self.mesh = mesh
+        self.starting_box = starting_box
+        self.destination_box = destination_box
+        self.stats = stats
+        self.status = AnytimeSearch.IN_PROGRESS
+        self.corridor = None
+        self.expansions = 0
+        self._centers = None
+        boxes = mesh.boxes
+        portals = mesh.portal_list
+        self._edges = edges = mesh.edges
+        self._touching = any(neighbor == destination_box for neighbor, _ in edges[starting_box])
+        self.frontier = frontier = HeapQueue() if open_list is None else open_list
+        push, pop, point = frontier.push, frontier.pop, portal_point
+        if stats is not None:
+            push, pop = stats.open_list(push, pop, frontier.__len__)
+            point = stats.timed_point(point)
+        self._push, self._pop = push, pop
+        push(0, (starting_box, 'f'))
+        push(0, (destination_box, 'b'))
+        self.forward_reached = forward_reached = dict()
+        self.forward_previous = forward_previous = dict()
+        self.backward_previous = backward_previous = dict()
+        self.backward_reached = backward_reached = dict()
+        # edge each box was entered through, so its portal can be looked up
+        self.forward_edge = forward_edge = dict()
+        self.backward_edge = backward_edge = dict()
+        forward_previous[starting_box] = None
+        backward_previous[destination_box] = None
+        forward_reached[starting_box] = 0
+        backward_reached[destination_box] = 0
+        starting_point = center(boxes[starting_box]) if not starting_point else starting_point
+        destination_point = center(boxes[destination_box]) if not destination_point else destination_point
+        self.destination_point = destination_point
+        def entry_to(current, dir):
+            # where the path enters current, taken as the center-to-center crossing of its portal
+            if current == starting_box:
+                return starting_point
+            elif current == destination_box:
+                return destination_point
+            previous = forward_previous if dir == 'f' else backward_previous
+            entered_by = forward_edge if dir == 'f' else backward_edge
+            return point(portals[entered_by[current]], center(boxes[previous[current]]), center(boxes[current]))
+        if landmarks is not None:
+            to_destination = landmarks.estimates(destination_box)
+            to_start = landmarks.estimates(starting_box)
+        def cost_to_next(current, next, edge, dir, prev_entry_point):
+            reached = forward_reached if dir == 'f' else backward_reached
+            if next == starting_box and dir == 'b':
+                end_point = starting_point
+            elif next == destination_box and dir == 'f':
+                end_point = destination_point
             else:
-                # if backward_previous.get(current, None):
-                #     prev_entry_point = get_point(backward_previous[current], current)
-                #     entry_point = get_point(current, adj_box, prev_entry_point)
-                # distance = backward_reached[current] + heuristic(prev_entry_point, entry_point)
-                distance, heuristic_value = cost_to_next(current, adj_box, dir)
-                if not adj_box in backward_reached or distance < backward_reached[adj_box]:
-                    backward_previous[adj_box] = current
-                    backward_reached[adj_box] = distance
-                    frontier.put((distance + heuristic_value, adj_box, 'b'))
-
-    return [], []
+                end_point = center(boxes[next])
+            entry_point = point(portals[edge], prev_entry_point, end_point)
+            estimate = heuristic(entry_point, destination_point if dir == 'f' else starting_point)
+            if landmarks is not None:
+                estimate = max(estimate, (to_destination if dir == 'f' else to_start)(next))
+            return reached[current] + heuristic(prev_entry_point, entry_point), estimate
+        self._entry_to, self._cost_to_next = entry_to, cost_to_next
+
+    def step(self, max_expansions=None, max_microseconds=None):
+        """
+        Advances the search by at most max_expansions expansions and about
+        max_microseconds of time; with neither, runs it to the end. Time is
+        checked between expansions, so a step can overrun it by one expansion
+        and the partial corridor lookup.
+
+        Returns:
+            (status, corridor): FOUND and the finished corridor, NO_PATH and [], or
+            IN_PROGRESS and the best partial corridor so far (see partial())
+        """
+        if self.status != AnytimeSearch.IN_PROGRESS:
+            return self.status, self.corridor
+        starting_box, destination_box = self.starting_box, self.destination_box
+        edges = self._edges
+        frontier, push, pop = self.frontier, self._push, self._pop
+        entry_to, cost_to_next = self._entry_to, self._cost_to_next
+        forward_reached, forward_previous, forward_edge = self.forward_reached, self.forward_previous, self.forward_edge
+        backward_reached, backward_previous, backward_edge = \
+            self.backward_reached, self.backward_previous, self.backward_edge
+        budget = math.inf if max_expansions is None else max_expansions
+        clock = time.perf_counter
+        deadline = None if max_microseconds is None else clock() + max_microseconds * 1e-6
+        expanded = 0
+        while frontier:
+            if expanded >= budget or (deadline is not None and clock() >= deadline):
+                self.expansions += expanded
+                return AnytimeSearch.IN_PROGRESS, self.partial()
+            _current_priority, (current, dir) = pop()
+            dest_reached = (dir == 'f' and current == destination_box) or (dir == 'b' and current == starting_box)
+            if dest_reached or (current in forward_reached and current in backward_reached):
+                # CHANGE
+                # Base Cases: Boxes are touching
+                # Boxes are seperated by one box
+                # Steps: Traverse from dest to midpoint
+                # Traverse from midpoint to start
+                # append dest path to start path
+                # get_path(forward_previous, destination_box)
+
+                if self.stats is not None:
+                    self.stats.meeting_box = current
+                path = []
+                #if boxes are touching
+                if self._touching:
+                    path.append(starting_box)
+                    path.append(destination_box)
+                    return self._finish(AnytimeSearch.FOUND, path, expanded)
+
+                path = get_path(forward_previous, current)
+                path += get_path(backward_previous, current)[::-1]
+                if path.count(current) > 1:
+                    path.remove(current)
+                return self._finish(AnytimeSearch.FOUND, path, expanded)
+            prev_entry_point = entry_to(current, dir)
+            for adj_box, edge in edges[current]:
+                if dir == 'f':
+                    distance, heuristic_value = cost_to_next(current, adj_box, edge, dir, prev_entry_point)
+                    if not adj_box in forward_reached or distance < forward_reached[adj_box]:
+                        forward_previous[adj_box] = current
+                        forward_edge[adj_box] = edge
+                        forward_reached[adj_box] = distance
+                        push(distance + heuristic_value, (adj_box, 'f'))
+                else:
+                    distance, heuristic_value = cost_to_next(current, adj_box, edge, dir, prev_entry_point)
+                    if not adj_box in backward_reached or distance < backward_reached[adj_box]:
+                        backward_previous[adj_box] = current
+                        backward_edge[adj_box] = edge
+                        backward_reached[adj_box] = distance
+                        push(distance + heuristic_value, (adj_box, 'b'))
+            expanded += 1
+
+        return self._finish(AnytimeSearch.NO_PATH, [], expanded)
+
+    def partial(self):
+        """
+        Returns:
+            The corridor from starting_box to the box reached from it whose
+            center is nearest the destination point, the finished corridor once
+            found, or [] if there is none
+        """
+        if self.status != AnytimeSearch.IN_PROGRESS:
+            return self.corridor
+        if self._centers is None:
+            self._centers = self.mesh.centers
+        reached = numpy.fromiter(self.forward_previous, dtype=numpy.int64, count=len(self.forward_previous))
+        offsets = self._centers[reached] - self.destination_point
+        nearest = int(reached[numpy.argmin((offsets ** 2).sum(axis=1))])
+        return get_path(self.forward_previous, nearest)
+
+    def _finish(self, status, corridor, expanded):
+        self.status, self.corridor = status, corridor
+        self.expansions += expanded
+        return status, corridor
+
+
+def search(mesh, starting_box, destination_box, starting_point=None, destination_point=None, landmarks=None,
+           open_list=None, stats=None):
+    """
+    Bidirectional search for a corridor of boxes between two boxes
+
+    Args:
+        mesh: a NavMesh
+        starting_box: id of the box containing starting_point
+        destination_box: id of the box containing destination_point
+        starting_point: exact start, defaults to the center of starting_box
+        destination_point: exact goal, defaults to the center of destination_box
+        landmarks: optional nm_landmarks.Landmarks; the heuristic becomes the larger of
+            the straight-line distance and the landmarks' triangle-inequality estimate
+        open_list: optional empty open list from nm_openlist to search with, a
+            HeapQueue by default; pass one in to read its stats() afterwards. The
+            forward and backward searches share it, so priorities do not only
+            grow and a RadixHeap raises ValueError. An IndexedHeap skips stale
+            re-expansions, which can change the corridor found.
+        stats: optional SearchStats to add this search's counts and timings to
+
+    Returns:
+        The list of box ids from starting_box to destination_box, or [] if none exists
+    """
+    return AnytimeSearch(mesh, starting_box, destination_box, starting_point, destination_point, landmarks,
+                         open_list, stats).step()[1]
+
+def box_dijkstra(mesh, sources, allowed=None, targets=None, open_list=None):
+    """
+    Dijkstra over the box graph, weighted by mesh.edge_costs
+
+    Args:
+        mesh: a NavMesh
+        sources: box ids the search starts from, all at distance 0
+        allowed: optional set of box ids the search may not leave
+        targets: optional box ids; the search stops once all are settled
+        open_list: optional empty open list from nm_openlist, a HeapQueue by default.
+            Costs only grow here, so a RadixHeap works too.
+
+    Returns:
+        (distances, previous, expansions): distance and predecessor of every
+        settled box id, and the number of boxes expanded
+    """
+    edges = mesh.edges
+    costs = mesh.edge_costs
+    distances = {}
+    previous = {}
+    reached = {}
+    queue = HeapQueue() if open_list is None else open_list
+    for box in sources:
+        reached[box] = 0
+        previous[box] = None
+        queue.push(0, box)
+    remaining = None if targets is None else set(targets)
+    expansions = 0
+    while queue:
+        distance, box = queue.pop()
+        if box in distances:
+            continue
+        distances[box] = distance
+        expansions += 1
+        if remaining is not None:
+            remaining.discard(box)
+            if not remaining:
+                break
+        for neighbor, edge in edges[box]:
+            if allowed is not None and neighbor not in allowed:
+                continue
+            candidate = distance + costs[edge]
+            if neighbor not in reached or candidate < reached[neighbor]:
+                reached[neighbor] = candidate
+                previous[neighbor] = box
+                queue.push(candidate, neighbor)
+    return distances, {box: previous[box] for box in distances}, expansions
 
 #def a_star(boxes, starting_box, destination_box):
     #frontier = PriorityQueue()
     #frontier.put(starting_box, 0)
 
 def get_path(history: dict, box) -> list:
-    if box == None or box == []:
-        return []
-    return get_path(history, history.get(box, None)) + [box]
+    path = []
+    while box is not None:
+        path.append(box)
+        box = history.get(box, None)
+    return path[::-1]
 
 def get_point(a_box, b_box=None, start_point=None, end_point=None):
-    # lambda functions to find center of box and to find midline
-    mid_line = lambda x: mid_line_slope * x + mid_line_offset
-
     #check if boxes are missing, and define start / end points
     if not a_box:
         return None
@@ -166,6 +742,98 @@ def get_point(a_box, b_box=None, start_point=None, end_point=None):
     if a_box == b_box:
         return end_point if end_point else center(a_box)
 
+    overlap_point_a = max(a_box[0], b_box[0]), max(a_box[2], b_box[2]) #(x1, y1)
+    overlap_point_b = min(a_box[1], b_box[1]), min(a_box[3], b_box[3]) #(x2, y2)
+    return portal_point(overlap_point_a + overlap_point_b, start_point, end_point)
+
+def funnel_path(mesh, corridor, source_point, destination_point):
+    """
+    Pulls the path through a corridor taut, the way a string would lie (the simple stupid funnel algorithm)
+
+    The funnel is a wedge from the last corner (the apex) spanning the
+    portals crossed so far. Each portal narrows one side of it; when a side
+    would cross over the other, the point on that other side becomes the
+    next corner and the funnel restarts from it. The result has a waypoint
+    only where the path bends around a wall corner, and is the shortest
+    path within the corridor.
+
+    Args:
+        mesh: a NavMesh
+        corridor: box ids from the box of source_point to that of destination_point
+        source_point, destination_point: the path's ends
+
+    Returns:
+        The list of points from source_point to destination_point
+    """
+    boxes, portals = mesh.boxes, mesh.portal_list
+    lefts, rights = [], []
+    for a, b in zip(corridor, corridor[1:]):
+        x1, y1, x2, y2 = portals[mesh.edge(a, b)]
+        cx, cy = center(boxes[a])
+        # seen from inside the box being left, the left end lies counterclockwise of the right one
+        if (x1 - cx) * (y2 - cy) - (y1 - cy) * (x2 - cx) > 0:
+            lefts.append((x2, y2))
+            rights.append((x1, y1))
+        else:
+            lefts.append((x1, y1))
+            rights.append((x2, y2))
+    lefts.append(destination_point)
+    rights.append(destination_point)
+
+    path = [source_point]
+    apex = left = right = source_point
+    apex_index = left_index = right_index = -1
+    i = 0
+    while i < len(lefts):
+        new_left, new_right = lefts[i], rights[i]
+        if _triangle_area2(apex, right, new_right) <= 0:
+            if apex == right or _triangle_area2(apex, left, new_right) >= 0:
+                # narrow the right side; on a tie the line just grazes the left point
+                right, right_index = new_right, i
+            else:
+                # the right side crosses the left: the left point is a corner
+                if path[-1] != left:
+                    path.append(left)
+                apex = right = left
+                apex_index = right_index = left_index
+                i = apex_index + 1
+                continue
+        if _triangle_area2(apex, left, new_left) >= 0:
+            if apex == left or _triangle_area2(apex, right, new_left) <= 0:
+                # narrow the left side
+                left, left_index = new_left, i
+            else:
+                # the left side crosses the right: the right point is a corner
+                if path[-1] != right:
+                    path.append(right)
+                apex = left = right
+                apex_index = left_index = right_index
+                i = apex_index + 1
+                continue
+        i += 1
+    if path[-1] != destination_point:
+        path.append(destination_point)
+    return path
+
+def _triangle_area2(a, b, c):
+    # twice the signed area of a, b, c; positive when c lies clockwise of b around a
+    return (c[0] - a[0]) * (b[1] - a[1]) - (b[0] - a[0]) * (c[1] - a[1])
+
+def portal_point(portal, start_point, end_point):
+    """
+    Places the crossing point on a portal for the line from start_point to end_point
+
+    Args:
+        portal: (x1, y1, x2, y2) segment shared by two boxes, see NavMesh.portals
+        start_point: point the line leaves from
+        end_point: point the line heads to
+
+    Returns:
+        The point where the line meets the portal, clamped to the segment
+    """
+    # lambda functions to find midline
+    mid_line = lambda x: mid_line_slope * x + mid_line_offset
+
     #computes slope and offset of line passing through start and end points
     mid_line_slope = (start_point[1] - end_point[1])
     if start_point[0] - end_point[0] == 0:
@@ -173,15 +841,13 @@ def get_point(a_box, b_box=None, start_point=None, end_point=None):
     else:
         mid_line_slope /= (start_point[0] - end_point[0]) #y / x  
     mid_line_offset = start_point[1] - mid_line_slope * start_point[0]
-    
-    overlap_point_a = max(a_box[0], b_box[0]), max(a_box[2], b_box[2]) #(x1, y1)
-    overlap_point_b = min(a_box[1], b_box[1]), min(a_box[3], b_box[3]) #(x2, y2)
-    
-    if overlap_point_a[0] == overlap_point_b[0]:
-        return overlap_point_a[0], clamp(mid_line(overlap_point_a[0]), overlap_point_a[1], overlap_point_b[1])
+
+    x1, y1, x2, y2 = portal
+    if x1 == x2:
+        return x1, clamp(mid_line(x1), y1, y2)
     else:
-        x = (overlap_point_a[1] - mid_line_offset) / mid_line_slope
-        return clamp(x, overlap_point_a[0], overlap_point_b[0]), overlap_point_a[1]
+        x = (y1 - mid_line_offset) / mid_line_slope
+        return clamp(x, x1, x2), y1
     
 
 def heuristic(point_a, point_b):
@@ -0,0 +1,178 @@
+"""
+Checks for nm_pathfinder. Run them with pytest from this directory, or as a
+script: python nm_pathfinder_test.py
+"""
+import math
+import os
+import pickle
+import random
+
+import nm_meshbuilder
+import nm_pathfinder
+from nm_navmesh import NavMesh
+from nm_samples import random_pairs
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+
+def load_mesh(name):
+    with open(os.path.join(INPUT, name + '.mesh.pickle'), 'rb') as f:
+        return pickle.load(f)
+
+
+def test_corridor_cache_reuses_and_invalidates():
+    mesh = load_mesh('ucsc_banana_slug.png')
+    navmesh = NavMesh.from_dict(mesh)
+    cache = nm_pathfinder.CorridorCache()
+    pairs = random_pairs(navmesh, 50, 0)
+    for source, destination in pairs:
+        path, boxes = nm_pathfinder.find_path(source, destination, navmesh, cache=cache, line_of_sight=False)
+        assert (path, boxes) == nm_pathfinder.find_path(source, destination, navmesh, line_of_sight=False)
+    searched = cache.stats()
+    assert searched['hits'] == 0 and searched['size'] > 0
+
+    # the same box pairs again come from the cache, with the same corridors
+    for source, destination in pairs:
+        _, boxes = nm_pathfinder.find_path(source, destination, navmesh, cache=cache, line_of_sight=False)
+        assert boxes == nm_pathfinder.find_path(source, destination, navmesh, line_of_sight=False)[1]
+    assert cache.stats()['hits'] == searched['misses']
+
+    # a patched mesh reuses box ids for other boxes, so it starts the cache over
+    image = nm_meshbuilder.read_map(os.path.join(INPUT, 'ucsc_banana_slug.png'))
+    image[100:140, 100:140] = 0
+    other = nm_meshbuilder.patch_navmesh(navmesh, image, (100, 140, 100, 140), 16)
+    source, destination = pairs[0]
+    nm_pathfinder.find_path(source, destination, other, cache=cache, line_of_sight=False)
+    assert cache.stats()['invalidations'] == 1 and cache.mesh is other and len(cache.entries) <= 1
+
+
+def test_find_path_refuses_cache_with_dict_mesh():
+    mesh = load_mesh('ucsc_banana_slug.png')
+    source, destination = random_pairs(NavMesh.from_dict(mesh), 1, 0)[0]
+    for options in ({'cache': nm_pathfinder.CorridorCache()},
+                    {'router': nm_pathfinder.FlowFieldCache()}):
+        try:
+            nm_pathfinder.find_path(source, destination, mesh, **options)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("find_path took %s with a dict mesh" % list(options))
+
+
+def test_flow_field_cache_follows_dijkstra_and_invalidates():
+    navmesh = NavMesh.from_dict(load_mesh('ucsc_banana_slug.png'))
+    flows = nm_pathfinder.FlowFieldCache(maxsize=2)
+    destinations = [0, len(navmesh) // 2, len(navmesh) - 1]
+    for destination_box in destinations:
+        distances, _, _ = nm_pathfinder.box_dijkstra(navmesh, [destination_box])
+        next_box, cost = flows.field(navmesh, destination_box)
+        for start_box in range(0, len(navmesh), 7):
+            corridor = flows.corridor(navmesh, start_box, destination_box)
+            if start_box not in distances:
+                assert corridor == [] and cost[start_box] == math.inf
+                continue
+            assert math.isclose(cost[start_box], distances[start_box], rel_tol=1e-6)
+            assert corridor[0] == start_box and corridor[-1] == destination_box
+            walked = sum(navmesh.edge_costs[navmesh.edge(a, b)] for a, b in zip(corridor, corridor[1:]))
+            assert math.isclose(walked, distances[start_box], rel_tol=1e-6)
+    # the least recently used field made room for the third
+    assert flows.stats()['evictions'] == 1 and list(flows.fields) == destinations[1:]
+    hits, misses = flows.hits, flows.misses
+    flows.field(navmesh, destinations[-1])
+    assert (flows.hits, flows.misses) == (hits + 1, misses)
+
+    # a patched mesh reuses box ids for other boxes, so its fields start over
+    image = nm_meshbuilder.read_map(os.path.join(INPUT, 'ucsc_banana_slug.png'))
+    image[100:140, 100:140] = 0
+    patched = nm_meshbuilder.patch_navmesh(navmesh, image, (100, 140, 100, 140), 16)
+    flows.corridor(patched, destinations[0], destinations[-1])
+    assert flows.stats()['invalidations'] == 1 and flows.mesh is patched and len(flows.fields) == 1
+
+
+def nearby_pairs(navmesh, count, seed, radius=60):
+    # pairs of points on the mesh at most radius apart, so many can see each other
+    rng = random.Random(seed)
+    pairs = []
+    for source, _ in random_pairs(navmesh, 4 * count, seed):
+        destination = (source[0] + rng.uniform(-radius, radius), source[1] + rng.uniform(-radius, radius))
+        if navmesh.locate(destination) is not None:
+            pairs.append((source, destination))
+    return pairs[:count]
+
+
+def test_visible_corridor_stays_on_the_mesh():
+    for name in ('homer.png', 'ucsc_banana_slug.png'):
+        navmesh = NavMesh.from_dict(load_mesh(name))
+        boxes = navmesh.boxes
+        found = 0
+        for source, destination in nearby_pairs(navmesh, 300, 0) + random_pairs(navmesh, 100, 0):
+            start_box, destination_box = navmesh.locate(source), navmesh.locate(destination)
+            corridor = nm_pathfinder.visible_corridor(navmesh, start_box, destination_box, source, destination)
+            if corridor is None:
+                continue
+            found += 1
+            assert corridor[0] == start_box and corridor[-1] == destination_box
+            # neighbors all the way, except that the last step may be into an overlapping box
+            assert all(navmesh.edge(a, b) is not None for a, b in zip(corridor[:-2], corridor[1:-1]))
+            if len(corridor) > 1:
+                last = boxes[corridor[-2]]
+                assert navmesh.edge(corridor[-2], corridor[-1]) is not None or \
+                    last[0] <= destination[0] <= last[1] and last[2] <= destination[1] <= last[3]
+            # every point of the segment is in one of the corridor's boxes
+            for step in range(65):
+                t = step / 64
+                x, y = source[0] + t * (destination[0] - source[0]), source[1] + t * (destination[1] - source[1])
+                assert any(x1 <= x <= x2 and y1 <= y <= y2 for x1, x2, y1, y2 in map(boxes.__getitem__, corridor)), \
+                    (name, source, destination, t)
+            # find_path answers with the segment only when asked to
+            path, _ = nm_pathfinder.find_path(source, destination, navmesh, line_of_sight=True)
+            assert path == [source, destination]
+            if start_box != destination_box:
+                assert nm_pathfinder.find_path(source, destination, navmesh)[0] != path
+        assert found > 50, name
+
+
+def path_length(path):
+    return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def test_funnel_path():
+    navmesh = NavMesh.from_dict(load_mesh('homer.png'))
+    checked = 0
+    for source, destination in random_pairs(navmesh, 100, 0):
+        start_box, destination_box = navmesh.locate(source), navmesh.locate(destination)
+        corridor = nm_pathfinder.search(navmesh, start_box, destination_box, source, destination)
+        if len(corridor) < 2:
+            continue
+        checked += 1
+        path = nm_pathfinder.funnel_path(navmesh, corridor, source, destination)
+        assert nm_pathfinder.find_path(source, destination, navmesh, smooth=True)[0] == path
+        portal_path, _ = nm_pathfinder.find_path(source, destination, navmesh)
+        assert path[0] == source and path[-1] == destination
+        # no shorter than the straight line, no longer than a waypoint per portal
+        assert math.dist(source, destination) - 1e-9 <= path_length(path) <= path_length(portal_path) + 1e-9
+
+        # bends only at portal ends, which are wall corners
+        corridor_boxes = [navmesh.boxes[box] for box in corridor]
+        ends = set()
+        for a, b in zip(corridor, corridor[1:]):
+            x1, y1, x2, y2 = navmesh.portal_list[navmesh.edge(a, b)]
+            ends.update(((x1, y1), (x2, y2)))
+        assert all(tuple(point) in ends for point in path[1:-1])
+
+        # and stays within the corridor
+        for a, b in zip(path, path[1:]):
+            for step in range(17):
+                t = step / 16
+                x, y = a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1])
+                assert any(x1 - 1e-9 <= x <= x2 + 1e-9 and y1 - 1e-9 <= y <= y2 + 1e-9
+                           for x1, x2, y1, y2 in corridor_boxes), (source, destination, (x, y))
+    assert checked > 50
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)
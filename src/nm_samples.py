@@ -0,0 +1,87 @@
+"""
+Seeded sample maps, maze levels and query points, shared by the benchmarks and the tests.
+"""
+import os
+import random
+import tempfile
+
+import numpy
+
+from Dijkstra_Forward_Search import maze_environment
+
+
+def mesh_extent(boxes):
+    return max(b[1] for b in boxes), max(b[3] for b in boxes)
+
+
+def random_points(boxes, count, seed):
+    rng = random.Random(seed)
+    width, height = mesh_extent(boxes)
+    return [(rng.uniform(0, width), rng.uniform(0, height)) for _ in range(count)]
+
+
+def random_pairs(navmesh, count, seed):
+    # points drawn inside random boxes, so every query starts and ends on the mesh
+    rng = random.Random(seed)
+    boxes = navmesh.boxes
+
+    def point():
+        x1, x2, y1, y2 = boxes[rng.randrange(len(boxes))]
+        return rng.uniform(x1, x2), rng.uniform(y1, y2)
+
+    return [(point(), point()) for _ in range(count)]
+
+
+def synthetic_map(size, seed, obstacle_density=0.0002, max_obstacle=64):
+    """Returns a size x size uint8 map of open floor (255) scattered with random wall rectangles."""
+    rng = numpy.random.default_rng(seed)
+    image = numpy.full((size, size), 255, dtype=numpy.uint8)
+    count = int(size * size * obstacle_density)
+    corners = rng.integers(0, size, (count, 2))
+    extents = rng.integers(2, max_obstacle, (count, 2))
+    for (x, y), (w, h) in zip(corners, extents):
+        image[x:x + w, y:y + h] = 0
+    return image
+
+
+def synthetic_level(size, seed, wall_density=0.2):
+    # a size x size maze text of random digit costs and walls, 'a' and 'b' in opposite corners
+    rng = random.Random(seed)
+    rows = [[maze_environment.WALL if rng.random() < wall_density else str(rng.randint(1, 9))
+             for _ in range(size)] for _ in range(size)]
+    rows[1][1], rows[-2][-2] = 'a', 'b'
+    return '\n'.join(''.join(row) for row in rows) + '\n'
+
+
+def open_level(size, seed, patches=0):
+    # a size x size maze text of open '1' floor crossed by wall segments, with optional
+    # rectangles of heavier floor; 'a' and 'b' in opposite corners
+    rng = random.Random(seed)
+    rows = [['1'] * size for _ in range(size)]
+    for _ in range(size // 3):
+        x, y = rng.randrange(size), rng.randrange(size)
+        if min(x, y) < 6 or max(x, y) > size - 7:
+            continue    # keep the corners around the waypoints clear
+        w, h = rng.randint(1, size // 6), rng.randint(1, 3)
+        if rng.random() < 0.5:
+            w, h = h, w
+        for j in range(y, min(size, y + h)):
+            rows[j][x:x + w] = [maze_environment.WALL] * len(rows[j][x:x + w])
+    for _ in range(patches):
+        x, y = rng.randrange(size), rng.randrange(size)
+        w, h, cost = rng.randint(2, size // 5), rng.randint(2, size // 5), str(rng.randint(2, 9))
+        for j in range(y, min(size, y + h)):
+            rows[j][x:x + w] = [c if c == maze_environment.WALL else cost for c in rows[j][x:x + w]]
+    for i in range(size):
+        rows[0][i] = rows[-1][i] = rows[i][0] = rows[i][-1] = maze_environment.WALL
+    rows[1][1], rows[-2][-2] = 'a', 'b'
+    return '\n'.join(''.join(row) for row in rows) + '\n'
+
+
+def load_level_text(text):
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write(text)
+    try:
+        return maze_environment.load_level(f.name)
+    finally:
+        os.unlink(f.name)
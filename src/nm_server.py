@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import signal
+import time
+
+import nm_pathfinder
+from nm_pathfinder import prepare_mesh
+
+
+class QueryServer:
+    """
+    Path query daemon: loads meshes once and answers find_path queries sent
+    as newline-delimited JSON over a Unix domain socket.
+
+    Each request is one line, {"id": ..., "mesh": name, "source": [x, y],
+    "destination": [x, y]}, where "mesh" may be left out when only one mesh is
+    served. Each reply is one line, {"id": ..., "path": [[x, y], ...], "boxes":
+    [[x1, x2, y1, y2], ...]} as find_path returns them, or {"id": ..., "error":
+    message}. When the points are not connected on the mesh, the reply has
+    both: an empty path and boxes, and "error": "no path". Replies come back in the order queries finish, not the order
+    they were sent, so clients match them up by id.
+
+    An asyncio front end reads requests into one bounded queue. A batcher
+    takes whatever queries are waiting, up to batch_size at a time, and
+    hands each batch to a pool of worker processes, each of which loads
+    every mesh itself (memory-mapping .navmesh files, so workers share their
+    pages). When the queue is full, connections stop being read until it
+    drains, which pushes back on the clients. Queries not answered within
+    timeout seconds get an error reply.
+
+    If batches can no longer be handed to the pool (a worker died and broke
+    it, say), every query still held gets that error as its reply, the server
+    stops listening, and serve() raises the error.
+    """
+
+    def __init__(self, meshes, workers=None, batch_size=32, max_pending=1024, timeout=5.0):
+        """
+        Args:
+            meshes: {name: mesh filename}
+            workers: number of worker processes, os.cpu_count() by default
+            batch_size: most queries handed to a worker at a time
+            max_pending: most queries queued before reading stops
+            timeout: seconds a query may take, from being queued to being answered
+        """
+        self.meshes = dict(meshes)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.answered = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.batches = 0
+        self.error = None
+        self.queue = asyncio.Queue(max_pending)
+        # keep two batches per worker in flight, so workers never wait on the front end
+        self.in_flight = asyncio.Semaphore(2 * self.workers)
+
+    async def serve(self, socket_path):
+        """Serves queries on socket_path until SIGINT or SIGTERM."""
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                    initargs=(self.meshes,)) as pool:
+            batcher = asyncio.ensure_future(self._batch(pool))
+            server = await asyncio.start_unix_server(self._connection, socket_path)
+            batcher.add_done_callback(lambda batcher: self._batcher_done(batcher, server))
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, server.close)
+            try:
+                async with server:
+                    await server.serve_forever()
+            except asyncio.CancelledError:
+                pass    # closed by a signal
+            finally:
+                batcher.cancel()
+                if os.path.exists(socket_path):
+                    os.unlink(socket_path)
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        return {'answered': self.answered, 'failed': self.failed, 'timed_out': self.timed_out,
+                'batches': self.batches, 'pending': self.queue.qsize()}
+
+    async def _connection(self, reader, writer):
+        replies = set()
+        lock = asyncio.Lock()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    query = self._query(request)
+                    if self.error is not None:
+                        raise ValueError("server is stopping: %s" % self.error)
+                except (ValueError, TypeError) as error:
+                    self.failed += 1
+                    await self._reply(writer, lock, {'id': _request_id(line), 'error': str(error)})
+                    continue
+                answer = asyncio.get_running_loop().create_future()
+                # a full queue blocks here, so this connection is not read further until it drains
+                await self.queue.put((query, answer))
+                reply = asyncio.ensure_future(self._answer(request.get('id'), answer, writer, lock))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+            if replies:
+                await asyncio.gather(*replies)
+        except ConnectionError:
+            pass
+        finally:
+            for reply in replies:
+                reply.cancel()
+            writer.close()
+
+    def _query(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        name = request.get('mesh')
+        if name is None:
+            if len(self.meshes) != 1:
+                raise ValueError("mesh is required when serving several meshes")
+            name = next(iter(self.meshes))
+        elif name not in self.meshes:
+            raise ValueError("unknown mesh %r" % name)
+        source, destination = request.get('source'), request.get('destination')
+        if not isinstance(source, list) or not isinstance(destination, list) or len(source) != 2 \
+                or len(destination) != 2:
+            raise ValueError("source and destination must be [x, y] points")
+        return name, (float(source[0]), float(source[1])), (float(destination[0]), float(destination[1]))
+
+    async def _answer(self, request_id, answer, writer, lock):
+        try:
+            path, boxes = await asyncio.wait_for(answer, self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            reply = {'id': request_id, 'error': "timed out after %g s" % self.timeout}
+        except Exception as error:
+            self.failed += 1
+            reply = {'id': request_id, 'error': str(error)}
+        else:
+            self.answered += 1
+            reply = {'id': request_id, 'path': path, 'boxes': boxes}
+            if not path:
+                reply['error'] = "no path"
+        await self._reply(writer, lock, reply)
+
+    async def _reply(self, writer, lock, reply):
+        async with lock:
+            writer.write(json.dumps(reply).encode() + b'\n')
+            await writer.drain()
+
+    async def _batch(self, pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            # queries whose caller already gave up are not worth computing
+            batch = [(query, answer) for query, answer in batch if not answer.done()]
+            if not batch:
+                continue
+            try:
+                await self.in_flight.acquire()
+            except asyncio.CancelledError:
+                _fail(batch, RuntimeError("server stopped"))
+                raise
+            try:
+                work = loop.run_in_executor(pool, _answer_batch, [query for query, _ in batch])
+            except Exception as error:
+                # the pool takes no more work, so neither does the server; see _batcher_done
+                self.in_flight.release()
+                _fail(batch, error)
+                raise
+            self.batches += 1
+            work.add_done_callback(lambda work, batch=batch: self._finish(work, batch))
+
+    def _finish(self, work, batch):
+        self.in_flight.release()
+        if work.cancelled():
+            _fail(batch, RuntimeError("query batch was cancelled"))
+            return
+        error = work.exception()
+        if error is not None:
+            _fail(batch, error)
+            return
+        for (_, answer), result in zip(batch, work.result()):
+            if not answer.done():
+                answer.set_result(result)
+
+    def _batcher_done(self, batcher, server):
+        # the batcher only returns by being cancelled at shutdown or by failing to
+        # submit work; after a failure, fail what is queued and stop serving
+        if batcher.cancelled() or batcher.exception() is None:
+            return
+        self.error = batcher.exception()
+        while not self.queue.empty():
+            _fail([self.queue.get_nowait()], self.error)
+        server.close()
+
+
+def _fail(batch, error):
+    for _, answer in batch:
+        if not answer.done():
+            answer.set_exception(error)
+
+
+def _request_id(line):
+    # the id of a request that failed to parse, if it can be recovered
+    try:
+        return json.loads(line).get('id')
+    except (ValueError, AttributeError):
+        return None
+
+
+# meshes of a server worker process, set once by _init_worker
+_worker_meshes = None
+
+def _init_worker(meshes):
+    global _worker_meshes
+    # the server shuts the pool down on SIGINT; workers should not die of it first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_meshes = {name: prepare_mesh(filename) for name, filename in meshes.items()}
+
+def _answer_batch(queries):
+    # find_path prints 'No Path Found!' for every miss; keep that out of the
+    # server's output, since _answer puts a "no path" error in the reply instead
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [nm_pathfinder.find_path(source, destination, _worker_meshes[name])
+                for name, source, destination in queries]
+
+
+def parse_meshes(specs):
+    """
+    Names mesh files given as name=filename, or as a bare filename named by its basename.
+    """
+    meshes = {}
+    for spec in specs:
+        name, _, filename = spec.rpartition('=')
+        meshes[name or os.path.basename(filename)] = filename
+    return meshes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serves find_path queries over a Unix domain socket")
+    parser.add_argument('socket', help="path of the Unix domain socket to listen on")
+    parser.add_argument('meshes', nargs='+', help="[name=].mesh.pickle or .navmesh files")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-pending', type=int, default=1024)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = QueryServer(parse_meshes(args.meshes), args.workers, args.batch_size, args.max_pending, args.timeout)
+    print("Serving %s on %s with %d workers" % (', '.join(server.meshes), args.socket, server.workers))
+    started = time.perf_counter()
+    asyncio.run(server.serve(args.socket))
+    print("Served for %.1f s: %s" % (time.perf_counter() - started, server.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Checks for nm_server. Run them with pytest from this directory, or as a
+script: python nm_server_test.py
+"""
+import asyncio
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+from nm_server import QueryServer
+
+
+class BrokenPool(concurrent.futures.Executor):
+    # a pool whose workers have died: it refuses every batch
+    def submit(self, fn, *args, **kwargs):
+        raise BrokenProcessPool("a worker died")
+
+
+class Listener:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def query(server, name='slug'):
+    answer = asyncio.get_running_loop().create_future()
+    server.queue.put_nowait(((name, (1., 1.), (2., 2.)), answer))
+    return answer
+
+
+def test_broken_pool_fails_queries_and_stops_the_server():
+    async def scenario():
+        server = QueryServer({'slug': 'unused.navmesh'}, workers=1, batch_size=2)
+        listener = Listener()
+        answers = [query(server) for _ in range(5)]
+        batcher = asyncio.ensure_future(server._batch(BrokenPool()))
+        batcher.add_done_callback(lambda batcher: server._batcher_done(batcher, listener))
+        results = await asyncio.wait_for(asyncio.gather(*answers, return_exceptions=True), 1)
+        await asyncio.sleep(0)
+        assert all(isinstance(result, BrokenProcessPool) for result in results), results
+        assert isinstance(server.error, BrokenProcessPool) and listener.closed
+        # the slot of the batch that could not be submitted was given back
+        assert not server.in_flight.locked() and server.in_flight._value == 2 * server.workers
+        assert server.batches == 0 and server.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_batch_fails_its_queries():
+    async def scenario():
+        server = QueryServer({'slug': 'unused.navmesh'}, workers=1)
+        answers = [query(server) for _ in range(3)]
+        batch = [server.queue.get_nowait() for _ in answers]
+        await server.in_flight.acquire()
+        work = asyncio.get_running_loop().create_future()
+        work.cancel()
+        server._finish(work, batch)
+        results = await asyncio.wait_for(asyncio.gather(*answers, return_exceptions=True), 1)
+        assert all(isinstance(result, RuntimeError) for result in results), results
+        assert server.in_flight._value == 2 * server.workers
+
+    asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("%s ok" % name)